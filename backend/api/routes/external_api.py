@@ -22,7 +22,10 @@ import traceback
 from db.session import get_session
 from models import Projects, Folders, Assets
 from dependencies.api_key_middleware import verify_api_key
-from services.search.embeddings_service import search
+from dependencies.inference_executor import run_in_inference_pool, decode_image
+from starlette.concurrency import run_in_threadpool
+from dependencies.embedding_cache import encode_image_bytes_cached
+from services.search.embeddings_service import search, search_batch, search_similar_to_asset, embed_image
 from utils.slug import create_slug
 from utils.path_builder import build_full_path, build_file_url
 from core.config import settings
@@ -32,7 +35,7 @@ from utils.filename_utils import truncate_filename, split_filename, sanitize_fil
 from utils.folder_finder import find_folder_by_path
 
 from db.crud_thumbnail import generate_thumbnail_urls_for_file
-from api.routes.search import validate_project_ownership
+from api.routes.search import validate_project_ownership, read_batch_queries, format_batch_results
 
 router = APIRouter(prefix="/external", tags=["External API"])
 
@@ -347,12 +350,13 @@ async def upload_assets(
             file_bytes = await file.read()
             size = len(file_bytes)
 
-            # lấy dimension nếu là ảnh
+            # Decode ảnh 1 lần: lấy dimension, rồi dùng cho embedding
             width = height = None
+            image = None
             if file.content_type.startswith("image/"):
                 try:
-                    with Image.open(io.BytesIO(file_bytes)) as im:
-                        width, height = im.size
+                    image = await run_in_inference_pool(decode_image, file_bytes)
+                    width, height = image.size
                 except Exception:
                     raise HTTPException(400, f"Ảnh {file.filename} không hợp lệ")
 
@@ -424,10 +428,12 @@ async def upload_assets(
                 # Chỉ tạo embedding nếu là file IMAGE (không phải video)
                 if file.content_type.startswith("image/"):
                     try:
-                        embedding = create_embedding_for_asset(
+                        image_vector = await run_in_inference_pool(embed_image, image)
+                        embedding = await run_in_threadpool(
+                            create_embedding_for_asset,
                             session=session,
                             asset_id=asset_id,
-                            image_bytes=file_bytes
+                            embedding_vector=image_vector
                         )
                         if embedding:
                             print(f"✅ Created embedding for asset {asset_id}")
@@ -689,6 +695,7 @@ async def search_by_image_upload_or_text(
     query_text: Optional[str] = Form(None),  # Query text
     file: UploadFile = File(None),
     folder_id: Optional[int] = Form(None),
+    include_subfolders: bool = Form(False),  # Tìm cả trong các folder con của folder_id
     k: int = Form(20),
     similarity_threshold: float = Form(0.7),  # Ngưỡng similarity (0.7 = 70% giống nhau)
     session: Session = Depends(get_session),
@@ -701,6 +708,7 @@ async def search_by_image_upload_or_text(
         file: File ảnh upload
         project_id: (Optional) ID của project cần tìm. Nếu None thì search tất cả projects của user
         folder_id: (Optional) Chỉ tìm trong folder này
+        include_subfolders: Tìm trong folder_id và toàn bộ folder con
         k: Số lượng kết quả trả về (default: 10)
     
     Returns:
@@ -715,15 +723,16 @@ async def search_by_image_upload_or_text(
         if project:
             validate_project_ownership(session, project.id, project.user_id)
         
-        # Đọc ảnh
-        query_image = None
+        # Đọc ảnh + CLIP trong inference pool (ảnh đã search trước đó lấy từ cache)
+        query_image_vector = None
         if (file):
             content = await file.read()
-            query_image = Image.open(io.BytesIO(content)).convert("RGB")
+            query_image_vector = await run_in_inference_pool(encode_image_bytes_cached, content)
              
-        # Tìm kiếm
-        assets = search(session=session, project_id=project.id, query_text = query_text, query_image = query_image, k=k,
+        # Tìm kiếm (FAISS / DB trong threadpool, inference pool chỉ dành cho CLIP)
+        assets = await run_in_threadpool(search, session=session, project_id=project.id, query_text = query_text, query_image_vector = query_image_vector, k=k,
             folder_id=folder_id,
+            include_subfolders=include_subfolders,
             user_id=project.user_id,
             similarity_threshold=similarity_threshold)
         return {"status": 1, "data": assets}
@@ -731,3 +740,87 @@ async def search_by_image_upload_or_text(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
+
+@router.post("/similar")
+def search_more_like_this(
+    asset_id: int = Form(...),
+    folder_id: Optional[int] = Form(None),
+    include_subfolders: bool = Form(False),
+    k: int = Form(20),
+    similarity_threshold: float = Form(0.7),
+    session: Session = Depends(get_session),
+    project: Projects = Depends(verify_api_key),
+):
+    """
+    "More like this": tìm ảnh giống 1 asset trong project của API key, dùng
+    vector đã có của asset (không upload lại ảnh, không chạy CLIP).
+    
+    Returns:
+        {
+            "status": 1,
+            "data": [...assets...]
+        }
+    """
+    asset = session.get(Assets, asset_id)
+    if not asset or asset.project_id != project.id:
+        raise HTTPException(status_code=404, detail="Asset không tồn tại")
+
+    try:
+        assets = search_similar_to_asset(
+            session=session,
+            asset_id=asset_id,
+            project_id=project.id,
+            k=k,
+            folder_id=folder_id,
+            user_id=project.user_id,
+            similarity_threshold=similarity_threshold,
+            include_subfolders=include_subfolders
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+    return {"status": 1, "data": assets}
+
+
+@router.post("/image/batch")
+async def search_batch_queries(
+    query_texts: Optional[List[str]] = Form(None),  # Nhiều text query
+    files: Optional[List[UploadFile]] = File(None),  # Nhiều ảnh query
+    folder_id: Optional[int] = Form(None),
+    include_subfolders: bool = Form(False),
+    k: int = Form(20),
+    similarity_threshold: float = Form(0.7),
+    session: Session = Depends(get_session),
+    project: Projects = Depends(verify_api_key),
+):
+    """
+    Tìm kiếm nhiều query (text và/hoặc ảnh) trong project của API key.
+    Query được encode theo batch và search bằng 1 lần FAISS search.
+    
+    Returns:
+        {
+            "status": 1,
+            "data": [{"query_index": 0, "query_type": "text", "query_text": "...", "data": [...]}, ...]
+        }
+    """
+    query_texts, query_images = await read_batch_queries(query_texts, files)
+
+    try:
+        results = await run_in_threadpool(
+            search_batch,
+            session=session,
+            project_id=project.id,
+            query_texts=query_texts,
+            query_images=query_images,
+            k=k,
+            folder_id=folder_id,
+            user_id=project.user_id,
+            similarity_threshold=similarity_threshold,
+            include_subfolders=include_subfolders
+        )
+        return {"status": 1, "data": format_batch_results(query_texts, results)}
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch search failed: {str(e)}")
+
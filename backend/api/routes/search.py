@@ -4,23 +4,34 @@ Search API Routes - Image & Text Search
 Endpoints:
 - POST /search/image - Tìm kiếm bằng ảnh
 - POST /search/text - Tìm kiếm bằng text
+- POST /search/batch - Tìm kiếm nhiều query (text/ảnh) trong 1 request
+- POST /search/range - Tất cả assets trên ngưỡng similarity (phân trang)
 - POST /search/rebuild - Rebuild FAISS index cho project
+- POST /search/reconcile - Đồng bộ FAISS index với database (chỉ phần khác biệt)
+- POST /search/compression - Cấu hình lưu vector dạng nén cho project
 """
 
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
 from sqlmodel import Session, select
 from PIL import Image
-import io
-from typing import Optional
+from typing import List, Optional
 
 from db.session import get_session
 from dependencies.dependencies import get_current_user
+from dependencies.clip_batcher import get_batcher_stats
+from dependencies.embedding_cache import get_cache_stats, encode_image_bytes_cached
+from dependencies.model_warmup import get_warmup_state
+from dependencies.inference_executor import run_in_inference_pool, decode_image
+from starlette.concurrency import run_in_threadpool
 from services.search.embeddings_service import (
-rebuild_project_embeddings,search
+rebuild_project_embeddings, reconcile_project_embeddings, search, search_batch, search_range,
+search_similar_to_asset, get_embedding_models
 )
-from services.search.faiss_index import get_project_stats
+from services.search.vector_client import get_project_stats, set_project_compression
+from services.search.faiss_policy import COMPRESSION_MODES
 from models.projects import Projects
 from models.folders import Folders
+from models.assets import Assets
 from utils.path_builder import build_file_url, build_full_path
 from core.config import settings
 
@@ -97,8 +108,11 @@ async def search_by_image_upload_or_text(
     file: UploadFile = File(None),
     project_id: Optional[int] = Form(None),  # Optional - nếu None thì search tất cả projects của user
     folder_id: Optional[int] = Form(None),
+    include_subfolders: bool = Form(False),  # Tìm cả trong các folder con của folder_id
     k: int = Form(20),
     similarity_threshold: float = Form(0.7),  # Ngưỡng similarity (0.7 = 70% giống nhau)
+    nprobe: Optional[int] = Form(None),  # IVF index: số cluster quét
+    ef_search: Optional[int] = Form(None),  # HNSW index: efSearch
     session: Session = Depends(get_session),
     current_user: dict = Depends(get_current_user)
 ):
@@ -109,7 +123,9 @@ async def search_by_image_upload_or_text(
         file: File ảnh upload
         project_id: (Optional) ID của project cần tìm. Nếu None thì search tất cả projects của user
         folder_id: (Optional) Chỉ tìm trong folder này
+        include_subfolders: Tìm trong folder_id và toàn bộ folder con
         k: Số lượng kết quả trả về (default: 10)
+        nprobe / ef_search: (Optional) Tinh chỉnh recall/latency cho index IVF / HNSW
     
     Returns:
         {
@@ -123,22 +139,250 @@ async def search_by_image_upload_or_text(
         if project_id:
             validate_project_ownership(session, project_id, current_user.id)
         
-        # Đọc ảnh
-        query_image = None
+        # Đọc ảnh + CLIP trong inference pool (ảnh đã search trước đó lấy từ cache)
+        query_image_vector = None
         if (file):
             content = await file.read()
-            query_image = Image.open(io.BytesIO(content)).convert("RGB")
+            query_image_vector = await run_in_inference_pool(encode_image_bytes_cached, content)
         
-        # Tìm kiếm
-        assets = search(session=session, project_id=project_id, query_text = query_text, query_image = query_image, k=k,
+        # Tìm kiếm (FAISS / DB trong threadpool, inference pool chỉ dành cho CLIP)
+        assets = await run_in_threadpool(search, session=session, project_id=project_id, query_text = query_text, query_image_vector = query_image_vector, k=k,
             folder_id=folder_id,
+            include_subfolders=include_subfolders,
             user_id=current_user.id,
-            similarity_threshold=similarity_threshold)
+            similarity_threshold=similarity_threshold,
+            nprobe=nprobe,
+            ef_search=ef_search)
         return {"status": 1, "data": assets}
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
+@router.post("/similar")
+def search_more_like_this(
+    asset_id: int = Form(...),
+    project_id: Optional[int] = Form(None),  # Optional - nếu None thì search tất cả projects của user
+    folder_id: Optional[int] = Form(None),
+    include_subfolders: bool = Form(False),
+    k: int = Form(20),
+    similarity_threshold: float = Form(0.7),
+    nprobe: Optional[int] = Form(None),
+    ef_search: Optional[int] = Form(None),
+    session: Session = Depends(get_session),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    "More like this": tìm ảnh giống 1 asset đã upload.
+    
+    Dùng vector đã có của asset (FAISS index / bảng Embeddings), không cần
+    upload lại ảnh và không chạy CLIP. Kết quả không gồm chính asset đó.
+    
+    Returns:
+        {
+            "status": 1,
+            "data": [...assets...]
+        }
+    """
+    # 🔒 SECURITY: Asset và project (nếu có) phải thuộc về user
+    asset = session.get(Assets, asset_id)
+    if not asset:
+        raise HTTPException(status_code=404, detail="Asset không tồn tại")
+    validate_project_ownership(session, asset.project_id, current_user.id)
+    if project_id:
+        validate_project_ownership(session, project_id, current_user.id)
+
+    try:
+        assets = search_similar_to_asset(
+            session=session,
+            asset_id=asset_id,
+            project_id=project_id,
+            k=k,
+            folder_id=folder_id,
+            user_id=current_user.id,
+            similarity_threshold=similarity_threshold,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            include_subfolders=include_subfolders
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+    return {"status": 1, "data": assets}
+
+
+async def read_batch_queries(
+    query_texts: Optional[List[str]],
+    files: Optional[List[UploadFile]]
+) -> tuple[list[str], list[Image.Image]]:
+    """
+    Đọc + kiểm tra các query của batch search (text và ảnh upload).
+    """
+    query_texts = [text for text in (query_texts or []) if text and text.strip()]
+    files = [f for f in (files or []) if f and f.filename]
+    total = len(query_texts) + len(files)
+    if total == 0:
+        raise HTTPException(status_code=400, detail="Cần ít nhất 1 query_texts hoặc files")
+    if total > settings.SEARCH_BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Tối đa {settings.SEARCH_BATCH_MAX_QUERIES} queries mỗi request"
+        )
+
+    query_images = []
+    for f in files:
+        content = await f.read()
+        query_images.append(await run_in_inference_pool(decode_image, content))
+    return query_texts, query_images
+
+
+def format_batch_results(query_texts: list[str], results: list) -> list[dict]:
+    """
+    Kết quả batch search: mỗi query 1 phần tử (thứ tự: query_texts rồi files),
+    mỗi asset kèm similarity.
+    """
+    formatted = []
+    for i, rows in enumerate(results):
+        is_text = i < len(query_texts)
+        formatted.append({
+            "query_index": i,
+            "query_type": "text" if is_text else "image",
+            "query_text": query_texts[i] if is_text else None,
+            "data": [{**asset.dict(), "similarity": round(score, 4)} for asset, score in rows],
+        })
+    return formatted
+
+
+@router.post("/batch")
+async def search_batch_queries(
+    query_texts: Optional[List[str]] = Form(None),  # Nhiều text query
+    files: Optional[List[UploadFile]] = File(None),  # Nhiều ảnh query
+    project_id: Optional[int] = Form(None),  # Optional - nếu None thì search tất cả projects của user
+    folder_id: Optional[int] = Form(None),
+    include_subfolders: bool = Form(False),
+    k: int = Form(20),
+    similarity_threshold: float = Form(0.7),
+    nprobe: Optional[int] = Form(None),
+    ef_search: Optional[int] = Form(None),
+    session: Session = Depends(get_session),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Tìm kiếm nhiều query (text và/hoặc ảnh) trong 1 request.
+    
+    Tất cả query được encode bằng CLIP theo batch và search bằng 1 lần
+    FAISS search trên ma trận query, nhanh hơn nhiều so với gọi /search/image
+    từng query.
+    
+    Returns:
+        {
+            "status": 1,
+            "data": [
+                {"query_index": 0, "query_type": "text", "query_text": "...", "data": [...assets + similarity...]},
+                ...
+            ]
+        }
+    """
+    # 🔒 SECURITY: Validate project ownership (nếu có project_id)
+    if project_id:
+        validate_project_ownership(session, project_id, current_user.id)
+
+    query_texts, query_images = await read_batch_queries(query_texts, files)
+
+    try:
+        results = await run_in_threadpool(
+            search_batch,
+            session=session,
+            project_id=project_id,
+            query_texts=query_texts,
+            query_images=query_images,
+            k=k,
+            folder_id=folder_id,
+            user_id=current_user.id,
+            similarity_threshold=similarity_threshold,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            include_subfolders=include_subfolders
+        )
+        return {"status": 1, "data": format_batch_results(query_texts, results)}
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch search failed: {str(e)}")
+
+
+@router.post("/range")
+async def search_by_similarity_range(
+    query_text: Optional[str] = Form(None),
+    file: UploadFile = File(None),
+    project_id: Optional[int] = Form(None),  # Optional - nếu None thì search tất cả projects của user
+    folder_id: Optional[int] = Form(None),
+    include_subfolders: bool = Form(False),
+    similarity_threshold: float = Form(0.7),  # Lấy tất cả kết quả có similarity >= ngưỡng
+    offset: int = Form(0),
+    limit: int = Form(50),
+    nprobe: Optional[int] = Form(None),
+    ef_search: Optional[int] = Form(None),
+    session: Session = Depends(get_session),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Tìm tất cả ảnh có similarity >= similarity_threshold ("mọi ảnh giống ảnh này"),
+    không cần chọn k. Kết quả sắp xếp theo similarity giảm dần và phân trang.
+    
+    Lưu ý: ngưỡng được dùng đúng như truyền vào, text query thường cần ngưỡng
+    thấp (~0.2-0.3).
+    
+    Returns:
+        {
+            "status": 1,
+            "data": [...assets + similarity...],
+            "total": <tổng số kết quả trên ngưỡng>,
+            "offset": 0,
+            "limit": 50
+        }
+    """
+    # 🔒 SECURITY: Validate project ownership (nếu có project_id)
+    if project_id:
+        validate_project_ownership(session, project_id, current_user.id)
+
+    if not query_text and not file:
+        raise HTTPException(status_code=400, detail="Cần query_text hoặc file")
+    if offset < 0 or limit <= 0:
+        raise HTTPException(status_code=400, detail="offset phải >= 0 và limit > 0")
+
+    try:
+        query_image_vector = None
+        if file:
+            content = await file.read()
+            query_image_vector = await run_in_inference_pool(encode_image_bytes_cached, content)
+
+        page, total = await run_in_threadpool(
+            search_range,
+            session=session,
+            project_id=project_id,
+            similarity_threshold=similarity_threshold,
+            query_text=query_text,
+            query_image_vector=query_image_vector,
+            offset=offset,
+            limit=limit,
+            folder_id=folder_id,
+            user_id=current_user.id,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            include_subfolders=include_subfolders
+        )
+        return {
+            "status": 1,
+            "data": [{**asset.dict(), "similarity": round(score, 4)} for asset, score in page],
+            "total": total,
+            "offset": offset,
+            "limit": limit
+        }
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Range search failed: {str(e)}")
+
+
 @router.post("/rebuild")
 def rebuild_project_index(
     project_id: int = Form(...),
@@ -168,7 +412,7 @@ def rebuild_project_index(
         validate_project_ownership(session, project_id, current_user.id)
         
         # Rebuild index
-        rebuild_project_embeddings(session, project_id)
+        report = rebuild_project_embeddings(session, project_id)
         
         # Get stats
         stats = get_project_stats(project_id)
@@ -176,7 +420,8 @@ def rebuild_project_index(
         return {
             "status": 1,
             "message": f"Project {project_id} index rebuilt successfully",
-            "stats": stats
+            "stats": stats,
+            "rebuild": report
         }
         
     except Exception as e:
@@ -246,6 +491,118 @@ def rebuild_all_projects_index(
         raise HTTPException(status_code=500, detail=f"Rebuild failed: {str(e)}")
 
 
+@router.post("/reconcile")
+def reconcile_project_index(
+    project_id: int = Form(...),
+    session: Session = Depends(get_session),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Đồng bộ FAISS index của project với database: thêm asset thiếu, xóa
+    asset không còn trong DB, cập nhật folder. Nhanh hơn rebuild khi index
+    chỉ lệch một phần (sau crash, restore database...).
+    
+    Returns:
+        {
+            "status": 1,
+            "changes": {"added", "removed", "moved", ...},
+            "stats": {...}
+        }
+    """
+    try:
+        # 🔒 SECURITY: Validate project ownership
+        validate_project_ownership(session, project_id, current_user.id)
+        
+        changes = reconcile_project_embeddings(session, project_id)
+        
+        return {
+            "status": 1,
+            "message": f"Project {project_id} index reconciled",
+            "changes": changes,
+            "stats": get_project_stats(project_id)
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reconcile failed: {str(e)}")
+
+
+@router.get("/reconcile-all")
+def reconcile_all_projects_index(
+    session: Session = Depends(get_session),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Đồng bộ FAISS index với database cho tất cả projects của user
+    (thay cho /rebuild-all khi chỉ cần sửa phần lệch).
+    """
+    user_projects = session.exec(
+        select(Projects).where(Projects.user_id == current_user.id)
+    ).all()
+    
+    results = []
+    for project in user_projects:
+        try:
+            results.append({
+                "project_id": project.id,
+                "name": project.name,
+                "status": "success",
+                "changes": reconcile_project_embeddings(session, project.id)
+            })
+        except Exception as e:
+            results.append({
+                "project_id": project.id,
+                "name": project.name,
+                "status": "error",
+                "error": str(e)
+            })
+    
+    return {
+        "status": 1,
+        "message": "All indexes reconciled",
+        "projects": results
+    }
+
+
+@router.post("/compression")
+def set_compression(
+    project_id: int = Form(...),
+    mode: str = Form(...),
+    session: Session = Depends(get_session),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Cấu hình kiểu lưu vector trong FAISS index của project.
+    
+    Modes:
+    - none: float32 (chính xác, tốn RAM nhất)
+    - fp16: 2x nhỏ hơn
+    - int8: 4x nhỏ hơn
+    - pq: IVF-PQ cho project rất lớn (tới 32x), project chưa lên IVF dùng int8
+    
+    Index được build lại ở background (chỉ khi project có từ
+    FAISS_COMPRESSION_MIN_VECTORS vectors); kết quả search được re-rank bằng
+    vector gốc nên độ chính xác top k gần như không đổi.
+    """
+    # 🔒 SECURITY: Validate project ownership
+    validate_project_ownership(session, project_id, current_user.id)
+    
+    if mode not in COMPRESSION_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"mode must be one of: {', '.join(COMPRESSION_MODES)}"
+        )
+    
+    set_project_compression(project_id, mode)
+    
+    return {
+        "status": 1,
+        "message": f"Project {project_id} compression set to {mode}",
+        "stats": get_project_stats(project_id)
+    }
+
+
 @router.get("/stats/{project_id}")
 def get_search_stats(
     project_id: int,
@@ -260,7 +617,11 @@ def get_search_stats(
             "project_id": <id>,
             "total_vectors": <số lượng vectors>,
             "indexed": true/false,
-            "dimension": 512
+            "dimension": 512,
+            "index_type": "flat" | "ivf_flat" | "hnsw",
+            "compression": "none" | "fp16" | "int8" | "pq",
+            "embedding_models": {"current", "models": {<model+backend>: <count>}, "legacy", "mixed"},
+            ...
         }
     """
     # 🔒 SECURITY: Validate project ownership
@@ -268,5 +629,25 @@ def get_search_stats(
     
     stats = get_project_stats(project_id)
     stats["project_id"] = project_id
+    stats["embedding_models"] = get_embedding_models(session, project_id)
     
     return stats
+
+
+@router.get("/inference-stats")
+def get_inference_stats(current_user: dict = Depends(get_current_user)):
+    """
+    Thống kê CLIP inference của worker này.
+    
+    Returns:
+        {
+            "batching": {
+                "enabled": true,
+                "image": {"queue_depth", "batches", "requests", "items", "avg_batch_size", "max_batch_size", "batch_sizes", ...},
+                "text": {...}
+            },
+            "cache": {"text": {"size", "max_size", "hits", "misses", "hit_rate"}, "image": {...}},
+            "model": {"status", "ready", "load_seconds", "warmup_seconds", "labels_seconds", "total_seconds", ...}
+        }
+    """
+    return {"batching": get_batcher_stats(), "cache": get_cache_stats(), "model": get_warmup_state()}
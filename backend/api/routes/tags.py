@@ -12,6 +12,7 @@ from sqlmodel import Session, select
 
 from db.session import get_session
 from dependencies.dependencies import get_current_user
+from dependencies.inference_executor import run_in_inference_pool, decode_image
 from db.crud_tag import (
     get_or_create_tag,
     add_tag_to_asset,
@@ -348,10 +349,10 @@ async def auto_tag_upload_image(
     try:
         # Đọc file
         contents = await file.read()
-        image = Image.open(io.BytesIO(contents)).convert("RGB")
+        image = await run_in_inference_pool(decode_image, contents)
         
-        # Get predicted tags
-        predicted_tags = get_image_tags(image, threshold=threshold, top_k=top_k)
+        # Get predicted tags (CLIP trong inference pool, không chặn event loop)
+        predicted_tags = await run_in_inference_pool(get_image_tags, image, threshold=threshold, top_k=top_k)
         
         return {
             "filename": file.filename,
@@ -15,8 +15,11 @@ from datetime import datetime
 from db.session import get_session
 from models import  Projects, Folders, Assets , Users
 from dependencies.dependencies import get_current_user
+from dependencies.inference_executor import run_in_inference_pool, decode_image
+from starlette.concurrency import run_in_threadpool
 from db.crud_asset import add_asset,  sort_type, display_order, update, delete
 from db.crud_embedding import create_embedding_for_asset
+from services.search.embeddings_service import embed_image
 from db.crud_thumbnail import generate_thumbnail_urls_for_file
 
 from utils.path_builder import build_full_path, build_file_url
@@ -308,12 +311,13 @@ async def upload_assets(
             file_bytes = await file.read()
             size = len(file_bytes)
 
-            # lấy dimension nếu là ảnh
+            # Decode ảnh 1 lần: lấy dimension, rồi dùng cho cả embedding và auto-tag
             width = height = None
+            image = None
             if file.content_type.startswith("image/"):
                 try:
-                    with Image.open(io.BytesIO(file_bytes)) as im:
-                        width, height = im.size
+                    image = await run_in_inference_pool(decode_image, file_bytes)
+                    width, height = image.size
                     
                 except Exception:
                     raise HTTPException(400, f"Ảnh {file.filename} không hợp lệ")
@@ -391,11 +395,15 @@ async def upload_assets(
                 # 🔥 TỰ ĐỘNG TẠO EMBEDDING cho ảnh
                 # Chỉ tạo embedding nếu là file IMAGE (không phải video)
                 if file.content_type.startswith("image/"):
+                    # 1 lần CLIP cho cả embedding và auto-tag
+                    image_vector = None
                     try:
-                        embedding = create_embedding_for_asset(
+                        image_vector = await run_in_inference_pool(embed_image, image)
+                        embedding = await run_in_threadpool(
+                            create_embedding_for_asset,
                             session=session,
                             asset_id=asset_id,
-                            image_bytes=file_bytes
+                            embedding_vector=image_vector
                         )
                         if embedding:
                             print(f"✅ Created embedding for asset {asset_id}")
@@ -410,12 +418,14 @@ async def upload_assets(
                     auto_tags = []  # Store tags for response
                     try:
                         from services.tagging_service import auto_tag_asset
-                        # Open image từ bytes
-                        image_for_tagging = Image.open(io.BytesIO(file_bytes)).convert("RGB")
-                        tags = auto_tag_asset(
+                        # Dùng lại vector vừa tạo (không decode / encode lại)
+                        if image_vector is None:
+                            raise ValueError("no image embedding")
+                        tags = await run_in_threadpool(
+                            auto_tag_asset,
                             session=session,
                             asset_id=asset_id,
-                            image=image_for_tagging,
+                            image_features=image_vector,
                             threshold=0.25,  # Cosine similarity threshold (0-1)
                             top_k=3  # Tăng lên 3 tags
                         )
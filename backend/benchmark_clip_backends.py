@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Benchmark các inference backend của CLIP (fp32 / int8)
+
+Encode cùng 1 tập ảnh mẫu + 1 tập text query bằng từng backend rồi so với
+fp32:
+- Thời gian tải model, kích thước state_dict
+- Latency mỗi batch (p50 / p95) và throughput (item/s) của image / text encoder
+- Cosine giữa vector của backend và vector fp32 (mean / p5 / min)
+- Top-k agreement: với mỗi text query, tỉ lệ top-k ảnh trùng với top-k của fp32
+
+Chạy trong thư mục backend (cần các biến môi trường của core.config):
+    python benchmark_clip_backends.py --images ./uploads --limit 200 --batch-size 16
+"""
+
+import argparse
+import io
+import json
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+import torch
+import clip
+from PIL import Image
+
+from dependencies.clip_service import INFERENCE_BACKENDS, load_clip_model
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+DEFAULT_QUERIES = [
+    "a photo of a cat", "a photo of a dog", "a beach at sunset", "a city street at night",
+    "a group of people smiling", "a plate of food", "a mountain landscape", "a car on the road",
+    "a child playing", "flowers in a garden", "a document with text", "a selfie",
+]
+
+
+def load_images(folder: str, limit: int) -> List[Image.Image]:
+    images = []
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            try:
+                images.append(Image.open(os.path.join(root, name)).convert("RGB"))
+            except Exception as e:
+                print(f"Skip {name}: {e}")
+            if len(images) >= limit:
+                return images
+    return images
+
+
+def state_dict_mb(model) -> float:
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return round(buffer.tell() / 1024 / 1024, 1)
+
+
+def percentile_ms(seconds: List[float], q: float) -> float:
+    return round(float(np.percentile(seconds, q)) * 1000, 2)
+
+
+def run_encoder(encode, inputs: torch.Tensor, batch_size: int, runs: int):
+    """Encode inputs theo batch, lặp runs lần. Trả về (vectors đã normalize, latency từng batch)."""
+    latencies = []
+    vectors = None
+    with torch.no_grad():
+        encode(inputs[:batch_size])  # warmup
+        for _ in range(runs):
+            outputs = []
+            for i in range(0, len(inputs), batch_size):
+                start = time.perf_counter()
+                features = encode(inputs[i:i + batch_size])
+                latencies.append(time.perf_counter() - start)
+                outputs.append(features.float())
+            vectors = torch.cat(outputs)
+    vectors /= vectors.norm(dim=-1, keepdim=True)
+    return vectors.cpu().numpy().astype("float32"), latencies
+
+
+def timing_report(latencies: List[float], items: int, runs: int) -> dict:
+    return {
+        "p50_ms": percentile_ms(latencies, 50),
+        "p95_ms": percentile_ms(latencies, 95),
+        "items_per_s": round(items * runs / sum(latencies), 1),
+    }
+
+
+def drift_report(baseline: np.ndarray, vectors: np.ndarray) -> dict:
+    cosine = np.sum(baseline * vectors, axis=1)
+    return {
+        "cosine_mean": round(float(cosine.mean()), 5),
+        "cosine_p5": round(float(np.percentile(cosine, 5)), 5),
+        "cosine_min": round(float(cosine.min()), 5),
+    }
+
+
+def topk_agreement(base_text: np.ndarray, base_image: np.ndarray, text: np.ndarray, image: np.ndarray, k: int) -> float:
+    k = min(k, len(base_image))
+    base_top = np.argsort(-(base_text @ base_image.T), axis=1)[:, :k]
+    top = np.argsort(-(text @ image.T), axis=1)[:, :k]
+    overlap = [len(set(a.tolist()) & set(b.tolist())) / k for a, b in zip(base_top, top)]
+    return round(float(np.mean(overlap)), 4)
+
+
+def benchmark_backend(backend: str, images: List[Image.Image], queries: List[str], batch_size: int, runs: int) -> Dict:
+    start = time.perf_counter()
+    model, preprocess, device = load_clip_model(backend)
+    load_seconds = time.perf_counter() - start
+
+    pixels = torch.stack([preprocess(image) for image in images]).to(device)
+    tokens = clip.tokenize(queries, truncate=True).to(device)
+
+    image_vectors, image_latencies = run_encoder(model.encode_image, pixels, batch_size, runs)
+    text_vectors, text_latencies = run_encoder(model.encode_text, tokens, batch_size, runs)
+
+    return {
+        "backend": backend,
+        "device": device,
+        "load_seconds": round(load_seconds, 2),
+        "state_dict_mb": state_dict_mb(model),
+        "image": timing_report(image_latencies, len(images), runs),
+        "text": timing_report(text_latencies, len(queries), runs),
+        "_image_vectors": image_vectors,
+        "_text_vectors": text_vectors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CLIP inference backends (latency, throughput, drift vs fp32)")
+    parser.add_argument("--images", required=True, help="Thư mục ảnh mẫu (đọc đệ quy)")
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--backends", default=",".join(INFERENCE_BACKENDS))
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=0, help="torch.set_num_threads (0 = mặc định)")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    images = load_images(args.images, args.limit)
+    if not images:
+        raise SystemExit(f"No images found in {args.images}")
+    backends = [backend.strip() for backend in args.backends.split(",") if backend.strip()]
+    if "fp32" not in backends:
+        backends.insert(0, "fp32")  # baseline
+    backends.sort(key=lambda backend: backend != "fp32")
+    print(f"{len(images)} images, {len(DEFAULT_QUERIES)} queries, batch {args.batch_size}, {args.runs} runs, torch threads {torch.get_num_threads()}")
+
+    results = []
+    for backend in backends:
+        print(f"\n=== {backend} ===")
+        result = benchmark_backend(backend, images, DEFAULT_QUERIES, args.batch_size, args.runs)
+        results.append(result)
+        print(f"load {result['load_seconds']}s, state_dict {result['state_dict_mb']} MB ({result['device']})")
+        for kind in ("image", "text"):
+            timing = result[kind]
+            print(f"{kind:>5}: p50 {timing['p50_ms']} ms, p95 {timing['p95_ms']} ms / batch, {timing['items_per_s']} items/s")
+
+    baseline = results[0]
+    print()
+    for result in results[1:]:
+        result["image_drift"] = drift_report(baseline["_image_vectors"], result["_image_vectors"])
+        result["text_drift"] = drift_report(baseline["_text_vectors"], result["_text_vectors"])
+        result["topk_agreement"] = topk_agreement(
+            baseline["_text_vectors"], baseline["_image_vectors"],
+            result["_text_vectors"], result["_image_vectors"], args.top_k
+        )
+        speedup = result["image"]["items_per_s"] / baseline["image"]["items_per_s"]
+        print(
+            f"{result['backend']} vs fp32: image x{speedup:.2f} throughput, "
+            f"image cosine mean {result['image_drift']['cosine_mean']} (min {result['image_drift']['cosine_min']}), "
+            f"text cosine mean {result['text_drift']['cosine_mean']} (min {result['text_drift']['cosine_min']}), "
+            f"top-{args.top_k} agreement {result['topk_agreement']}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([{k: v for k, v in r.items() if not k.startswith("_")} for r in results], f, indent=2)
+        print(f"\nSaved {args.json}")
+
+
+if __name__ == "__main__":
+    main()
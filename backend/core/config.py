@@ -29,6 +29,76 @@ class Settings(BaseSettings):
     ADMIN_CLIENT_ID: str
     ADMIN_CLIENT_SECRET: str
     PERMANENT_DELETE_AFTER_DAYS: int = 30
+    
+    # FAISS persistence: gộp WAL vào snapshot sau N thao tác hoặc T giây
+    FAISS_CHECKPOINT_OPS: int = 1000
+    FAISS_CHECKPOINT_SECONDS: int = 60
+    FAISS_SNAPSHOT_KEEP: int = 2  # số version snapshot giữ lại mỗi project
+    FAISS_VERIFY_CHECKSUMS: bool = True  # kiểm tra sha256 trong manifest khi tải
+    FAISS_MEMORY_BUDGET_MB: int = 2048  # tổng RAM cho index mỗi worker (0 = không giới hạn)
+    FAISS_MMAP_LOAD: bool = True  # mmap vectors từ snapshot, chỉ copy vào RAM khi có thay đổi
+    FAISS_PRELOAD: bool = False  # tải trước toàn bộ index khi khởi động thay vì tải lười
+    
+    # FAISS index policy: flat cho project nhỏ, IVF/HNSW khi vượt ngưỡng (0 = tắt)
+    FAISS_IVF_MIN_VECTORS: int = 50000
+    FAISS_HNSW_MIN_VECTORS: int = 0
+    FAISS_RETRAIN_GROWTH_FACTOR: float = 2.0  # train lại IVF khi project lớn gấp N lần lúc train
+    FAISS_IVF_NPROBE: int = 16
+    FAISS_HNSW_M: int = 32
+    FAISS_HNSW_EF_CONSTRUCTION: int = 80
+    FAISS_HNSW_EF_SEARCH: int = 64
+    FAISS_COMPACT_DEAD_RATIO: float = 0.2  # build lại HNSW khi >= 20% vectors là tombstone (0 = tắt)
+    FAISS_FILTER_EXACT_MAX: int = 2048  # folder nhỏ hơn: search exact trên vectors của folder (IVF/HNSW)
+    FAISS_USER_COMPOSITE_INDEX: bool = False  # search mọi project của user bằng 1 index gộp
+    SEARCH_BATCH_MAX_QUERIES: int = 256  # số query tối đa mỗi request /search/batch
+    FAISS_RANGE_MAX_RESULTS: int = 10000  # range search: số kết quả tối đa (trước phân trang)
+    FAISS_RANGE_RERANK_MARGIN: float = 0.05  # index nén: hạ ngưỡng range search rồi lọc lại bằng score exact
+
+    # FAISS compression: none / fp16 / int8 / pq (mặc định cho project chưa cấu hình riêng)
+    FAISS_COMPRESSION: str = "none"
+    FAISS_COMPRESSION_MIN_VECTORS: int = 10000  # project nhỏ hơn giữ float32
+    FAISS_PQ_M: int = 64  # số sub-quantizer IVF-PQ (bytes/vector), phải chia hết 512
+    FAISS_RERANK_FACTOR: int = 4  # lấy k * N candidates từ index nén rồi re-rank bằng vector gốc
+
+    # Vector server (services/search/vector_server.py): rỗng = mỗi worker tự giữ index
+    VECTOR_SERVER_URL: str = ""
+    VECTOR_SERVER_TIMEOUT: float = 10.0  # giây
+
+    # Đồng bộ index giữa các replica dùng chung faiss_indices (Redis pub/sub, cùng Redis với Celery)
+    REDIS_URL: str = "redis://localhost:6379/0"
+    FAISS_SYNC_ENABLED: bool = False
+    FAISS_SYNC_CHANNEL: str = "photostore:faiss"
+    # URL vector server của writer: replica này chỉ đọc faiss_indices, mutation gửi sang writer
+    # (để rỗng trên writer; mỗi thư mục faiss_indices chỉ có 1 writer, giữ bằng file lock)
+    FAISS_WRITER_URL: str = ""
+
+    # CLIP model + cách lưu vector trong bảng Embeddings (services/search/embedding_codec.py)
+    CLIP_MODEL_NAME: str = "ViT-B/32"
+    CLIP_INFERENCE_BACKEND: str = "fp32"  # "fp32" | "int8" (dynamic quantization, CPU) - so sánh: benchmark_clip_backends.py
+    EMBEDDING_STORAGE_DTYPE: str = "float32"  # float32 / float16 (nhỏ gấp đôi, sai số ~1e-3)
+
+    # Gộp các request encode CLIP đồng thời thành 1 batch (dependencies/clip_batcher.py)
+    CLIP_BATCH_ENABLED: bool = True
+    CLIP_BATCH_MAX_SIZE: int = 32  # số ảnh / text tối đa mỗi lần forward
+    CLIP_BATCH_WAIT_MS: float = 5.0  # chờ thêm request tối đa N ms sau request đầu tiên
+
+    # Decode ảnh / CLIP của route async chạy trên thread pool riêng (dependencies/inference_executor.py)
+    INFERENCE_MAX_WORKERS: int = 4
+    TORCH_NUM_THREADS: int = 0  # intra-op threads mỗi lần forward (0 = mặc định của torch, = số core)
+    TORCH_INTEROP_THREADS: int = 0  # inter-op threads (0 = mặc định của torch)
+
+    # LRU cache text query -> vector (dependencies/embedding_cache.py), 0 = tắt
+    TEXT_EMBEDDING_CACHE_SIZE: int = 10000
+    IMAGE_EMBEDDING_CACHE_SIZE: int = 2000  # ảnh query, key = sha256 của file upload
+
+    # Tải + chạy thử CLIP lúc startup, GET /ready = 503 cho tới khi xong (dependencies/model_warmup.py)
+    CLIP_WARMUP_ON_STARTUP: bool = True
+    CLIP_WARMUP_BATCH_SIZE: int = 8
+
+    # CLIP server dùng chung cho mọi worker trên node (dependencies/clip_server.py), rỗng = tải model trong process
+    CLIP_SERVER_SOCKET: str = ""  # vd. /run/photostore/clip.sock
+    CLIP_SERVER_TIMEOUT: float = 60.0
+    CLIP_SERVER_WAIT_TIMEOUT: float = 600.0  # giây warmup chờ server ready (socket + tải model), quá hạn = failed
     @property
     def all_cors_origins(self) -> List[str]:
         """Parse CORS_ORIGINS string to list"""
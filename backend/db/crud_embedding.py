@@ -7,6 +7,7 @@ Helper functions để tạo/xóa embeddings khi upload/delete assets
 from sqlmodel import Session
 from PIL import Image
 import io
+import numpy as np
 from typing import Optional
 
 from models import Embeddings, Assets, Folders
@@ -20,10 +21,11 @@ from services.search.embeddings_service import (
 def create_embedding_for_asset(
     session: Session,
     asset_id: int,
-    image_bytes: bytes
+    image_bytes: Optional[bytes] = None,
+    embedding_vector: Optional[np.ndarray] = None
 ) -> Optional[Embeddings]:
     """
-    Tạo embedding cho asset từ image bytes.
+    Tạo embedding cho asset từ image bytes (hoặc vector đã encode sẵn).
     
     Tự động lấy project_id và folder_id từ asset.
     
@@ -31,6 +33,7 @@ def create_embedding_for_asset(
         session: Database session
         asset_id: ID của asset
         image_bytes: Bytes của ảnh
+        embedding_vector: Vector (512,) đã normalize, bỏ qua decode + CLIP
     
     Returns:
         Embeddings object hoặc None nếu không tạo được
@@ -48,11 +51,12 @@ def create_embedding_for_asset(
         return None
     
     try:
-        # Convert bytes to PIL Image
-        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-        
-        # Tạo embedding vector
-        embedding_vector = embed_image(image)
+        if embedding_vector is None:
+            # Convert bytes to PIL Image
+            image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+            
+            # Tạo embedding vector
+            embedding_vector = embed_image(image)
         
         # Lưu vào DB và FAISS
         embedding = add_embedding_to_db(
@@ -50,3 +50,24 @@ def get_folder(session: Session, project_id: int, path: str) -> Folders:
         parent_id = folder.id
 
     return folder
+
+
+def get_folder_subtree_ids(session: Session, folder_id: int) -> list[int]:
+    """
+    ID của folder và toàn bộ folder con cháu (1 query cho cả project).
+    """
+    folder = session.get(Folders, folder_id)
+    if not folder:
+        return []
+
+    rows = session.exec(
+        select(Folders.id, Folders.parent_id).where(Folders.project_id == folder.project_id)
+    ).all()
+    children: dict[int, list[int]] = {}
+    for child_id, parent_id in rows:
+        children.setdefault(parent_id, []).append(child_id)
+
+    subtree = [folder_id]
+    for current in subtree:
+        subtree.extend(children.get(current, []))
+    return subtree
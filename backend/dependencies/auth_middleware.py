@@ -54,6 +54,7 @@ class AuthMiddleware(BaseHTTPMiddleware):
            "/redoc",
            "/favicon.ico",
            "/api/v1/test/*",  # Test
+           "/ready",  # Readiness probe (model warmup)
            
         ]
 
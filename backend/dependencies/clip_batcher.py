@@ -0,0 +1,238 @@
+# dependencies/clip_batcher.py
+"""
+CLIP Batcher - Gộp các request encode ảnh / text đồng thời thành 1 batch
+
+Upload và search chạy song song mỗi request chỉ encode 1 ảnh / 1 text,
+nên CPU phải chạy N lần forward batch-1. Mỗi loại (image, text) có 1
+thread worker: lấy request đầu tiên trong queue, chờ thêm tối đa
+CLIP_BATCH_WAIT_MS (hoặc tới CLIP_BATCH_MAX_SIZE item) rồi chạy 1 lần
+encode_image / encode_text cho cả batch và trả kết quả qua Future của
+từng caller.
+
+- Preprocess ảnh chạy ở thread của caller (song song), worker chỉ stack tensor
+- 1 request nhiều item (vd. 100 label) không bị tách ra, chỉ được gộp thêm
+  request khác khi tổng số item còn <= CLIP_BATCH_MAX_SIZE
+- CLIP_BATCH_ENABLED=false: encode trực tiếp trong thread của caller
+- CLIP_SERVER_SOCKET: encode_images / encode_texts gửi sang CLIP server
+  (dependencies/clip_client.py), process này không tải model; server dùng
+  encode_images_local / encode_texts_local nên batch gộp request của mọi worker
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import torch
+import clip
+from PIL import Image
+
+from core.config import settings
+from dependencies import clip_client
+from dependencies.clip_service import DIM, get_clip_model
+from services.search.embedding_codec import model_key
+
+
+class ClipBatcher:
+    """Queue + worker thread cho 1 loại input (image hoặc text)."""
+
+    def __init__(self, name: str, run_batch: Callable[[list], np.ndarray], max_batch: int, max_wait_ms: float):
+        self.name = name
+        self._run_batch = run_batch
+        self._max_batch = max(1, max_batch)
+        self._max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: "queue.Queue[tuple[list, Future]]" = queue.Queue()
+        self._pending = None  # request đã lấy ra nhưng không vừa batch trước
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._requests = 0
+        self._max_batch_seen = 0
+        self._busy_seconds = 0.0
+        self._batch_sizes: Dict[int, int] = {}
+
+    def submit(self, items: list) -> Future:
+        """Đưa items vào queue, Future trả về ndarray (len(items), DIM)."""
+        future: Future = Future()
+        if not items:
+            future.set_result(np.empty((0, DIM), dtype="float32"))
+            return future
+        self._ensure_started()
+        self._queue.put((list(items), future))
+        return future
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name=f"clip-batcher-{self.name}", daemon=True)
+                self._thread.start()
+
+    def _next_request(self, timeout: Optional[float]):
+        if self._pending is not None:
+            request, self._pending = self._pending, None
+            return request
+        return self._queue.get(timeout=timeout) if timeout is not None else self._queue.get()
+
+    def _collect(self) -> List[tuple]:
+        """Request đầu tiên + các request đến trong max_wait (tới max_batch item)."""
+        batch = [self._next_request(None)]
+        size = len(batch[0][0])
+        deadline = time.perf_counter() + self._max_wait
+        while size < self._max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._next_request(remaining)
+            except queue.Empty:
+                break
+            if size + len(request[0]) > self._max_batch:
+                self._pending = request
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            # Bỏ request mà caller đã hủy
+            batch = [(items, future) for items, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            items = [item for request_items, _ in batch for item in request_items]
+
+            start = time.perf_counter()
+            try:
+                vectors = self._run_batch(items)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self._record(len(batch), len(items), time.perf_counter() - start)
+
+            offset = 0
+            for request_items, future in batch:
+                future.set_result(vectors[offset:offset + len(request_items)])
+                offset += len(request_items)
+
+    def _record(self, requests: int, items: int, seconds: float):
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += requests
+            self._items += items
+            self._max_batch_seen = max(self._max_batch_seen, items)
+            self._busy_seconds += seconds
+            self._batch_sizes[items] = self._batch_sizes.get(items, 0) + 1
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize() + (1 if self._pending is not None else 0),
+                "batches": self._batches,
+                "requests": self._requests,
+                "items": self._items,
+                "avg_batch_size": round(self._items / self._batches, 2) if self._batches else 0.0,
+                "max_batch_size": self._max_batch_seen,
+                "batch_sizes": dict(sorted(self._batch_sizes.items())),
+                "busy_seconds": round(self._busy_seconds, 3),
+            }
+
+
+def _run_images(tensors: list) -> np.ndarray:
+    model, preprocess, device = get_clip_model()
+    image_tensor = torch.stack(tensors).to(device)
+    with torch.no_grad():
+        image_features = model.encode_image(image_tensor)
+        # Normalize để dùng cosine similarity
+        image_features /= image_features.norm(dim=-1, keepdim=True)
+    return image_features.cpu().numpy().astype("float32")
+
+
+def _run_texts(texts: List[str]) -> np.ndarray:
+    model, preprocess, device = get_clip_model()
+    text_tokens = clip.tokenize(texts, truncate=True).to(device)
+    with torch.no_grad():
+        text_features = model.encode_text(text_tokens)
+        # Normalize để dùng cosine similarity
+        text_features /= text_features.norm(dim=-1, keepdim=True)
+    return text_features.cpu().numpy().astype("float32")
+
+
+IMAGE_BATCHER = ClipBatcher("image", _run_images, settings.CLIP_BATCH_MAX_SIZE, settings.CLIP_BATCH_WAIT_MS)
+TEXT_BATCHER = ClipBatcher("text", _run_texts, settings.CLIP_BATCH_MAX_SIZE, settings.CLIP_BATCH_WAIT_MS)
+
+
+def producer_model_key() -> str:
+    """
+    model_key của nơi tạo vector cho encode_images / encode_texts: CLIP
+    server (CLIP_SERVER_SOCKET, có thể chạy backend khác) hoặc process này.
+    """
+    if clip_client.is_remote():
+        return clip_client.get_server_model_key()
+    return model_key()
+
+
+def encode_images(images: List[Image.Image]) -> np.ndarray:
+    """Embedding (n, DIM) đã normalize của nhiều ảnh."""
+    if not images:
+        return np.empty((0, DIM), dtype="float32")
+    if clip_client.is_remote():
+        return clip_client.encode_images(images)
+    return encode_images_local(images)
+
+
+def encode_images_local(images: List[Image.Image]) -> np.ndarray:
+    """Như encode_images nhưng luôn dùng model trong process này."""
+    if not images:
+        return np.empty((0, DIM), dtype="float32")
+    model, preprocess, device = get_clip_model()
+    tensors = [preprocess(image) for image in images]
+    if not settings.CLIP_BATCH_ENABLED:
+        return _run_images(tensors)
+    return IMAGE_BATCHER.submit(tensors).result()
+
+
+def encode_texts(texts: List[str]) -> np.ndarray:
+    """Embedding (n, DIM) đã normalize của nhiều text."""
+    if not texts:
+        return np.empty((0, DIM), dtype="float32")
+    if clip_client.is_remote():
+        return clip_client.encode_texts(texts)
+    return encode_texts_local(texts)
+
+
+def encode_texts_local(texts: List[str]) -> np.ndarray:
+    """Như encode_texts nhưng luôn dùng model trong process này."""
+    if not texts:
+        return np.empty((0, DIM), dtype="float32")
+    if not settings.CLIP_BATCH_ENABLED:
+        return _run_texts(texts)
+    return TEXT_BATCHER.submit(texts).result()
+
+
+def get_batcher_stats() -> dict:
+    """Queue depth + phân bố batch size của từng loại (của CLIP server nếu dùng)."""
+    if clip_client.is_remote():
+        try:
+            return {"server": settings.CLIP_SERVER_SOCKET, **clip_client.get_server_stats()}
+        except Exception as e:
+            return {"server": settings.CLIP_SERVER_SOCKET, "error": str(e)}
+    return get_local_batcher_stats()
+
+
+def get_local_batcher_stats() -> dict:
+    """Stats của batcher trong process này."""
+    return {
+        "enabled": settings.CLIP_BATCH_ENABLED,
+        "max_batch_size": settings.CLIP_BATCH_MAX_SIZE,
+        "max_wait_ms": settings.CLIP_BATCH_WAIT_MS,
+        "image": IMAGE_BATCHER.stats(),
+        "text": TEXT_BATCHER.stats(),
+    }
@@ -0,0 +1,154 @@
+# dependencies/clip_client.py
+"""
+CLIP Client - Gọi CLIP server (dependencies/clip_server.py) qua Unix socket
+
+Khi CLIP_SERVER_SOCKET có giá trị, encode_images / encode_texts của
+clip_batcher đi qua đây thay vì tự tải model: mọi uvicorn worker và celery
+worker trên 1 node dùng chung 1 bản model trong CLIP server, và request
+từ mọi nguồn được gộp batch ở cùng 1 chỗ.
+
+Ảnh được resize (cạnh ngắn = image_size, bicubic) + center crop ở phía
+client giống hệt bước đầu của preprocess CLIP, rồi gửi dạng uint8 RGB
+(150 KB/ảnh với 224x224) nên process client không cần model để preprocess.
+
+Vector do model của server tạo ra: get_server_model_key() trả model_key
+của server (từ /health và từ mỗi response encode) để ghi vào header
+embedding thay cho CLIP_INFERENCE_BACKEND của process này.
+"""
+
+import base64
+import http.client
+import json
+import socket
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image
+
+from core.config import settings
+from utils.array_codec import decode_array
+
+_local = threading.local()
+_image_size: Optional[int] = None
+_model_key: Optional[str] = None
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection qua Unix domain socket."""
+
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self._socket_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self._socket_path)
+        self.sock = sock
+
+
+def is_remote() -> bool:
+    """Có dùng CLIP server hay không."""
+    return bool(settings.CLIP_SERVER_SOCKET)
+
+
+def _connection() -> _UnixHTTPConnection:
+    # HTTPConnection không thread-safe: mỗi thread 1 connection (giữ keep-alive)
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = _UnixHTTPConnection(settings.CLIP_SERVER_SOCKET, settings.CLIP_SERVER_TIMEOUT)
+    return conn
+
+
+def _request(method: str, path: str, payload: Optional[dict] = None):
+    body = json.dumps(payload).encode("utf-8") if payload is not None else None
+    headers = {"Content-Type": "application/json"} if body is not None else {}
+    for attempt in range(2):
+        conn = _connection()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+            break
+        except (ConnectionError, http.client.HTTPException):
+            # Server restart / đóng keep-alive: mở connection mới và thử lại 1 lần
+            conn.close()
+            _local.conn = None
+            if attempt:
+                raise
+    if response.status >= 400:
+        raise RuntimeError(f"CLIP server {method} {path} -> {response.status}: {data[:200]!r}")
+    return json.loads(data)
+
+
+def get_server_health() -> dict:
+    return _request("GET", "/health")
+
+
+def get_server_stats() -> dict:
+    return _request("GET", "/stats")
+
+
+def _get_image_size() -> int:
+    """Input resolution của model ở server (chờ server tải xong model)."""
+    global _image_size, _model_key
+    deadline = time.monotonic() + settings.CLIP_SERVER_TIMEOUT
+    while _image_size is None:
+        health = get_server_health()
+        if health.get("image_size"):
+            _image_size = int(health["image_size"])
+            _model_key = health.get("model") or _model_key
+        elif health.get("status") == "failed" or time.monotonic() > deadline:
+            raise RuntimeError(f"CLIP server not ready: {health.get('status')} {health.get('error') or ''}".strip())
+        else:
+            time.sleep(0.5)
+    return _image_size
+
+
+def get_server_model_key() -> str:
+    """model_key (model + inference backend) của CLIP server đang tạo vector."""
+    if _model_key is None:
+        _get_image_size()
+    return _model_key
+
+
+def _decode_vectors(response: dict) -> np.ndarray:
+    # Server restart với backend khác: cập nhật model theo response mới nhất
+    global _model_key
+    _model_key = response.get("model") or _model_key
+    return decode_array(response)
+
+
+def fit_image(image: Image.Image, size: int) -> np.ndarray:
+    """Resize cạnh ngắn = size (bicubic) + center crop size x size, như preprocess của CLIP."""
+    image = image.convert("RGB")
+    width, height = image.size
+    if width <= height:
+        new_size = (size, int(size * height / width))
+    else:
+        new_size = (int(size * width / height), size)
+    if new_size != image.size:
+        image = image.resize(new_size, Image.BICUBIC)
+    width, height = image.size
+    left = int(round((width - size) / 2.0))
+    top = int(round((height - size) / 2.0))
+    image = image.crop((left, top, left + size, top + size))
+    return np.asarray(image, dtype=np.uint8)
+
+
+def encode_images(images: List[Image.Image]) -> np.ndarray:
+    """Embedding (n, DIM) đã normalize của nhiều ảnh, encode ở CLIP server."""
+    size = _get_image_size()
+    pixels = np.stack([fit_image(image, size) for image in images])
+    payload = {
+        "shape": list(pixels.shape),
+        "data": base64.b64encode(pixels.tobytes()).decode("ascii"),
+    }
+    return _decode_vectors(_request("POST", "/encode/images", payload))
+
+
+def encode_texts(texts: List[str]) -> np.ndarray:
+    """Embedding (n, DIM) đã normalize của nhiều text, encode ở CLIP server."""
+    return _decode_vectors(_request("POST", "/encode/texts", {"texts": list(texts)}))
@@ -0,0 +1,103 @@
+# dependencies/clip_server.py
+"""
+CLIP Server - Process riêng giữ 1 bản model CLIP cho cả node
+
+Mỗi uvicorn worker / celery worker tự gọi get_clip_model() thì mỗi
+process giữ 1 bản ViT-B/32 (vài trăm MB) và chỉ gộp batch được các
+request của chính nó. Khi đặt CLIP_SERVER_SOCKET, các process gọi
+server này qua Unix socket (dependencies/clip_client.py): RAM cho model
+chỉ tốn 1 lần và ClipBatcher ở đây gộp request từ mọi nguồn.
+
+Chạy (luôn 1 worker, request được phục vụ song song bằng thread pool,
+batcher gộp chúng thành batch):
+    uvicorn dependencies.clip_server:app --uds /run/photostore/clip.sock
+hoặc:
+    python -m dependencies.clip_server
+
+Endpoints:
+- POST /encode/images - Ảnh đã resize + crop (uint8 RGB, base64) -> vectors
+- POST /encode/texts - Danh sách text -> vectors
+- GET /health - Trạng thái tải model + image_size
+
+Response encode và /health có "model" (model_key của server, vd.
+"ViT-B/32+int8"): client ghi đúng model đã tạo vector vào header embedding
+dù CLIP_INFERENCE_BACKEND của client khác server.
+- GET /stats - Queue depth / batch size của batcher
+"""
+
+import base64
+import os
+from typing import List
+
+import numpy as np
+from fastapi import FastAPI, HTTPException
+from PIL import Image
+from pydantic import BaseModel
+
+from core.config import settings
+from dependencies import model_warmup
+from dependencies.clip_batcher import encode_images_local, encode_texts_local, get_local_batcher_stats
+from dependencies.clip_service import get_clip_model
+from services.search.embedding_codec import model_key
+from utils.array_codec import encode_array
+
+app = FastAPI(title="PhotoStore CLIP Server")
+
+
+class ImagesRequest(BaseModel):
+    shape: List[int]  # (n, size, size, 3)
+    data: str
+
+
+class TextsRequest(BaseModel):
+    texts: List[str]
+
+
+def _wait_for_model():
+    if not model_warmup.wait_until_warm(settings.CLIP_SERVER_TIMEOUT):
+        raise HTTPException(status_code=503, detail=f"Model not ready: {model_warmup.WARMUP_STATE['status']}")
+
+
+@app.on_event("startup")
+def startup_event():
+    """Tải model + warmup ở thread nền (GET /health báo status)"""
+    model_warmup.start_model_warmup(remote=False, prime_labels=False)
+
+
+@app.get("/health")
+def health():
+    state = model_warmup.get_warmup_state()
+    image_size = None
+    if state["status"] == model_warmup.STATUS_READY:
+        model, preprocess, device = get_clip_model()
+        image_size = model.visual.input_resolution
+    return {**state, "image_size": image_size, "pid": os.getpid()}
+
+
+@app.get("/stats")
+def stats():
+    return get_local_batcher_stats()
+
+
+@app.post("/encode/images")
+def encode_images(request: ImagesRequest):
+    if len(request.shape) != 4 or request.shape[3] != 3:
+        raise HTTPException(status_code=400, detail="Expected shape (n, size, size, 3)")
+    _wait_for_model()
+    pixels = np.frombuffer(base64.b64decode(request.data), dtype=np.uint8).reshape(request.shape)
+    images = [Image.fromarray(pixel) for pixel in pixels]
+    return {**encode_array(encode_images_local(images)), "model": model_key()}
+
+
+@app.post("/encode/texts")
+def encode_texts(request: TextsRequest):
+    _wait_for_model()
+    return {**encode_array(encode_texts_local(request.texts)), "model": model_key()}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    socket_path = settings.CLIP_SERVER_SOCKET or "/run/photostore/clip.sock"
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    uvicorn.run(app, uds=socket_path, workers=1)
@@ -3,11 +3,47 @@ import torch
 import clip
 from functools import lru_cache
 
+from core.config import settings
+
 DIM = 512  # embedding_dim của CLIP ViT-B/32
 
+# "fp32": model gốc; "int8": dynamic int8 quantization cho các nn.Linear (MLP,
+# projection) của cả image và text encoder, chỉ chạy trên CPU
+INFERENCE_BACKENDS = ("fp32", "int8")
+
+
+def configure_torch_threads():
+    """Giới hạn số thread torch (0 = giữ mặc định) để CPU còn cho event loop / request khác."""
+    if settings.TORCH_NUM_THREADS > 0:
+        torch.set_num_threads(settings.TORCH_NUM_THREADS)
+    if settings.TORCH_INTEROP_THREADS > 0:
+        try:
+            torch.set_num_interop_threads(settings.TORCH_INTEROP_THREADS)
+        except RuntimeError:
+            # Chỉ đặt được trước lần chạy song song đầu tiên
+            pass
+
+
+def load_clip_model(backend: str = "fp32"):
+    """
+    Tải CLIP với inference backend cho trước (không cache, dùng cho benchmark).
+
+    Returns:
+        (model, preprocess, device)
+    """
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown CLIP_INFERENCE_BACKEND '{backend}', expected one of {INFERENCE_BACKENDS}")
+    # Quantized kernel của torch chỉ có trên CPU
+    device = "cuda" if torch.cuda.is_available() and backend == "fp32" else "cpu"
+    model, preprocess = clip.load(settings.CLIP_MODEL_NAME, device=device)
+    model.eval()
+    if backend == "int8":
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model, preprocess, device
+
+
 @lru_cache()
 def get_clip_model():
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    print("Loading CLIP model...")  # Debug: chỉ in khi lần đầu gọi
-    model, preprocess = clip.load("ViT-B/32", device=device)
-    return model, preprocess, device
+    configure_torch_threads()
+    print(f"Loading CLIP model ({settings.CLIP_INFERENCE_BACKEND})...")  # Debug: chỉ in khi lần đầu gọi
+    return load_clip_model(settings.CLIP_INFERENCE_BACKEND)
@@ -0,0 +1,128 @@
+# dependencies/embedding_cache.py
+"""
+Embedding Cache - LRU cache vector query đã encode bằng CLIP
+
+Text query lặp lại rất nhiều ("beach", "cat", "sunset"...) nhưng mỗi lần
+search đều chạy lại text transformer. Cache giữ tối đa
+TEXT_EMBEDDING_CACHE_SIZE vector (~2 KB/vector), key = (model + backend,
+query đã chuẩn hóa) nên đổi CLIP_MODEL_NAME / CLIP_INFERENCE_BACKEND không
+dùng nhầm vector cũ.
+
+Dùng chung cho search(), search_batch(), search_similar_tags và
+/tags/search/suggest.
+
+Ảnh query (search bằng ảnh upload) được cache theo sha256 của bytes gốc
+(IMAGE_EMBEDDING_CACHE_SIZE): gửi lại cùng 1 ảnh không phải decode và
+chạy CLIP lại. Thống kê hit/miss: GET /search/inference-stats.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Hashable, List, Optional
+
+import numpy as np
+
+from core.config import settings
+from dependencies.clip_batcher import encode_images, encode_texts, producer_model_key
+from dependencies.clip_service import DIM
+from dependencies.inference_executor import decode_image
+
+
+class VectorLRU:
+    """LRU key -> vector (read-only) an toàn với nhiều thread."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: "OrderedDict[Hashable, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._data.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, key: Hashable, vector: np.ndarray):
+        if self.max_size <= 0:
+            return
+        vector = np.array(vector, dtype="float32")
+        vector.flags.writeable = False
+        with self._lock:
+            self._data[key] = vector
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+TEXT_QUERY_CACHE = VectorLRU(settings.TEXT_EMBEDDING_CACHE_SIZE)
+IMAGE_QUERY_CACHE = VectorLRU(settings.IMAGE_EMBEDDING_CACHE_SIZE)
+
+
+def normalize_query(text: str) -> str:
+    """Bỏ khoảng trắng thừa + lowercase (tokenizer của CLIP cũng lowercase)."""
+    return " ".join(text.split()).lower()
+
+
+def encode_texts_cached(texts: List[str]) -> np.ndarray:
+    """
+    Như encode_texts nhưng lấy từ cache nếu có; các text chưa có được
+    encode chung 1 batch rồi lưu vào cache.
+    """
+    if not texts:
+        return np.empty((0, DIM), dtype="float32")
+
+    model = producer_model_key()
+    keys = [(model, normalize_query(text)) for text in texts]
+    vectors: List[Optional[np.ndarray]] = [TEXT_QUERY_CACHE.get(key) for key in keys]
+
+    missing = {}
+    for i, vector in enumerate(vectors):
+        if vector is None:
+            missing.setdefault(keys[i], []).append(i)
+    if missing:
+        encoded = encode_texts([key[1] for key in missing])
+        for (key, positions), vector in zip(missing.items(), encoded):
+            TEXT_QUERY_CACHE.put(key, vector)
+            for i in positions:
+                vectors[i] = vector
+
+    return np.vstack(vectors).astype("float32")
+
+
+def encode_image_bytes_cached(data: bytes) -> np.ndarray:
+    """
+    Embedding (DIM,) đã normalize của ảnh từ bytes gốc. Cache hit thì
+    không decode ảnh, không chạy CLIP.
+    """
+    key = (producer_model_key(), hashlib.sha256(data).hexdigest())
+    vector = IMAGE_QUERY_CACHE.get(key)
+    if vector is None:
+        vector = encode_images([decode_image(data)])[0]
+        IMAGE_QUERY_CACHE.put(key, vector)
+    return vector
+
+
+def get_cache_stats() -> dict:
+    return {"text": TEXT_QUERY_CACHE.stats(), "image": IMAGE_QUERY_CACHE.stats()}
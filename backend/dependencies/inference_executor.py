@@ -0,0 +1,67 @@
+# dependencies/inference_executor.py
+"""
+Inference Executor - Chạy decode ảnh / CLIP ngoài event loop
+
+Các route async (/search/image, /external/image, upload...) nếu gọi thẳng
+PIL + torch thì cả worker bị chặn tới khi encode xong. Các route này
+await run_in_inference_pool(...): công việc chạy trên 1 thread pool giới
+hạn INFERENCE_MAX_WORKERS thread (các thread này cũng là caller của
+clip_batcher nên request đồng thời vẫn được gộp batch), event loop tiếp
+tục phục vụ request khác.
+
+Pool chỉ dành cho decode ảnh + CLIP (decode_image, embed_image,
+encode_image_bytes_cached, get_image_tags). Search, ghi DB, FAISS / gọi
+vector server chạy bằng starlette run_in_threadpool: không chiếm thread
+inference, upload và search không phải xếp hàng sau nhau.
+
+Số thread torch dùng cho mỗi lần forward: TORCH_NUM_THREADS (xem
+dependencies/clip_service.py).
+"""
+
+import asyncio
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Optional, TypeVar
+
+from PIL import Image
+
+from core.config import settings
+
+T = TypeVar("T")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_inference_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=max(1, settings.INFERENCE_MAX_WORKERS),
+                    thread_name_prefix="inference"
+                )
+    return _executor
+
+
+async def run_in_inference_pool(fn: Callable[..., T], *args, **kwargs) -> T:
+    """Chạy fn(*args, **kwargs) trên inference pool và await kết quả."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_inference_executor(), partial(fn, *args, **kwargs))
+
+
+def decode_image(data: bytes) -> Image.Image:
+    """Bytes -> PIL Image RGB (chạy trong inference pool)."""
+    return Image.open(io.BytesIO(data)).convert("RGB")
+
+
+def shutdown_inference_executor():
+    """Chờ các task đang chạy rồi dừng pool (khi shutdown)."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
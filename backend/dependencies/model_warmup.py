@@ -0,0 +1,168 @@
+# dependencies/model_warmup.py
+"""
+Model Warmup - Tải CLIP và chạy thử trước khi nhận traffic
+
+get_clip_model() tải lười: request search / upload đầu tiên sau mỗi lần
+deploy phải chờ clip.load và lần forward đầu tiên (vài giây). Khi
+CLIP_WARMUP_ON_STARTUP bật, main.py gọi start_model_warmup() lúc startup:
+1 thread nền tải model, chạy 1 batch ảnh + 1 batch text qua cả 2 encoder,
+rồi tính sẵn label features của DEFAULT_LABELS cho auto-tag.
+
+GET /ready trả 503 cho tới khi warmup xong (200 khi đã sẵn sàng) để
+orchestrator chỉ route traffic tới worker đã warm. Thời gian từng bước
+có trong /ready và GET /search/inference-stats.
+
+Với CLIP_SERVER_SOCKET, model nằm ở CLIP server: bước "load" là chờ
+server báo ready, batch warmup và label features đi qua server.
+"""
+
+import threading
+import time
+from typing import Optional
+
+from PIL import Image
+
+from core.config import settings
+from services.search.embedding_codec import model_key
+
+STATUS_IDLE = "idle"
+STATUS_LOADING = "loading"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+# Trạng thái + thời gian (giây) từng bước
+WARMUP_STATE = {
+    "status": STATUS_IDLE,
+    "model": model_key(),
+    "load_seconds": None,
+    "warmup_seconds": None,
+    "labels_seconds": None,
+    "total_seconds": None,
+    "error": None,
+}
+
+_thread: Optional[threading.Thread] = None
+_lock = threading.Lock()
+_done = threading.Event()
+
+
+def _wait_for_server():
+    """
+    Chờ CLIP server tải xong model (server tự warmup lúc startup), tối đa
+    CLIP_SERVER_WAIT_TIMEOUT giây.
+
+    Raises:
+        RuntimeError: Server báo lỗi tải model, hoặc quá hạn (sai socket
+            path, container chưa chạy...)
+    """
+    from dependencies.clip_client import get_server_health
+
+    deadline = time.monotonic() + settings.CLIP_SERVER_WAIT_TIMEOUT
+    last_error = None
+    while True:
+        try:
+            health = get_server_health()
+        except (OSError, RuntimeError) as e:
+            # Server chưa tạo socket / đang khởi động
+            health, last_error = None, e
+        if health and health["status"] == STATUS_READY:
+            return
+        if health and health["status"] == STATUS_FAILED:
+            raise RuntimeError(f"CLIP server failed to load model: {health.get('error')}")
+        if time.monotonic() > deadline:
+            state = health["status"] if health else f"unreachable ({last_error})"
+            raise RuntimeError(
+                f"CLIP server at {settings.CLIP_SERVER_SOCKET} not ready after "
+                f"{settings.CLIP_SERVER_WAIT_TIMEOUT:.0f}s: {state}"
+            )
+        time.sleep(1.0)
+
+
+def _warmup(remote: bool, prime_labels: bool):
+    from dependencies import clip_batcher
+    from dependencies.clip_service import get_clip_model
+
+    start = time.perf_counter()
+    try:
+        if remote:
+            encode_images, encode_texts = clip_batcher.encode_images, clip_batcher.encode_texts
+            print(f"[Warmup] Waiting for CLIP server at {settings.CLIP_SERVER_SOCKET}...")
+            _wait_for_server()
+            # Vector do model của server tạo ra (backend có thể khác process này)
+            from dependencies.clip_client import get_server_model_key
+            WARMUP_STATE["model"] = get_server_model_key()
+        else:
+            encode_images, encode_texts = clip_batcher.encode_images_local, clip_batcher.encode_texts_local
+            print(f"[Warmup] Loading CLIP model {model_key()}...")
+            get_clip_model()
+        loaded = time.perf_counter()
+        WARMUP_STATE["load_seconds"] = round(loaded - start, 3)
+
+        # 1 batch qua mỗi encoder (khởi tạo kernel / bộ nhớ cho lần forward thật đầu tiên)
+        batch = max(1, settings.CLIP_WARMUP_BATCH_SIZE)
+        encode_images([Image.new("RGB", (224, 224)) for _ in range(batch)])
+        encode_texts(["a photo"] * batch)
+        warmed = time.perf_counter()
+        WARMUP_STATE["warmup_seconds"] = round(warmed - loaded, 3)
+
+        if prime_labels:
+            from services.tagging_service import DEFAULT_LABELS, get_cached_label_features
+            get_cached_label_features(DEFAULT_LABELS)
+        done = time.perf_counter()
+        WARMUP_STATE["labels_seconds"] = round(done - warmed, 3)
+        WARMUP_STATE["total_seconds"] = round(done - start, 3)
+        WARMUP_STATE["status"] = STATUS_READY
+        print(
+            f"[Warmup] CLIP ready in {WARMUP_STATE['total_seconds']}s "
+            f"(load {WARMUP_STATE['load_seconds']}s, warmup {WARMUP_STATE['warmup_seconds']}s, "
+            f"labels {WARMUP_STATE['labels_seconds']}s)"
+        )
+    except Exception as e:
+        WARMUP_STATE["status"] = STATUS_FAILED
+        WARMUP_STATE["error"] = str(e)
+        WARMUP_STATE["total_seconds"] = round(time.perf_counter() - start, 3)
+        print(f"[Warmup] CLIP warmup failed: {e}")
+    finally:
+        _done.set()
+
+
+def start_model_warmup(remote: Optional[bool] = None, prime_labels: bool = True):
+    """
+    Chạy warmup ở thread nền (gọi 1 lần lúc startup).
+
+    Args:
+        remote: Model ở CLIP server (mặc định: CLIP_SERVER_SOCKET có giá trị).
+        prime_labels: Tính sẵn label features của DEFAULT_LABELS (CLIP server
+            không auto-tag nên gọi với remote=False, prime_labels=False).
+    """
+    global _thread
+    if remote is None:
+        remote = bool(settings.CLIP_SERVER_SOCKET)
+    with _lock:
+        if _thread is not None:
+            return
+        WARMUP_STATE["status"] = STATUS_LOADING
+        _thread = threading.Thread(target=_warmup, args=(remote, prime_labels), name="clip-warmup", daemon=True)
+        _thread.start()
+
+
+def wait_until_warm(timeout: Optional[float] = None) -> bool:
+    """Chờ warmup kết thúc (ready hoặc failed). Chưa start warmup thì trả về ngay."""
+    if _thread is None:
+        return True
+    _done.wait(timeout)
+    return WARMUP_STATE["status"] == STATUS_READY
+
+
+def is_ready() -> bool:
+    """
+    Worker sẵn sàng nhận traffic. Không bật warmup thì luôn sẵn sàng
+    (model được tải lười như trước).
+    """
+    if not settings.CLIP_WARMUP_ON_STARTUP:
+        return True
+    return WARMUP_STATE["status"] == STATUS_READY
+
+
+def get_warmup_state() -> dict:
+    return {**WARMUP_STATE, "ready": is_ready()}
@@ -1,4 +1,5 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.routing import APIRoute
 from starlette.middleware.cors import CORSMiddleware
 from sqlmodel import SQLModel
@@ -48,6 +49,13 @@ app.include_router(external_api_router, prefix="/api")
 def root():
     return {"message": "Database connected successfully!"}
 
+@app.get("/ready")
+def ready():
+    """Readiness probe: 200 khi CLIP đã tải + warmup xong, 503 khi chưa"""
+    from dependencies.model_warmup import get_warmup_state
+    state = get_warmup_state()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
 # Add static files middleware
 from dependencies.static_middleware import verify_static_access
 app.middleware("http")(verify_static_access)
@@ -61,12 +69,43 @@ def startup_event():
     SQLModel.metadata.create_all(engine)
     print("✅ Database tables initialized")
     
+    # Cột embeddings.embedding phải là BLOB trước khi ghi embedding binary đầu tiên
+    # (database cũ còn cột TEXT; dòng JSON cũ vẫn đọc được, chuyển đổi sau bằng migration)
+    from migrations.migrate_embeddings_binary import ensure_binary_column
+    if ensure_binary_column(engine):
+        print("✅ embeddings.embedding column converted to BLOB")
+    
     # Create uploads directory if not exists
     from pathlib import Path
     uploads_dir = Path("uploads")
     uploads_dir.mkdir(exist_ok=True)
     print(f"✅ Uploads directory initialized at {uploads_dir.absolute()}")
     
-    # Load FAISS indices from disk
-    from services.search.faiss_index import load_all_indices_from_disk
+    # Tải + warmup CLIP ở thread nền (GET /ready = 503 cho tới khi xong)
+    if settings.CLIP_WARMUP_ON_STARTUP:
+        from dependencies.model_warmup import start_model_warmup
+        start_model_warmup()
+    
+    # Load FAISS indices from disk (snapshot + replay WAL)
+    # Với VECTOR_SERVER_URL, index do vector server giữ: worker không tải bản riêng
+    if settings.VECTOR_SERVER_URL:
+        print(f"✅ Using vector server at {settings.VECTOR_SERVER_URL}")
+        return
+    from services.search.faiss_index import load_all_indices_from_disk, start_checkpoint_worker
+    from services.search.faiss_sync import start_sync
     load_all_indices_from_disk()
+    start_checkpoint_worker()
+    start_sync()
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """Flush pending FAISS WAL records into snapshots before exit"""
+    from dependencies.inference_executor import shutdown_inference_executor
+    shutdown_inference_executor()
+    if settings.VECTOR_SERVER_URL:
+        return
+    from services.search.faiss_index import stop_checkpoint_worker
+    from services.search.faiss_sync import stop_sync
+    stop_sync()
+    stop_checkpoint_worker()
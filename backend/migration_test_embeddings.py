@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Migration Test Script cho migrations/migrate_embeddings_binary.py
+
+Tạo bảng embeddings tạm (SQLite) chứa vector dạng JSON cũ, chạy migration
+và kiểm tra dữ liệu + header của giá trị binary.
+
+Chạy trong thư mục backend (cần các biến môi trường của core.config):
+    python migration_test_embeddings.py
+"""
+
+import json
+import os
+import tempfile
+import traceback
+
+import numpy as np
+from sqlalchemy import create_engine, text
+
+from core.config import settings
+from migrations.migrate_embeddings_binary import run_migration
+from services.search.embedding_codec import decode_embedding, is_legacy, model_id, read_header
+
+
+def expect(actual, expected, message: str):
+    if actual != expected:
+        raise AssertionError(f"{message}: expected {expected}, got {actual}")
+
+
+def test_legacy_rows_keep_fp32_model():
+    """
+    Migration chạy khi CLIP_INFERENCE_BACKEND=int8: dòng JSON cũ (do fp32 tạo)
+    vẫn mang model_id của fp32, vector giữ nguyên.
+    """
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((3, 512)).astype("float32")
+    path = os.path.join(tempfile.mkdtemp(prefix="embeddings-migration-"), "test.db")
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.connect() as conn:
+        conn.execute(text("CREATE TABLE embeddings (id INTEGER PRIMARY KEY, embedding BLOB NOT NULL)"))
+        conn.execute(
+            text("INSERT INTO embeddings (id, embedding) VALUES (:id, :embedding)"),
+            [{"id": i + 1, "embedding": json.dumps(vector.tolist())} for i, vector in enumerate(vectors)]
+        )
+        conn.commit()
+
+    backend = settings.CLIP_INFERENCE_BACKEND
+    try:
+        settings.CLIP_INFERENCE_BACKEND = "int8"
+        run_migration(batch_size=2, dtype="float32", engine=engine)
+    finally:
+        settings.CLIP_INFERENCE_BACKEND = backend
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT embedding FROM embeddings ORDER BY id")).all()
+    for i, (value,) in enumerate(rows):
+        expect(is_legacy(value), False, f"row {i + 1} converted")
+        expect(read_header(value)[2], model_id(backend="fp32"), f"row {i + 1} model_id")
+        expect(np.allclose(decode_embedding(value), vectors[i]), True, f"row {i + 1} vector")
+
+
+def main():
+    ok = True
+    for test in (test_legacy_rows_keep_fp32_model,):
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except Exception:
+            ok = False
+            print(f"❌ {test.__name__}")
+            traceback.print_exc()
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Migration script chuyển cột embeddings.embedding từ JSON text sang BLOB binary
+
+- MySQL: đổi kiểu cột TEXT -> BLOB (giữ nguyên dữ liệu, bytes của JSON)
+- Đọc các dòng theo từng batch (id tăng dần), dòng còn ở dạng JSON được
+  ghi lại bằng embedding_codec.encode_embedding, commit sau mỗi batch
+- Vector JSON cũ đều do model fp32 tạo ra: header luôn mang model_id của
+  fp32 (LEGACY_BACKEND), không phụ thuộc CLIP_INFERENCE_BACKEND lúc chạy
+- Chạy lại nhiều lần được: dòng đã là binary thì bỏ qua
+
+Bước đổi kiểu cột (ensure_binary_column) cũng được main.py chạy lúc startup,
+trước khi ghi embedding đầu tiên: model Embeddings ghi bytes binary, ghi vào
+cột TEXT cũ sẽ lỗi / hỏng dữ liệu. Bước chuyển đổi dữ liệu có thể chạy sau
+(dòng JSON cũ vẫn đọc được).
+
+Chạy trong thư mục backend:
+    python migrations/migrate_embeddings_binary.py [--batch-size 1000] [--dtype float32] [--legacy-model ViT-B/32]
+"""
+from sqlalchemy import create_engine, text
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# Add backend directory to Python path
+backend_dir = Path(__file__).parent.parent
+sys.path.append(str(backend_dir))
+
+from core.config import settings
+from services.search.embedding_codec import decode_embedding, encode_embedding, is_legacy
+
+
+BINARY_COLUMN_TYPES = ("blob", "mediumblob", "longblob")
+
+# Inference backend đã tạo mọi vector JSON cũ (trước khi có int8 backend)
+LEGACY_BACKEND = "fp32"
+
+
+def ensure_binary_column(engine) -> bool:
+    """
+    Đổi cột embeddings.embedding sang BLOB nếu còn là TEXT (MySQL; SQLite
+    không cần). Chỉ tốn 1 query khi cột đã đúng kiểu.
+
+    Returns:
+        True nếu vừa ALTER cột
+    """
+    if engine.dialect.name != "mysql":
+        return False
+    with engine.connect() as conn:
+        column_type = conn.execute(text(
+            "SELECT DATA_TYPE FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'embeddings' AND COLUMN_NAME = 'embedding'"
+        )).scalar()
+        if column_type is None or column_type.lower() in BINARY_COLUMN_TYPES:
+            return False
+        print("Executing: ALTER TABLE embeddings MODIFY COLUMN embedding BLOB NOT NULL")
+        conn.execute(text("ALTER TABLE embeddings MODIFY COLUMN embedding BLOB NOT NULL"))
+        conn.commit()
+    return True
+
+
+def run_migration(batch_size: int = 1000, dtype: str = None, legacy_model: str = None, engine=None):
+    """
+    Convert JSON embeddings to binary BLOBs in batches
+
+    Args:
+        legacy_model: Model CLIP đã tạo các vector JSON (None = CLIP_MODEL_NAME)
+        engine: SQLAlchemy engine (None = DATABASE_URL)
+    """
+    try:
+        engine = engine or create_engine(settings.DATABASE_URL)
+        ensure_binary_column(engine)
+
+        start = time.perf_counter()
+        last_id = 0
+        scanned = converted = 0
+        bytes_before = bytes_after = 0
+        while True:
+            with engine.connect() as conn:
+                rows = conn.execute(
+                    text("SELECT id, embedding FROM embeddings WHERE id > :last_id ORDER BY id LIMIT :limit"),
+                    {"last_id": last_id, "limit": batch_size}
+                ).all()
+                if not rows:
+                    break
+
+                updates = []
+                for row_id, value in rows:
+                    if is_legacy(value):
+                        blob = encode_embedding(
+                            decode_embedding(value), dtype=dtype, model_name=legacy_model, backend=LEGACY_BACKEND
+                        )
+                        bytes_before += len(value)
+                        bytes_after += len(blob)
+                        updates.append({"id": row_id, "embedding": blob})
+                if updates:
+                    conn.execute(text("UPDATE embeddings SET embedding = :embedding WHERE id = :id"), updates)
+                    conn.commit()
+
+            scanned += len(rows)
+            converted += len(updates)
+            last_id = rows[-1][0]
+            print(f"  {scanned} rows scanned, {converted} converted (last id {last_id})")
+
+        elapsed = time.perf_counter() - start
+        print(f"✅ Migration completed: {converted}/{scanned} rows converted in {elapsed:.1f}s")
+        if converted:
+            print(f"   {bytes_before / 1024 / 1024:.1f} MB -> {bytes_after / 1024 / 1024:.1f} MB")
+
+    except Exception as e:
+        print(f"❌ Migration failed: {str(e)}")
+        raise
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert JSON embeddings to binary BLOBs")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dtype", choices=["float32", "float16"], default=None,
+                        help="Mặc định EMBEDDING_STORAGE_DTYPE")
+    parser.add_argument("--legacy-model", default=None,
+                        help="Model CLIP đã tạo vector JSON cũ (mặc định CLIP_MODEL_NAME)")
+    args = parser.parse_args()
+    run_migration(args.batch_size, args.dtype, args.legacy_model)
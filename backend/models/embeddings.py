@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Optional, List
 from sqlmodel import SQLModel, Field, Relationship
-from sqlalchemy import Text
+from sqlalchemy import LargeBinary
 
 
 class Embeddings(SQLModel, table=True):
@@ -11,7 +11,7 @@ class Embeddings(SQLModel, table=True):
 
     project_id: int = Field(foreign_key="projects.id", index=True)  # Thêm project_id để tìm kiếm nhanh
     folder_id: Optional[int] = Field(default=None, foreign_key="folders.id", index=True)  # Thêm folder_id để filter
-    embedding: str = Field(sa_type=Text, nullable=False)  # TEXT type để chứa vector lớn (512 floats ~11KB)
+    embedding: bytes = Field(sa_type=LargeBinary, nullable=False)  # BLOB: header + 512 float32/float16 (embedding_codec)
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
     # Relationships
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Persistence Test Script cho FAISS index (snapshot + WAL)
+
+Mỗi kịch bản chạy trên 1 thư mục index tạm, giả lập restart process bằng
+cách xóa toàn bộ state trong RAM rồi tải lại từ ổ cứng, và kiểm tra asset
+trong index đúng với kỳ vọng.
+
+Chạy trong thư mục backend (cần các biến môi trường của core.config):
+    python persistence_test_faiss.py
+"""
+
+import fcntl
+import os
+import shutil
+import tempfile
+import threading
+import traceback
+from typing import Callable, List
+
+import numpy as np
+
+from core.config import settings
+from services.search import faiss_index, faiss_policy, faiss_snapshot, faiss_wal
+
+
+def random_vectors(rng: np.random.Generator, n: int) -> np.ndarray:
+    X = rng.standard_normal((n, faiss_index.DIM)).astype("float32")
+    return X / np.linalg.norm(X, axis=1, keepdims=True)
+
+
+def restart():
+    """Giả lập restart: bỏ mọi state trong RAM, chỉ giữ lại ổ cứng."""
+    faiss_wal.close_all()
+    for state in (
+        faiss_index.PROJECT_INDICES,
+        faiss_index.PROJECT_FOLDER_MAP,
+        faiss_index.PROJECT_WAL_SEQ,
+        faiss_index.PROJECT_SNAPSHOT_SEQ,
+        faiss_index.PROJECT_TRAINED_SIZE,
+        faiss_index.PROJECT_LOAD_STATS,
+        faiss_index._RETRAIN_DELTAS,
+    ):
+        state.clear()
+    faiss_index._MMAPPED.clear()
+    faiss_index._FORCE_CHECKPOINT.clear()
+    for f in faiss_index._WRITER_LOCKS.values():
+        f.close()
+    faiss_index._WRITER_LOCKS.clear()
+
+
+def indexed_ids(project_id: int) -> List[int]:
+    asset_ids, _ = faiss_index.get_project_asset_ids(project_id)
+    return sorted(asset_ids.tolist())
+
+
+def expect(actual, expected, message: str):
+    if actual != expected:
+        raise AssertionError(f"{message}: expected {expected}, got {actual}")
+
+
+def test_rebuild_non_resident_project():
+    """
+    Rebuild project chưa được tải (lazy load sau restart) rồi tải lại:
+    record WAL cũ không được replay đè lên kết quả rebuild.
+    """
+    rng = np.random.default_rng(0)
+    X = random_vectors(rng, 5)
+    for asset_id in range(1, 6):
+        faiss_index.upsert_vector_to_project(1, asset_id, None, X[asset_id - 1])
+
+    # Restart: project 1 chỉ còn trên ổ cứng (WAL chưa checkpoint)
+    restart()
+    # Rebuild từ DB, asset 2 đã bị xóa trong DB
+    keep = np.array([1, 3, 4, 5], dtype="int64")
+    faiss_index.rebuild_project_index_arrays(1, keep, np.full(4, -1, dtype="int64"), X[keep - 1].copy())
+    expect(indexed_ids(1), [1, 3, 4, 5], "after rebuild")
+
+    faiss_index.upsert_vector_to_project(1, 6, None, random_vectors(rng, 1)[0])
+    restart()
+    expect(indexed_ids(1), [1, 3, 4, 5, 6], "after reload")
+
+
+def test_fallback_to_older_snapshot():
+    """
+    Snapshot mới nhất hỏng checksum: tải version cũ hơn + replay WAL phải
+    ra đúng trạng thái mới nhất (WAL chưa bị cắt qua version cũ).
+    """
+    rng = np.random.default_rng(2)
+    for asset_id in range(1, 4):
+        faiss_index.upsert_vector_to_project(1, asset_id, None, random_vectors(rng, 1)[0])
+    faiss_index.checkpoint_due_projects(force=True)
+    faiss_index.remove_vector_from_project(1, 2)
+    faiss_index.upsert_vector_to_project(1, 4, None, random_vectors(rng, 1)[0])
+    faiss_index.checkpoint_due_projects(force=True)
+    faiss_index.upsert_vector_to_project(1, 5, None, random_vectors(rng, 1)[0])
+
+    latest = faiss_snapshot.list_versions(faiss_index.FAISS_INDEX_DIR, 1)[-1]
+    path = os.path.join(faiss_snapshot.project_dir(faiss_index.FAISS_INDEX_DIR, 1), f"v{latest:06d}", faiss_snapshot.ASSET_IDS_FILE)
+    with open(path, "r+b") as f:
+        f.seek(-8, os.SEEK_END)
+        f.write(b"\xff" * 8)
+
+    restart()
+    expect(indexed_ids(1), [1, 3, 4, 5], "after fallback")
+
+
+def test_mmap_only_flat():
+    """FAISS_MMAP_LOAD chỉ mmap index flat: project IVF tải lại không bị tính là mmap."""
+    rng = np.random.default_rng(3)
+    ivf_min = settings.FAISS_IVF_MIN_VECTORS
+    mmap_load = settings.FAISS_MMAP_LOAD
+    try:
+        settings.FAISS_IVF_MIN_VECTORS = 1000
+        settings.FAISS_MMAP_LOAD = True
+        for project_id, n in ((1, 100), (2, 2000)):
+            faiss_index.rebuild_project_index_arrays(
+                project_id, np.arange(1, n + 1, dtype="int64"), np.full(n, -1, dtype="int64"), random_vectors(rng, n)
+            )
+        restart()
+        expect(faiss_index.get_project_stats(1)["total_vectors"], 100, "flat project on disk")
+        faiss_index.get_loaded_project_index(1)
+        faiss_index.get_loaded_project_index(2)
+        expect(faiss_index.get_project_stats(1)["mmap"], True, "flat project mmap")
+        expect(faiss_index.get_project_stats(2)["index_type"], faiss_policy.INDEX_IVF_FLAT, "ivf project")
+        expect(faiss_index.get_project_stats(2)["mmap"], False, "ivf project mmap")
+    finally:
+        settings.FAISS_IVF_MIN_VECTORS = ivf_min
+        settings.FAISS_MMAP_LOAD = mmap_load
+
+
+def _start_slow_retrain(project_id: int) -> threading.Event:
+    """Cho project retrain ở background, build bị chặn cho tới khi set Event trả về."""
+    release = threading.Event()
+    build_index = faiss_policy.build_index
+
+    def slow_build(*args, **kwargs):
+        # Chỉ chặn build của retrain background, rebuild trong test chạy bình thường
+        if threading.current_thread().name.startswith("faiss-retrain"):
+            release.wait(10)
+        return build_index(*args, **kwargs)
+
+    faiss_policy.build_index = slow_build
+    with faiss_index._STATE_LOCK:
+        faiss_index._RETRAIN_DELTAS[project_id] = []
+        faiss_index._RETRAIN_EXECUTOR.submit(
+            faiss_index._retrain_project, project_id, faiss_policy.INDEX_FLAT, faiss_policy.COMPRESSION_NONE
+        )
+    return release
+
+
+def _finish_retrain(release: threading.Event, build_index):
+    release.set()
+    faiss_index._RETRAIN_EXECUTOR.submit(lambda: None).result()
+    faiss_policy.build_index = build_index
+
+
+def test_evict_during_retrain():
+    """
+    Project đang retrain ở background không bị evict khi vượt memory budget;
+    nếu vẫn bị bỏ khỏi RAM (reload), kết quả build bị bỏ và project tải lại được.
+    """
+    rng = np.random.default_rng(1)
+    build_index = faiss_policy.build_index
+    budget = settings.FAISS_MEMORY_BUDGET_MB
+    try:
+        faiss_index.rebuild_project_index_arrays(
+            1, np.arange(1, 401, dtype="int64"), np.full(400, -1, dtype="int64"), random_vectors(rng, 400)
+        )
+        release = _start_slow_retrain(1)
+        # Budget nhỏ hơn 1 project: tải project 2 sẽ evict mọi project khác có thể evict
+        settings.FAISS_MEMORY_BUDGET_MB = 1
+        faiss_index.rebuild_project_index_arrays(
+            2, np.arange(1, 401, dtype="int64"), np.full(400, -1, dtype="int64"), random_vectors(rng, 400)
+        )
+        expect(1 in faiss_index.PROJECT_INDICES, True, "retraining project resident")
+        _finish_retrain(release, build_index)
+        expect(len(indexed_ids(1)), 400, "after retrain")
+
+        # Bỏ khỏi RAM trong lúc build: kết quả build không được ghi lại vào PROJECT_INDICES
+        settings.FAISS_MEMORY_BUDGET_MB = budget
+        release = _start_slow_retrain(1)
+        with faiss_index._STATE_LOCK:
+            faiss_index._evict_project(1)
+        _finish_retrain(release, build_index)
+        expect(1 in faiss_index.PROJECT_INDICES, False, "evicted project stays evicted")
+        faiss_index.upsert_vector_to_project(1, 401, None, random_vectors(rng, 1)[0])
+        expect(len(indexed_ids(1)), 401, "after reload")
+        faiss_index.get_project_stats(1)
+        faiss_index.checkpoint_due_projects(force=True)
+    finally:
+        faiss_policy.build_index = build_index
+        settings.FAISS_MEMORY_BUDGET_MB = budget
+
+
+def test_wal_per_index_dir():
+    """WAL cùng project_id ở 2 thư mục index trong 1 process không ghi lẫn sang nhau."""
+    other_dir = tempfile.mkdtemp(prefix="faiss-persistence-other-")
+    try:
+        faiss_wal.append_records(faiss_index.FAISS_INDEX_DIR, 1, [(1, faiss_wal.OP_REMOVE, 10, None, None)])
+        faiss_wal.append_records(other_dir, 1, [(1, faiss_wal.OP_REMOVE, 20, None, None)])
+        faiss_wal.append_records(faiss_index.FAISS_INDEX_DIR, 1, [(2, faiss_wal.OP_REMOVE, 11, None, None)])
+        expect([r[2] for r in faiss_wal.read_records(faiss_index.FAISS_INDEX_DIR, 1)], [10, 11], "first dir WAL")
+        expect([r[2] for r in faiss_wal.read_records(other_dir, 1)], [20], "second dir WAL")
+
+        faiss_wal.truncate_through(other_dir, 1, 1)
+        faiss_wal.append_records(faiss_index.FAISS_INDEX_DIR, 1, [(3, faiss_wal.OP_REMOVE, 12, None, None)])
+        expect([r[2] for r in faiss_wal.read_records(faiss_index.FAISS_INDEX_DIR, 1)], [10, 11, 12], "after truncating other dir")
+        expect(list(faiss_wal.read_records(other_dir, 1)), [], "other dir truncated")
+    finally:
+        faiss_wal.close_all()
+        shutil.rmtree(other_dir, ignore_errors=True)
+
+
+def _try_writer_lock() -> bool:
+    """Giả lập process khác lấy quyền ghi (flock trên 1 file description mới)."""
+    with open(os.path.join(faiss_index.FAISS_INDEX_DIR, faiss_index.WRITER_LOCK_FILE), "a+") as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        return True
+
+
+def _expect_raises(func, message: str):
+    try:
+        func()
+    except RuntimeError:
+        return
+    raise AssertionError(f"{message}: expected RuntimeError")
+
+
+def test_single_writer():
+    """
+    Chỉ 1 process ghi thư mục index: writer giữ lock, process thứ 2 không ghi
+    được; replica chỉ đọc (FAISS_WRITER_URL) từ chối mutation, không ghi WAL.
+    """
+    rng = np.random.default_rng(4)
+    writer_url = settings.FAISS_WRITER_URL
+    try:
+        faiss_index.upsert_vector_to_project(1, 1, None, random_vectors(rng, 1)[0])
+        expect(_try_writer_lock(), False, "lock held by writer")
+
+        # Process khác đang ghi: restart (nhả lock) rồi để "process khác" giữ lock
+        restart()
+        with open(os.path.join(faiss_index.FAISS_INDEX_DIR, faiss_index.WRITER_LOCK_FILE), "a+") as other:
+            fcntl.flock(other.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            _expect_raises(faiss_index.load_all_indices_from_disk, "second writer at startup")
+            _expect_raises(
+                lambda: faiss_index.upsert_vector_to_project(1, 2, None, random_vectors(rng, 1)[0]),
+                "second writer upsert"
+            )
+
+        # Replica chỉ đọc: đọc được snapshot + WAL của writer, không ghi gì
+        restart()
+        settings.FAISS_WRITER_URL = "http://writer:8001"
+        faiss_index.load_all_indices_from_disk()
+        expect(indexed_ids(1), [1], "read-only replica loads writer data")
+        _expect_raises(lambda: faiss_index.remove_vector_from_project(1, 1), "read-only remove")
+        faiss_index.checkpoint_due_projects(force=True)
+        expect(faiss_wal.last_seq(faiss_index.FAISS_INDEX_DIR, 1), 1, "read-only replica keeps WAL")
+        expect(faiss_snapshot.list_versions(faiss_index.FAISS_INDEX_DIR, 1), [], "read-only replica writes no snapshot")
+        expect(_try_writer_lock(), True, "read-only replica holds no lock")
+    finally:
+        settings.FAISS_WRITER_URL = writer_url
+
+
+def run(tests: List[Callable[[], None]]) -> bool:
+    ok = True
+    for test in tests:
+        faiss_index.FAISS_INDEX_DIR = tempfile.mkdtemp(prefix="faiss-persistence-")
+        restart()
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except Exception:
+            ok = False
+            print(f"❌ {test.__name__}")
+            traceback.print_exc()
+        finally:
+            restart()
+            shutil.rmtree(faiss_index.FAISS_INDEX_DIR, ignore_errors=True)
+    return ok
+
+
+def main():
+    ok = run([
+        test_rebuild_non_resident_project,
+        test_evict_during_retrain,
+        test_fallback_to_older_snapshot,
+        test_mmap_only_flat,
+        test_single_writer,
+        test_wal_per_index_dir,
+    ])
+    os._exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Embedding Codec - Lưu vector embedding dạng binary trong bảng Embeddings
+
+Format 1 giá trị (little-endian):
+    header: magic "PSE1" (4 bytes) | dtype (u8) | reserved (u8) | dim (u16) | model_id (u32)
+    payload: dim * float32 (2048 bytes) hoặc dim * float16 (1024 bytes)
+
+model_id = crc32 tên model CLIP (CLIP_MODEL_NAME), thêm "+<backend>" khi
+CLIP_INFERENCE_BACKEND khác "fp32" (vd. "ViT-B/32+int8"): vector tạo bởi
+model / backend khác không nên dùng chung 1 index, header cho phép phát
+hiện mà không cần decode.
+
+So với JSON text (~11 KB/vector) nhỏ hơn ~5x (float32) hoặc ~10x (float16),
+và decode nhiều dòng là 1 lần np.frombuffer trên bytes nối liền thay vì
+json.loads từng dòng. Giá trị cũ dạng JSON (bắt đầu bằng "[") vẫn đọc được
+cho tới khi chạy migrations/migrate_embeddings_binary.py.
+"""
+
+import json
+import struct
+import zlib
+import numpy as np
+from typing import Optional, Sequence, Tuple, Union
+
+from core.config import settings
+
+MAGIC = b"PSE1"
+
+DTYPE_FLOAT32 = 1
+DTYPE_FLOAT16 = 2
+
+_DTYPES = {DTYPE_FLOAT32: np.dtype("<f4"), DTYPE_FLOAT16: np.dtype("<f2")}
+_DTYPE_CODES = {"float32": DTYPE_FLOAT32, "float16": DTYPE_FLOAT16}
+
+_HEADER = struct.Struct("<4sBBHI")
+HEADER_SIZE = _HEADER.size
+
+EmbeddingValue = Union[bytes, bytearray, memoryview, str]
+
+
+def model_key(model_name: Optional[str] = None, backend: Optional[str] = None) -> str:
+    """Tên model + inference backend, vd. "ViT-B/32" (fp32) hoặc "ViT-B/32+int8"."""
+    model_name = model_name or settings.CLIP_MODEL_NAME
+    backend = backend or settings.CLIP_INFERENCE_BACKEND
+    # fp32 giữ nguyên tên model để vector đã lưu trước đây vẫn khớp
+    return model_name if backend == "fp32" else f"{model_name}+{backend}"
+
+
+def model_id(model_name: Optional[str] = None, backend: Optional[str] = None, key: Optional[str] = None) -> int:
+    """Định danh (u32) của model + backend tạo ra vector (key: model_key có sẵn, vd. của CLIP server)."""
+    return zlib.crc32((key or model_key(model_name, backend)).encode("utf-8"))
+
+
+def encode_embedding(
+    vector: np.ndarray,
+    dtype: Optional[str] = None,
+    model_name: Optional[str] = None,
+    backend: Optional[str] = None,
+    key: Optional[str] = None
+) -> bytes:
+    """
+    Vector -> bytes (header + payload).
+
+    Args:
+        dtype: "float32" / "float16" (None = EMBEDDING_STORAGE_DTYPE)
+        backend: Inference backend (None = CLIP_INFERENCE_BACKEND)
+        key: model_key của nơi tạo vector (thay cho model_name + backend)
+    """
+    code = _DTYPE_CODES[dtype or settings.EMBEDDING_STORAGE_DTYPE]
+    payload = np.asarray(vector, dtype=_DTYPES[code]).reshape(-1)
+    header = _HEADER.pack(MAGIC, code, 0, len(payload), model_id(model_name, backend, key))
+    return header + payload.tobytes()
+
+
+def is_legacy(value: EmbeddingValue) -> bool:
+    """Giá trị còn ở dạng JSON text cũ."""
+    if isinstance(value, str):
+        return True
+    return bytes(value[:1]) == b"["
+
+
+def read_header(value: EmbeddingValue) -> Tuple[int, int, int]:
+    """(dtype code, dim, model_id) của giá trị binary."""
+    magic, code, _, dim, model = _HEADER.unpack_from(bytes(value[:HEADER_SIZE]))
+    if magic != MAGIC or code not in _DTYPES:
+        raise ValueError("Not a binary embedding value")
+    return code, dim, model
+
+
+def decode_embedding(value: EmbeddingValue) -> np.ndarray:
+    """1 giá trị (binary hoặc JSON cũ) -> vector float32."""
+    if is_legacy(value):
+        text = value if isinstance(value, str) else bytes(value).decode("utf-8")
+        return np.array(json.loads(text), dtype="float32")
+    code, dim, _ = read_header(value)
+    return np.frombuffer(bytes(value), dtype=_DTYPES[code], count=dim, offset=HEADER_SIZE).astype("float32")
+
+
+def decode_embeddings(values: Sequence[EmbeddingValue]) -> np.ndarray:
+    """
+    Nhiều giá trị -> ma trận (n, dim) float32.
+
+    Khi mọi dòng cùng header (trường hợp thường gặp) chỉ nối bytes rồi
+    np.frombuffer 1 lần; có dòng JSON cũ hoặc khác dtype thì decode từng dòng.
+    """
+    n = len(values)
+    if n == 0:
+        return np.empty((0, 0), dtype="float32")
+
+    first = values[0]
+    if not is_legacy(first):
+        header = bytes(first[:HEADER_SIZE])
+        code, dim, _ = read_header(first)
+        row_size = HEADER_SIZE + dim * _DTYPES[code].itemsize
+        raw = b"".join(bytes(v) for v in values)
+        if len(raw) == n * row_size:
+            rows = np.frombuffer(raw, dtype=np.uint8).reshape(n, row_size)
+            if (rows[:, :HEADER_SIZE] == np.frombuffer(header, dtype=np.uint8)).all():
+                payload = np.ascontiguousarray(rows[:, HEADER_SIZE:])
+                return payload.view(_DTYPES[code]).astype("float32")
+
+    return np.vstack([decode_embedding(v) for v in values])
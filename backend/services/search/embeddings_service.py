@@ -8,21 +8,35 @@ Xử lý:
 - Đồng bộ với FAISS index
 """
 
-import torch
-import clip
 import numpy as np
 from PIL import Image
-from sqlmodel import Session, select
-import json
+from sqlmodel import Session, select, func
+import time
 from typing import Optional, Union
 
-from dependencies.clip_service import get_clip_model
+from dependencies.clip_batcher import encode_images, producer_model_key
+from dependencies.embedding_cache import encode_texts_cached
+from dependencies.clip_service import DIM, INFERENCE_BACKENDS
 from models import Embeddings, Assets, Folders
-from services.search.faiss_index import (
-    add_vector_to_project,
+from services.search.embedding_codec import (
+    HEADER_SIZE, encode_embedding, decode_embeddings, is_legacy, model_id, model_key, read_header
+)
+from services.search.faiss_folders import NO_FOLDER
+from services.search.vector_client import (
+    is_project_indexed,
+    get_project_asset_ids,
+    apply_project_changes,
+    get_asset_vector,
+    upsert_vector_to_project,
     remove_vector_from_project,
-    rebuild_project_index,
-    search_in_project
+    rebuild_project_index_arrays,
+    search_in_project,
+    search_user_projects,
+    search_in_project_batch,
+    search_user_projects_batch,
+    range_search_in_project,
+    range_search_user_projects,
+    merge_top_k
 )
 
 # Load CLIP model (cached)
@@ -39,15 +53,7 @@ def embed_image(image: Image.Image) -> np.ndarray:
     Returns:
         numpy array shape (512,) - normalized vector
     """
-    model, preprocess, device = get_clip_model()
-    image_tensor = preprocess(image).unsqueeze(0).to(device)
-    
-    with torch.no_grad():
-        image_features = model.encode_image(image_tensor)
-        # Normalize để dùng cosine similarity
-        image_features /= image_features.norm(dim=-1, keepdim=True)
-    
-    return image_features.cpu().numpy().astype("float32").flatten()  # shape (512,)
+    return embed_images([image])[0]  # shape (512,)
 
 
 def embed_text(text: str) -> np.ndarray:
@@ -60,15 +66,30 @@ def embed_text(text: str) -> np.ndarray:
     Returns:
         numpy array shape (512,) - normalized vector
     """
-    model, preprocess, device = get_clip_model()
-    text_token = clip.tokenize([text]).to(device)
+    return embed_texts([text])[0]  # shape (512,)
+
+
+def embed_images(images: list[Image.Image]) -> np.ndarray:
+    """
+    Tạo embeddings cho nhiều ảnh trong 1 lần forward CLIP
+    (gộp chung batch với các request đồng thời khác, xem clip_batcher).
     
-    with torch.no_grad():
-        text_features = model.encode_text(text_token)
-        # Normalize để dùng cosine similarity
-        text_features /= text_features.norm(dim=-1, keepdim=True)
+    Returns:
+        numpy array shape (n, 512) - normalized vectors
+    """
+    return encode_images(images)
+
+
+def embed_texts(texts: list[str]) -> np.ndarray:
+    """
+    Tạo embeddings cho nhiều text trong 1 lần forward CLIP
+    (gộp chung batch với các request đồng thời khác, xem clip_batcher).
+    Query đã gặp được lấy từ LRU cache (embedding_cache), không encode lại.
     
-    return text_features.cpu().numpy().astype("float32").flatten()  # shape (512,)
+    Returns:
+        numpy array shape (n, 512) - normalized vectors
+    """
+    return encode_texts_cached(texts)
 
 
 def add_embedding_to_db(
@@ -80,6 +101,7 @@ def add_embedding_to_db(
 ) -> Embeddings:
     """
     Lưu embedding vào database và đồng bộ với FAISS.
+    Nếu asset đã có embedding thì cập nhật (không tạo bản ghi/vector thứ 2).
     
     Args:
         session: Database session
@@ -91,32 +113,40 @@ def add_embedding_to_db(
     Returns:
         Embeddings object đã lưu
     """
-    # Convert numpy array to JSON string
-    embedding_json = json.dumps(embedding_vector.tolist())
+    # Vector -> BLOB (header + float32/float16), header ghi model đã tạo vector
+    # (CLIP server có thể chạy backend khác process này)
+    embedding_blob = encode_embedding(embedding_vector, key=producer_model_key())
     
-    # Tạo embedding record
-    embedding = Embeddings(
-        asset_id=asset_id,
-        project_id=project_id,
-        folder_id=folder_id,
-        embedding=embedding_json
-    )
+    # Tạo mới hoặc cập nhật embedding record
+    embedding = session.exec(
+        select(Embeddings).where(Embeddings.asset_id == asset_id)
+    ).first()
+    if embedding:
+        embedding.project_id = project_id
+        embedding.folder_id = folder_id
+        embedding.embedding = embedding_blob
+    else:
+        embedding = Embeddings(
+            asset_id=asset_id,
+            project_id=project_id,
+            folder_id=folder_id,
+            embedding=embedding_blob
+        )
     
     session.add(embedding)
     session.commit()
     session.refresh(embedding)
     
-    # Kiểm tra xem project có FAISS index chưa
-    from services.search.faiss_index import PROJECT_INDICES
-    if project_id not in PROJECT_INDICES:
+    # Kiểm tra xem project có FAISS index chưa (trong RAM hoặc trên ổ cứng)
+    if not is_project_indexed(project_id):
         try:
             # Thử rebuild index từ database
             rebuild_project_embeddings(session, project_id)
         except Exception as e:
             print(f"[Embeddings] Error rebuilding index for project {project_id}: {e}")
     
-    # Đồng bộ với FAISS index
-    add_vector_to_project(
+    # Đồng bộ với FAISS index (upsert theo asset_id)
+    upsert_vector_to_project(
         project_id=project_id,
         asset_id=asset_id,
         folder_id=folder_id,
@@ -148,30 +178,213 @@ def remove_embedding_from_db(session: Session, asset_id: int, project_id: int):
     remove_vector_from_project(project_id, asset_id)
 
 
-def rebuild_project_embeddings(session: Session, project_id: int):
+def get_exact_vectors(session: Session, asset_ids: list[int]) -> dict[int, np.ndarray]:
+    """
+    Lấy vector gốc (float32) của các asset từ database, dùng để re-rank
+    kết quả search trên index nén.
+    
+    Returns:
+        {asset_id: vector}
+    """
+    if not asset_ids:
+        return {}
+    rows = session.exec(
+        select(Embeddings.asset_id, Embeddings.embedding)
+        .where(Embeddings.asset_id.in_(asset_ids))
+    ).all()
+    if not rows:
+        return {}
+    vectors = decode_embeddings([embedding for _, embedding in rows])
+    return {asset_id: vectors[i] for i, (asset_id, _) in enumerate(rows)}
+
+
+def get_embedding_models(session: Session, project_id: int) -> dict:
+    """
+    Số vector của project theo model + backend (đọc model_id trong header).
+
+    Vector tạo bởi model / inference backend khác nhau (vd. fp32 và int8)
+    lệch nhau một chút, dùng chung 1 index làm kết quả search kém ổn định:
+    "mixed" = true thì nên re-embed các asset không khớp "current".
+
+    Returns:
+        {"current": "ViT-B/32", "models": {"ViT-B/32": 120, "ViT-B/32+int8": 3}, "legacy": 0, "mixed": true}
+    """
+    header = func.substr(Embeddings.embedding, 1, HEADER_SIZE)
+    rows = session.exec(
+        select(header, func.count())
+        .where(Embeddings.project_id == project_id)
+        .group_by(header)
+    ).all()
+    
+    current = producer_model_key()
+    names = {model_id(backend=backend): model_key(backend=backend) for backend in INFERENCE_BACKENDS}
+    names[model_id(key=current)] = current
+    models: dict[str, int] = {}
+    legacy = 0
+    for value, count in rows:
+        if is_legacy(value):
+            # JSON cũ không có header (model lúc đó luôn là fp32)
+            legacy += count
+            continue
+        _, _, model = read_header(value)
+        name = names.get(model, f"{model:08x}")
+        models[name] = models.get(name, 0) + count
+    
+    return {
+        "current": current,
+        "models": models,
+        "legacy": legacy,
+        "mixed": any(name != current for name in models),
+    }
+
+
+def rebuild_project_embeddings(session: Session, project_id: int, chunk_size: int = 2000) -> dict:
     """
     Rebuild toàn bộ FAISS index cho project từ database.
     
+    Chỉ đọc 3 cột (asset_id, folder_id, embedding) bằng server-side cursor
+    theo từng chunk, decode thẳng vào 1 ma trận float32 cấp phát trước
+    (COUNT(*) dòng). RAM dùng ~ ma trận (n * 2 KB) + 1 chunk BLOB, không
+    tạo object ORM hay list Python cho từng vector.
+    
     Args:
         session: Database session
         project_id: ID của project
+        chunk_size: Số dòng đọc từ DB mỗi lần
+    
+    Returns:
+        {"project_id", "count", "chunks", "matrix_mb", "peak_chunk_mb", "peak_mb", "seconds", "models"}
     """
     print(f"[Embeddings] Rebuilding embeddings for project {project_id}")
+    start = time.perf_counter()
+    
+    models = get_embedding_models(session, project_id)
+    if models["mixed"]:
+        print(
+            f"[Embeddings] WARNING: project {project_id} mixes vectors from {sorted(models['models'])}, "
+            f"current model is {models['current']}"
+        )
     
-    # Query tất cả embeddings của project
-    embeddings = session.exec(
-        select(Embeddings)
+    capacity = session.exec(
+        select(func.count()).select_from(Embeddings).where(Embeddings.project_id == project_id)
+    ).one()
+    asset_ids = np.empty(capacity, dtype="int64")
+    folder_ids = np.empty(capacity, dtype="int64")
+    X = np.empty((capacity, DIM), dtype="float32")
+    
+    result = session.exec(
+        select(Embeddings.asset_id, Embeddings.folder_id, Embeddings.embedding)
         .where(Embeddings.project_id == project_id)
-    ).all()
+        .execution_options(yield_per=chunk_size)
+    )
+    filled = chunks = peak_chunk_bytes = 0
+    for rows in result.partitions(chunk_size):
+        n = len(rows)
+        if filled + n > capacity:
+            # Có dòng mới được thêm sau khi COUNT -> nới rộng
+            capacity = max(capacity * 2, filled + n)
+            asset_ids = np.resize(asset_ids, capacity)
+            folder_ids = np.resize(folder_ids, capacity)
+            X = np.resize(X, (capacity, DIM))
+        
+        asset_ids[filled:filled + n] = [asset_id for asset_id, _, _ in rows]
+        folder_ids[filled:filled + n] = [NO_FOLDER if folder_id is None else folder_id for _, folder_id, _ in rows]
+        X[filled:filled + n] = decode_embeddings([embedding for _, _, embedding in rows])
+        
+        peak_chunk_bytes = max(peak_chunk_bytes, sum(len(embedding) for _, _, embedding in rows))
+        filled += n
+        chunks += 1
+    
+    # Rebuild FAISS index (X được normalize tại chỗ, không copy)
+    rebuild_project_index_arrays(project_id, asset_ids[:filled], folder_ids[:filled], X[:filled])
+    
+    report = {
+        "project_id": project_id,
+        "count": filled,
+        "chunks": chunks,
+        "matrix_mb": round(X.nbytes / 1024 / 1024, 1),
+        "peak_chunk_mb": round(peak_chunk_bytes / 1024 / 1024, 1),
+        "peak_mb": round((X.nbytes + asset_ids.nbytes + folder_ids.nbytes + peak_chunk_bytes) / 1024 / 1024, 1),
+        "seconds": round(time.perf_counter() - start, 3),
+        "models": models,
+    }
+    print(
+        f"[Embeddings] Rebuilt project {project_id}: {filled} vectors in {chunks} chunks, "
+        f"~{report['peak_mb']} MB peak ({report['seconds']}s)"
+    )
+    return report
+
+
+def reconcile_project_embeddings(session: Session, project_id: int, batch_size: int = 1000) -> dict:
+    """
+    Đồng bộ FAISS index của project với database mà không rebuild toàn bộ.
+    
+    So sánh asset_id (và folder_id) trong index với bảng Embeddings bằng
+    query chỉ lấy id, sau đó chỉ đọc vector của các asset thiếu / đổi folder
+    (theo từng batch) và xóa các asset không còn trong DB. Chi phí tỉ lệ với
+    số khác biệt, không phải kích thước thư viện ảnh.
+    
+    Args:
+        session: Database session
+        project_id: ID của project
+        batch_size: Số vector đọc từ DB mỗi lần
     
-    # Prepare data for FAISS
-    embeddings_data = []
-    for emb in embeddings:
-        embedding_vec = json.loads(emb.embedding)
-        embeddings_data.append((emb.asset_id, emb.folder_id, embedding_vec))
+    Returns:
+        {"project_id", "db_count", "index_count", "added", "removed", "moved", "seconds"}
+    """
+    start = time.perf_counter()
     
-    # Rebuild FAISS index
-    rebuild_project_index(project_id, embeddings_data)
+    # Chỉ lấy id (không đọc cột embedding)
+    db_folders = dict(session.exec(
+        select(Embeddings.asset_id, Embeddings.folder_id)
+        .where(Embeddings.project_id == project_id)
+    ).all())
+    index_asset_ids, index_folder_ids = get_project_asset_ids(project_id)
+    index_folders = {
+        asset_id: (None if folder_id == -1 else folder_id)
+        for asset_id, folder_id in zip(index_asset_ids.tolist(), index_folder_ids.tolist())
+    }
+    
+    missing = [asset_id for asset_id in db_folders if asset_id not in index_folders]
+    moved = [
+        asset_id for asset_id, folder_id in db_folders.items()
+        if asset_id in index_folders and index_folders[asset_id] != folder_id
+    ]
+    stale = [asset_id for asset_id in index_folders if asset_id not in db_folders]
+    
+    # Đọc vector của các asset cần thêm / cập nhật folder theo từng batch
+    to_fetch = missing + moved
+    for i in range(0, max(len(to_fetch), 1), batch_size):
+        batch = to_fetch[i:i + batch_size]
+        upserts = []
+        if batch:
+            rows = session.exec(
+                select(Embeddings.asset_id, Embeddings.folder_id, Embeddings.embedding)
+                .where(Embeddings.asset_id.in_(batch))
+            ).all()
+            if rows:
+                vectors = decode_embeddings([embedding for _, _, embedding in rows])
+                upserts = [
+                    (asset_id, folder_id, vectors[j])
+                    for j, (asset_id, folder_id, _) in enumerate(rows)
+                ]
+        # Xóa asset cũ cùng với batch đầu tiên
+        apply_project_changes(project_id, upserts, stale if i == 0 else [])
+    
+    report = {
+        "project_id": project_id,
+        "db_count": len(db_folders),
+        "index_count": len(index_folders),
+        "added": len(missing),
+        "removed": len(stale),
+        "moved": len(moved),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+    print(
+        f"[Embeddings] Reconciled project {project_id}: +{report['added']} -{report['removed']} "
+        f"~{report['moved']} in {report['seconds']}s"
+    )
+    return report
 
 
 def search_by_image(
@@ -202,7 +415,8 @@ def search_by_image(
     
     if project_id:
         # Search trong 1 project cụ thể
-        asset_ids = search_in_project(project_id, query_vector, k, folder_id, similarity_threshold, search_type="image" )
+        results = search_in_project(project_id, query_vector, k, folder_id, search_type="image", similarity_threshold=similarity_threshold)
+        asset_ids = [asset_id for asset_id, _ in results]
     else:
         # Search across all projects của user
         if not user_id:
@@ -217,14 +431,15 @@ def search_by_image(
         if not user_projects:
             return []
         
-        # Search trong từng project và merge results
-        all_results = []
-        for proj in user_projects:
-            proj_results = search_in_project(proj.id, query_vector, k, folder_id, similarity_threshold, search_type="image")
-            all_results.extend(proj_results)
-        
-        # Sort by similarity và lấy top k
-        asset_ids = all_results[:k]
+        # Search trong từng project và merge theo similarity
+        results = merge_top_k(
+            [
+                search_in_project(proj.id, query_vector, k, folder_id, search_type="image", similarity_threshold=similarity_threshold)
+                for proj in user_projects
+            ],
+            k
+        )
+        asset_ids = [asset_id for asset_id, _ in results]
     
     if not asset_ids:
         return []
@@ -269,7 +484,8 @@ def search_by_text(
     
     if project_id:
         # Search trong 1 project cụ thể
-        asset_ids = search_in_project(project_id, query_vector, k, folder_id, similarity_threshold, search_type="text")
+        results = search_in_project(project_id, query_vector, k, folder_id, search_type="text", similarity_threshold=similarity_threshold)
+        asset_ids = [asset_id for asset_id, _ in results]
     else:
         # Search across all projects của user
         if not user_id:
@@ -284,14 +500,15 @@ def search_by_text(
         if not user_projects:
             return []
         
-        # Search trong từng project và merge results
-        all_results = []
-        for proj in user_projects:
-            proj_results = search_in_project(proj.id, query_vector, k, folder_id, similarity_threshold, search_type="text")
-            all_results.extend(proj_results)
-        
-        # Sort by similarity và lấy top k
-        asset_ids = all_results[:k]
+        # Search trong từng project và merge theo similarity
+        results = merge_top_k(
+            [
+                search_in_project(proj.id, query_vector, k, folder_id, search_type="text", similarity_threshold=similarity_threshold)
+                for proj in user_projects
+            ],
+            k
+        )
+        asset_ids = [asset_id for asset_id, _ in results]
     
     if not asset_ids:
         return []
@@ -311,6 +528,36 @@ from typing import Union, Optional
 from PIL import Image
 import numpy as np
 
+def build_query_vector(
+    query_text: Optional[str] = None,
+    query_image: Optional[Image.Image] = None,
+    mix_ratio: float = 0.5,
+    query_image_vector: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Vector query (normalized) từ text, ảnh, hoặc trộn cả hai theo mix_ratio.
+    query_image_vector: embedding ảnh đã có sẵn (cache / asset), thay cho query_image.
+    """
+    vectors = []
+    if query_text:
+        vectors.append(embed_text(query_text))
+    if query_image_vector is not None:
+        vectors.append(np.asarray(query_image_vector, dtype="float32"))
+    elif query_image:
+        vectors.append(embed_image(query_image))
+
+    # Nếu có cả 2 → trộn (weighted average)
+    if len(vectors) == 2:
+        query_vector = (
+            (1 - mix_ratio) * vectors[0] + mix_ratio * vectors[1]
+        ).astype("float32")
+    else:
+        query_vector = vectors[0]
+
+    # Normalize vector
+    return query_vector / np.linalg.norm(query_vector)
+
+
 def search(
     session: Session,
     project_id: Optional[int],
@@ -321,46 +568,47 @@ def search(
     user_id: Optional[int] = None,
     similarity_threshold: float = 0.7,
     mix_ratio: float = 0.5,  # tỉ lệ trộn giữa text và image (0.5 = cân bằng)
+    nprobe: Optional[int] = None,  # IVF: số cluster quét (recall vs latency)
+    ef_search: Optional[int] = None,  # HNSW: efSearch (recall vs latency)
+    include_subfolders: bool = False,  # tìm cả trong các folder con của folder_id
+    query_image_vector: Optional[np.ndarray] = None,  # embedding ảnh có sẵn (cache / asset), không chạy CLIP
 ) -> list[Assets]:
     """
     Search bằng text, ảnh, hoặc kết hợp cả hai (CLIP multimodal search).
     """
 
-    if not query_text and not query_image:
+    has_image = query_image is not None or query_image_vector is not None
+    if not query_text and not has_image:
         raise ValueError("Cần ít nhất 1 trong query_text hoặc query_image")
 
     # 1️⃣ Tạo embedding vector
-    vectors = []
+    query_vector = build_query_vector(query_text, query_image, mix_ratio, query_image_vector)
     if query_text:
-        text_vec = embed_text(query_text)
-        vectors.append(text_vec)
         similarity_threshold = 0.2 # Giảm ngưỡng cho text search
-    if query_image:
-        image_vec = embed_image(query_image)
-        vectors.append(image_vec)
-
-    # Nếu có cả 2 → trộn (weighted average)
-    if len(vectors) == 2:
-        query_vector = (
-            (1 - mix_ratio) * vectors[0] + mix_ratio * vectors[1]
-        ).astype("float32")
-    else:
-        query_vector = vectors[0]
-
-    # Normalize vector
-    query_vector /= np.linalg.norm(query_vector)
 
     # 2️⃣ Search trong project hoặc tất cả project của user
-    search_type = "image" if query_image else "text"
+    search_type = "image" if has_image else "text"
+    # Vector gốc để re-rank khi index của project được lưu dạng nén
+    exact_vectors = lambda ids: get_exact_vectors(session, ids)
+    
+    # Filter theo folder (+ cây thư mục con) được đẩy xuống FAISS
+    folder_ids = None
+    if folder_id:
+        from db.crud_folder import get_folder_subtree_ids
+        folder_ids = get_folder_subtree_ids(session, folder_id) if include_subfolders else [folder_id]
     
     if project_id:
-        asset_ids = search_in_project(
+        results = search_in_project(
             project_id=project_id,
             query_vector=query_vector,
             k=k,
             folder_id=folder_id,
             search_type=search_type,
-            similarity_threshold=similarity_threshold
+            similarity_threshold=similarity_threshold,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            exact_vectors=exact_vectors,
+            folder_ids=folder_ids
         )
     else:
         if not user_id:
@@ -371,19 +619,21 @@ def search(
             select(Projects).where(Projects.user_id == user_id)
         ).all()
 
-        all_results = []
-        for proj in user_projects:
-            proj_results = search_in_project(
-                project_id=proj.id,
-                query_vector=query_vector,
-                k=k,
-                folder_id=folder_id,
-                search_type=search_type,
-                similarity_threshold=similarity_threshold
-            )
-            all_results.extend(proj_results)
+        # Top k chung theo similarity (k-way merge hoặc 1 composite index)
+        results = search_user_projects(
+            user_id=user_id,
+            project_ids=[proj.id for proj in user_projects],
+            query_vector=query_vector,
+            k=k,
+            folder_ids=folder_ids,
+            search_type=search_type,
+            similarity_threshold=similarity_threshold,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            exact_vectors=exact_vectors
+        )
 
-        asset_ids = all_results[:k]
+    asset_ids = [asset_id for asset_id, _ in results]
 
     if not asset_ids:
         return []
@@ -396,3 +646,194 @@ def search(
     sorted_assets = [asset_dict[aid] for aid in asset_ids if aid in asset_dict]
 
     return sorted_assets
+
+
+def get_asset_query_vector(session: Session, asset_id: int) -> Optional[tuple[int, np.ndarray]]:
+    """
+    (project_id, vector) của 1 asset đã có embedding, không upload / decode /
+    CLIP: đọc từ FAISS index (RAM), index nén thì đọc vector gốc trong bảng
+    Embeddings. None nếu asset chưa có embedding.
+    """
+    project_id = session.exec(
+        select(Embeddings.project_id).where(Embeddings.asset_id == asset_id)
+    ).first()
+    if project_id is None:
+        return None
+    vector = get_asset_vector(project_id, asset_id)
+    if vector is None:
+        vector = get_exact_vectors(session, [asset_id]).get(asset_id)
+    return None if vector is None else (project_id, vector)
+
+
+def search_similar_to_asset(
+    session: Session,
+    asset_id: int,
+    project_id: Optional[int] = None,
+    k: int = 10,
+    folder_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    similarity_threshold: float = 0.7,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    include_subfolders: bool = False,
+) -> list[Assets]:
+    """
+    "More like this": search bằng vector của asset có sẵn (không tính chính asset đó).
+    project_id = None: search trong tất cả project của user (giống search()).
+    """
+    found = get_asset_query_vector(session, asset_id)
+    if found is None:
+        raise ValueError(f"Asset {asset_id} chưa có embedding")
+    _, vector = found
+
+    assets = search(
+        session=session,
+        project_id=project_id,
+        query_image_vector=vector,
+        k=k + 1,
+        folder_id=folder_id,
+        user_id=user_id,
+        similarity_threshold=similarity_threshold,
+        nprobe=nprobe,
+        ef_search=ef_search,
+        include_subfolders=include_subfolders
+    )
+    return [asset for asset in assets if asset.id != asset_id][:k]
+
+
+def search_batch(
+    session: Session,
+    project_id: Optional[int],
+    query_texts: Optional[list[str]] = None,
+    query_images: Optional[list[Image.Image]] = None,
+    k: int = 10,
+    folder_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    similarity_threshold: float = 0.7,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    include_subfolders: bool = False,
+) -> list[list[tuple[Assets, float]]]:
+    """
+    Search nhiều query (text và/hoặc ảnh) cùng lúc.
+    
+    Text được encode trong 1 lần forward CLIP, ảnh trong 1 lần forward, rồi
+    cả ma trận query được search bằng 1 lần idx.search mỗi index. Text query
+    dùng ngưỡng 0.2 giống search().
+    
+    Returns:
+        Mỗi query (thứ tự: query_texts rồi query_images) 1 list (asset, similarity)
+    """
+    query_texts = query_texts or []
+    query_images = query_images or []
+    if not query_texts and not query_images:
+        raise ValueError("Cần ít nhất 1 query_text hoặc query_image")
+
+    query_vectors = np.vstack([embed_texts(query_texts), embed_images(query_images)])
+    thresholds = [0.2] * len(query_texts) + [similarity_threshold] * len(query_images)
+    exact_vectors = lambda ids: get_exact_vectors(session, ids)
+
+    folder_ids = None
+    if folder_id:
+        from db.crud_folder import get_folder_subtree_ids
+        folder_ids = get_folder_subtree_ids(session, folder_id) if include_subfolders else [folder_id]
+
+    search_kwargs = dict(
+        k=k,
+        thresholds=thresholds,
+        folder_ids=folder_ids,
+        nprobe=nprobe,
+        ef_search=ef_search,
+        exact_vectors=exact_vectors
+    )
+    if project_id:
+        results = search_in_project_batch(project_id, query_vectors, **search_kwargs)
+    else:
+        if not user_id:
+            raise ValueError("user_id required khi project_id=None")
+
+        from models.projects import Projects
+        user_projects = session.exec(
+            select(Projects).where(Projects.user_id == user_id)
+        ).all()
+        results = search_user_projects_batch(
+            user_id, [proj.id for proj in user_projects], query_vectors, **search_kwargs
+        )
+
+    # 1 query DB cho asset của tất cả query
+    all_ids = {asset_id for rows in results for asset_id, _ in rows}
+    if not all_ids:
+        return [[] for _ in results]
+    assets = session.exec(
+        select(Assets).where(Assets.id.in_(all_ids))
+    ).all()
+    asset_dict = {asset.id: asset for asset in assets}
+
+    return [
+        [(asset_dict[asset_id], score) for asset_id, score in rows if asset_id in asset_dict]
+        for rows in results
+    ]
+
+
+def search_range(
+    session: Session,
+    project_id: Optional[int],
+    similarity_threshold: float,
+    query_text: Optional[str] = None,
+    query_image: Optional[Image.Image] = None,
+    offset: int = 0,
+    limit: int = 50,
+    folder_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    mix_ratio: float = 0.5,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    include_subfolders: bool = False,
+    query_image_vector: Optional[np.ndarray] = None,
+) -> tuple[list[tuple[Assets, float]], int]:
+    """
+    Lấy tất cả assets có similarity >= similarity_threshold (FAISS range search),
+    sắp xếp giảm dần và phân trang. Ngưỡng được dùng đúng như truyền vào
+    (không tự hạ xuống 0.2 cho text như search()).
+    
+    Returns:
+        (trang kết quả [(asset, similarity)], tổng số kết quả trên ngưỡng)
+    """
+    if not query_text and query_image is None and query_image_vector is None:
+        raise ValueError("Cần ít nhất 1 trong query_text hoặc query_image")
+
+    query_vector = build_query_vector(query_text, query_image, mix_ratio, query_image_vector)
+    exact_vectors = lambda ids: get_exact_vectors(session, ids)
+
+    folder_ids = None
+    if folder_id:
+        from db.crud_folder import get_folder_subtree_ids
+        folder_ids = get_folder_subtree_ids(session, folder_id) if include_subfolders else [folder_id]
+
+    if project_id:
+        results = range_search_in_project(
+            project_id, query_vector, similarity_threshold, folder_ids, nprobe, ef_search, exact_vectors
+        )
+    else:
+        if not user_id:
+            raise ValueError("user_id required khi project_id=None")
+
+        from models.projects import Projects
+        user_projects = session.exec(
+            select(Projects).where(Projects.user_id == user_id)
+        ).all()
+        results = range_search_user_projects(
+            user_id, [proj.id for proj in user_projects], query_vector, similarity_threshold,
+            folder_ids, nprobe, ef_search, exact_vectors
+        )
+
+    page = results[offset:offset + limit]
+    if not page:
+        return [], len(results)
+
+    assets = session.exec(
+        select(Assets).where(Assets.id.in_([asset_id for asset_id, _ in page]))
+    ).all()
+    asset_dict = {asset.id: asset for asset in assets}
+
+    return [(asset_dict[asset_id], score) for asset_id, score in page if asset_id in asset_dict], len(results)
@@ -0,0 +1,111 @@
+"""
+FAISS Folder Map - asset_id -> folder_id dạng NumPy array song song với index
+
+Thay cho dict {asset_id: folder_id}: asset_ids/folder_ids được giữ trong
+2 array int64 (slot bị xóa có asset_id = -1), cộng 1 dict asset_id -> slot
+để upsert/remove O(1). Nhờ vậy filter theo folder (hoặc cả cây thư mục)
+là 1 phép np.isin thay vì vòng lặp Python, và kết quả được đưa vào FAISS
+dưới dạng IDSelector để search trả về đúng k kết quả trong folder.
+"""
+
+import numpy as np
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+# folder_id = None được lưu là -1 (giống folder_ids.npy trong snapshot)
+NO_FOLDER = -1
+
+_MIN_CAPACITY = 64
+
+
+class FolderMap:
+    """Mapping asset_id -> folder_id (có thể None) cho 1 project."""
+
+    def __init__(self, asset_ids: Optional[np.ndarray] = None, folder_ids: Optional[np.ndarray] = None):
+        asset_ids = np.empty(0, dtype="int64") if asset_ids is None else np.asarray(asset_ids, dtype="int64")
+        folder_ids = np.empty(0, dtype="int64") if folder_ids is None else np.asarray(folder_ids, dtype="int64")
+        n = len(asset_ids)
+        capacity = max(_MIN_CAPACITY, n)
+        self._asset_ids = np.full(capacity, -1, dtype="int64")
+        self._folder_ids = np.full(capacity, NO_FOLDER, dtype="int64")
+        self._asset_ids[:n] = asset_ids
+        self._folder_ids[:n] = folder_ids
+        self._size = n
+        self._slots: Dict[int, int] = dict(zip(asset_ids.tolist(), range(n)))
+
+    @classmethod
+    def from_dict(cls, mapping: Dict[int, Optional[int]]) -> "FolderMap":
+        asset_ids = np.fromiter(mapping.keys(), dtype="int64", count=len(mapping))
+        folder_ids = np.fromiter(
+            (NO_FOLDER if f is None else f for f in mapping.values()),
+            dtype="int64",
+            count=len(mapping)
+        )
+        return cls(asset_ids, folder_ids)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, asset_id: int) -> bool:
+        return asset_id in self._slots
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._slots)
+
+    def get(self, asset_id: int, default: Optional[int] = None) -> Optional[int]:
+        slot = self._slots.get(asset_id)
+        if slot is None:
+            return default
+        folder_id = int(self._folder_ids[slot])
+        return None if folder_id == NO_FOLDER else folder_id
+
+    def __getitem__(self, asset_id: int) -> Optional[int]:
+        if asset_id not in self._slots:
+            raise KeyError(asset_id)
+        return self.get(asset_id)
+
+    def __setitem__(self, asset_id: int, folder_id: Optional[int]):
+        value = NO_FOLDER if folder_id is None else folder_id
+        slot = self._slots.get(asset_id)
+        if slot is None:
+            if self._size == len(self._asset_ids):
+                self._grow()
+            slot = self._size
+            self._size += 1
+            self._asset_ids[slot] = asset_id
+            self._slots[asset_id] = slot
+        self._folder_ids[slot] = value
+
+    def __delitem__(self, asset_id: int):
+        slot = self._slots.pop(asset_id)
+        self._asset_ids[slot] = -1
+        self._folder_ids[slot] = NO_FOLDER
+        # Dọn slot trống khi quá nửa array là slot đã xóa
+        if self._size > _MIN_CAPACITY and len(self._slots) < self._size // 2:
+            self._compact()
+
+    def _grow(self):
+        capacity = max(_MIN_CAPACITY, len(self._asset_ids) * 2)
+        for name in ("_asset_ids", "_folder_ids"):
+            old = getattr(self, name)
+            new = np.full(capacity, -1, dtype="int64")
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def _compact(self):
+        asset_ids, folder_ids = self.arrays()
+        self.__init__(asset_ids, folder_ids)
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(asset_ids, folder_ids) của các asset còn sống (copy, folder None = -1)."""
+        live = self._asset_ids[:self._size] >= 0
+        return self._asset_ids[:self._size][live].copy(), self._folder_ids[:self._size][live].copy()
+
+    def ids_in_folders(self, folder_ids: Iterable[int]) -> np.ndarray:
+        """asset_ids nằm trong 1 trong các folder (vectorized)."""
+        folders = np.fromiter(folder_ids, dtype="int64")
+        mask = np.isin(self._folder_ids[:self._size], folders) & (self._asset_ids[:self._size] >= 0)
+        return self._asset_ids[:self._size][mask]
+
+    def nbytes(self) -> int:
+        """RAM ước lượng: 2 array + dict asset_id -> slot."""
+        return self._asset_ids.nbytes + self._folder_ids.nbytes + len(self._slots) * 100
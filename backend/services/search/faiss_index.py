@@ -1,17 +1,65 @@
 """
 FAISS Index Management - Project-based Architecture
 
-Mỗi project có 1 FAISS index riêng:
-- PROJECT_INDICES: {project_id: faiss.Index}
-- PROJECT_FAISS_MAP: {project_id: {faiss_id: (asset_id, folder_id)}}
-- PROJECT_ASSET_MAP: {project_id: {asset_id: faiss_id}}
+Mỗi project có 1 FAISS index riêng, FAISS id chính là asset_id:
+- PROJECT_INDICES: {project_id: faiss.IndexIDMap2}
+- PROJECT_FOLDER_MAP: {project_id: FolderMap}  (asset_id -> folder_id, NumPy arrays)
+
+Xóa dùng remove_ids thật (không còn vector "chết" trong RAM), cập nhật
+dùng upsert (remove + add_with_ids) nên mỗi asset chỉ có đúng 1 vector.
+Search theo folder (hoặc cả cây thư mục) dùng IDSelector của FAISS nên trả
+về đúng k kết quả trong folder trong 1 lần search.
+
+Persistence: mỗi upsert/remove chỉ append 1 record vào WAL (faiss_wal.py).
+Background checkpoint gộp WAL vào snapshot sau mỗi FAISS_CHECKPOINT_OPS
+thao tác hoặc FAISS_CHECKPOINT_SECONDS giây; khi khởi động, snapshot được
+tải rồi replay phần WAL chưa nằm trong snapshot.
+
+Snapshot là thư mục versioned per project (faiss_snapshot.py): index +
+asset_ids/folder_ids dạng .npy + manifest checksum, publish bằng atomic
+rename. File `project_N.index` + `project_N_mapping.pkl` cũ chỉ còn được
+đọc 1 lần để migrate.
+
+Index được tải lười (lần đầu dùng) và giữ trong LRU giới hạn bởi
+FAISS_MEMORY_BUDGET_MB; project ít dùng bị evict khỏi RAM và tự tải lại
+khi cần. Với FAISS_MMAP_LOAD, vectors được mmap từ snapshot và chỉ copy
+vào RAM khi project có thay đổi.
+
+Loại index theo kích thước project (faiss_policy.py): flat cho project nhỏ,
+tự động train và chuyển sang IVF-Flat/HNSW ở background khi vượt ngưỡng,
+train lại khi project lớn thêm FAISS_RETRAIN_GROWTH_FACTOR lần.
+
+Project lớn có thể lưu vector dạng nén (fp16 / int8 / IVF-PQ, cấu hình
+FAISS_COMPRESSION hoặc set_project_compression); search trên index nén lấy
+thêm candidates rồi re-rank bằng vector gốc do caller cung cấp (bảng Embeddings).
+
+Mỗi thư mục FAISS_INDEX_DIR chỉ có 1 process ghi (WAL, seq, snapshot), giữ
+bằng flock trên `.writer.lock`. Replica khác dùng chung thư mục phải đặt
+FAISS_WRITER_URL: chỉ đọc snapshot + WAL, mutation gửi sang writer và thay
+đổi về qua faiss_sync.
 """
 
 import faiss
+import heapq
+import itertools
 import numpy as np
 import os
 import pickle
-from typing import Dict, Tuple, Optional
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Tuple, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: không có flock
+    fcntl = None
+
+from core.config import settings
+from services.search import faiss_wal, faiss_snapshot, faiss_policy
+from services.search.faiss_folders import FolderMap, NO_FOLDER
+from services.search.rwlock import RWLock
 
 # Dimension của CLIP ViT-B/32
 DIM = 512
@@ -19,67 +67,267 @@ DIM = 512
 # Thư mục lưu trữ FAISS index trên ổ cứng
 FAISS_INDEX_DIR = "faiss_indices"
 
-# Lưu trữ FAISS index theo project_id (trong RAM)
-PROJECT_INDICES: Dict[int, faiss.Index] = {}
+# Phiên bản format mapping của file .pkl cũ (1 = faiss_id tuần tự, 2 = id = asset_id)
+MAPPING_VERSION = 2
+
+# Lưu trữ FAISS index theo project_id (trong RAM), thứ tự LRU: cũ nhất ở đầu
+PROJECT_INDICES: "OrderedDict[int, faiss.Index]" = OrderedDict()
+
+# Project đang dùng index mmap (read-only) từ snapshot
+_MMAPPED: set = set()
+
+# Số vectors tại lần train/build index gần nhất: project_id -> n
+PROJECT_TRAINED_SIZE: Dict[int, int] = {}
+
+# Compression cấu hình riêng cho project (none / fp16 / int8 / pq): project_id -> mode
+PROJECT_COMPRESSION: Dict[int, str] = {}
+
+# Project có remove kể từ lần kiểm tra compaction gần nhất
+_COMPACT_CANDIDATES: set = set()
+
+# Project đang retrain ở background: project_id -> [mutation xảy ra trong lúc build]
+_RETRAIN_DELTAS: Dict[int, list] = {}
+_RETRAIN_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="faiss-retrain")
+
+# Mapping: project_id -> FolderMap (asset_id -> folder_id)
+PROJECT_FOLDER_MAP: Dict[int, FolderMap] = {}
+
+# Composite index gộp mọi project của 1 user (FAISS_USER_COMPOSITE_INDEX):
+# user_id -> {"index", "folder_map", "projects", "lock"}. Chỉ nằm trong RAM, dựng lại
+# từ index các project khi cần, được cập nhật cùng lúc với index project.
+USER_COMPOSITE: Dict[int, dict] = {}
+_COMPOSITE_OWNER: Dict[int, int] = {}  # project_id -> user_id
+
+# Seq của mutation cuối cùng đã ghi vào WAL: project_id -> seq
+PROJECT_WAL_SEQ: Dict[int, int] = {}
+
+# Seq cuối cùng đã nằm trong snapshot trên ổ cứng: project_id -> seq
+PROJECT_SNAPSHOT_SEQ: Dict[int, int] = {}
+
+# Thông tin lần tải gần nhất (cold load time, version snapshot): project_id -> dict
+PROJECT_LOAD_STATS: Dict[int, dict] = {}
+
+# Thời điểm checkpoint gần nhất: project_id -> timestamp
+_LAST_CHECKPOINT: Dict[int, float] = {}
+
+# Project cần ghi snapshot ngay cả khi WAL rỗng (vd. vừa migrate format cũ)
+_FORCE_CHECKPOINT: set = set()
+
+# Lock cho các thao tác ghi (mutation + WAL append phải đi cùng nhau)
+_STATE_LOCK = threading.RLock()
 
-# Mapping: project_id -> {faiss_id: (asset_id, folder_id)}
-PROJECT_FAISS_MAP: Dict[int, Dict[int, Tuple[int, Optional[int]]]] = {}
+# Chỉ 1 snapshot được ghi tại 1 thời điểm
+_SAVE_LOCK = threading.Lock()
 
-# Reverse mapping: project_id -> {asset_id: faiss_id} (để xóa/update nhanh)
-PROJECT_ASSET_MAP: Dict[int, Dict[int, int]] = {}
+# Reader/writer lock cho từng index project: search chạy song song (read),
+# add/remove sửa index tại chỗ nên giữ write. Retrain/rebuild/evict không sửa
+# index đang dùng mà thay object mới vào dict (trong _STATE_LOCK), search đang
+# chạy vẫn giữ object cũ nên chỉ cần _STATE_LOCK.
+# Thứ tự lock: project write -> _STATE_LOCK -> composite write.
+_PROJECT_LOCKS: Dict[int, RWLock] = {}
+_PROJECT_LOCKS_GUARD = threading.Lock()
+
+# File lock giữ quyền ghi của process này: FAISS_INDEX_DIR -> file handle (mở suốt đời process)
+WRITER_LOCK_FILE = ".writer.lock"
+_WRITER_LOCKS: Dict[str, object] = {}
+_WRITER_LOCKS_GUARD = threading.Lock()
+
+# Listener nhận mọi thay đổi index đã ghi WAL (vd. faiss_sync publish sang replica khác)
+_CHANGE_LISTENERS: List[Callable[[dict], None]] = []
+
+# Background checkpoint worker
+_checkpoint_wakeup = threading.Event()
+_checkpoint_stop = threading.Event()
+_checkpoint_thread: Optional[threading.Thread] = None
 
 # Tạo thư mục lưu trữ nếu chưa có
 os.makedirs(FAISS_INDEX_DIR, exist_ok=True)
 
 
-def save_project_index_to_disk(project_id: int):
+def is_read_only() -> bool:
+    """Replica chỉ đọc (FAISS_WRITER_URL có giá trị): không ghi WAL / snapshot."""
+    return bool(settings.FAISS_WRITER_URL)
+
+
+def _ensure_writer():
     """
-    Lưu FAISS index của project xuống ổ cứng.
+    Giữ quyền ghi duy nhất trên FAISS_INDEX_DIR trước mọi mutation.
+    
+    Mỗi process ghi có fd WAL và seq riêng: 2 process cùng ghi 1 thư mục thì
+    trùng seq, ghi vào inode WAL đã bị checkpoint của process kia thay thế,
+    và snapshot đè lên nhau. flock chỉ cho 1 process giữ lock (tự nhả khi
+    process chết).
+    
+    Raises:
+        RuntimeError: Nếu process này là replica chỉ đọc, hoặc process khác
+            đang giữ quyền ghi
     """
-    if project_id not in PROJECT_INDICES:
+    if is_read_only():
+        raise RuntimeError(
+            f"FAISS index is read-only on this replica, send mutations to the writer at {settings.FAISS_WRITER_URL}"
+        )
+    if fcntl is None:
         return
+    with _WRITER_LOCKS_GUARD:
+        if FAISS_INDEX_DIR in _WRITER_LOCKS:
+            return
+        os.makedirs(FAISS_INDEX_DIR, exist_ok=True)
+        f = open(os.path.join(FAISS_INDEX_DIR, WRITER_LOCK_FILE), "a+")
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            raise RuntimeError(
+                f"FAISS index dir {FAISS_INDEX_DIR} is already owned by another process: "
+                "run a single vector server (VECTOR_SERVER_URL) or set FAISS_WRITER_URL on the other replicas"
+            )
+        f.seek(0)
+        f.truncate()
+        f.write(f"{os.getpid()}\n")
+        f.flush()
+        _WRITER_LOCKS[FAISS_INDEX_DIR] = f
+
+
+def save_project_index_to_disk(project_id: int):
+    """
+    Lưu snapshot FAISS index của project xuống ổ cứng (checkpoint).
     
-    try:
-        # Lưu FAISS index
-        index_path = os.path.join(FAISS_INDEX_DIR, f"project_{project_id}.index")
-        faiss.write_index(PROJECT_INDICES[project_id], index_path)
-        
-        # Lưu mapping
-        mapping_path = os.path.join(FAISS_INDEX_DIR, f"project_{project_id}_mapping.pkl")
-        with open(mapping_path, 'wb') as f:
-            pickle.dump({
-                'faiss_map': PROJECT_FAISS_MAP[project_id],
-                'asset_map': PROJECT_ASSET_MAP[project_id]
-            }, f)
+    Index được serialize trong lock (nhanh, chỉ copy bộ nhớ), việc ghi file
+    diễn ra ngoài lock nên upload không bị chặn. Snapshot được publish atomic
+    rồi mới cắt bỏ các record WAL đã nằm trong mọi snapshot còn giữ lại.
+    Replica chỉ đọc không ghi gì (writer checkpoint thay).
+    """
+    if is_read_only():
+        return
+    with _SAVE_LOCK:
+        with _STATE_LOCK:
+            if project_id not in PROJECT_INDICES:
+                return
+            idx = PROJECT_INDICES[project_id]
+            index_bytes = faiss.serialize_index(idx)
+            extra = {
+                "index_type": faiss_policy.index_type_of(idx),
+                "trained_size": PROJECT_TRAINED_SIZE.get(project_id, idx.ntotal),
+                "compression": faiss_policy.compression_of(idx),
+            }
+            if project_id in PROJECT_COMPRESSION:
+                extra["compression_mode"] = PROJECT_COMPRESSION[project_id]
+            asset_ids, folder_ids = PROJECT_FOLDER_MAP[project_id].arrays()
+            seq = PROJECT_WAL_SEQ.get(project_id, 0)
         
-    except Exception as e:
-        print(f"[FAISS] Error saving index for project {project_id}: {e}")
+        try:
+            faiss_snapshot.write_snapshot(
+                FAISS_INDEX_DIR,
+                project_id,
+                index_bytes,
+                asset_ids,
+                folder_ids,
+                wal_seq=seq,
+                keep=settings.FAISS_SNAPSHOT_KEEP,
+                extra=extra
+            )
+            
+            # Cắt WAL: chỉ bỏ các record đã nằm trong mọi version còn giữ lại, để
+            # fallback về version cũ hơn (khi version mới bị hỏng) vẫn replay đủ
+            oldest = faiss_snapshot.oldest_wal_seq(FAISS_INDEX_DIR, project_id)
+            faiss_wal.truncate_through(FAISS_INDEX_DIR, project_id, seq if oldest is None else min(seq, oldest))
+            PROJECT_SNAPSHOT_SEQ[project_id] = seq
+            _LAST_CHECKPOINT[project_id] = time.time()
+            _remove_legacy_files(project_id)
+            
+        except Exception as e:
+            print(f"[FAISS] Error saving index for project {project_id}: {e}")
+
+
+def _legacy_paths(project_id: int) -> Tuple[str, str]:
+    return (
+        os.path.join(FAISS_INDEX_DIR, f"project_{project_id}.index"),
+        os.path.join(FAISS_INDEX_DIR, f"project_{project_id}_mapping.pkl"),
+    )
+
+
+def _remove_legacy_files(project_id: int):
+    for path in _legacy_paths(project_id):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _load_legacy_files(project_id: int) -> bool:
+    """
+    Tải format cũ (project_N.index + project_N_mapping.pkl) để migrate
+    sang snapshot mới ở lần checkpoint kế tiếp.
+    """
+    index_path, mapping_path = _legacy_paths(project_id)
+    if not os.path.exists(index_path) or not os.path.exists(mapping_path):
+        return False
+    
+    idx = faiss.read_index(index_path)
+    with open(mapping_path, 'rb') as f:
+        data = pickle.load(f)
+    
+    if data.get('version', 1) < MAPPING_VERSION:
+        # Format cũ: faiss_id tuần tự + tombstone trong mapping -> chuyển sang id = asset_id
+        idx, folder_map = _migrate_legacy_index(idx, data['faiss_map'])
+    else:
+        folder_map = data['folder_map']
+    
+    PROJECT_INDICES[project_id] = idx
+    PROJECT_FOLDER_MAP[project_id] = FolderMap.from_dict(folder_map)
+    PROJECT_SNAPSHOT_SEQ[project_id] = data.get('wal_seq', 0)
+    _FORCE_CHECKPOINT.add(project_id)
+    _checkpoint_wakeup.set()
+    print(f"[FAISS] Migrating legacy index for project {project_id} ({idx.ntotal} vectors)")
+    return True
 
 
 def load_project_index_from_disk(project_id: int) -> bool:
     """
-    Tải FAISS index của project từ ổ cứng.
+    Tải FAISS index của project từ ổ cứng (snapshot mới nhất + replay WAL).
+    Thời gian cold load được đo và lưu vào PROJECT_LOAD_STATS.
     
     Returns:
         True nếu tải thành công, False nếu không
     """
     try:
-        index_path = os.path.join(FAISS_INDEX_DIR, f"project_{project_id}.index")
-        mapping_path = os.path.join(FAISS_INDEX_DIR, f"project_{project_id}_mapping.pkl")
+        start = time.perf_counter()
+        io_flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) if settings.FAISS_MMAP_LOAD else 0
+        snapshot = faiss_snapshot.read_latest_snapshot(
+            FAISS_INDEX_DIR, project_id, verify=settings.FAISS_VERIFY_CHECKSUMS, io_flags=io_flags
+        )
         
-        if not os.path.exists(index_path) or not os.path.exists(mapping_path):
+        if snapshot is not None:
+            idx, asset_ids, folder_ids, manifest = snapshot
+            PROJECT_INDICES[project_id] = idx
+            PROJECT_FOLDER_MAP[project_id] = FolderMap(asset_ids, folder_ids)
+            PROJECT_SNAPSHOT_SEQ[project_id] = manifest["wal_seq"]
+            PROJECT_TRAINED_SIZE[project_id] = manifest.get("trained_size", idx.ntotal)
+            if "compression_mode" in manifest:
+                PROJECT_COMPRESSION[project_id] = manifest["compression_mode"]
+            version = manifest["version"]
+            # read_latest_snapshot chỉ mmap index flat, IVF/HNSW được đọc vào RAM
+            if io_flags and manifest.get("index_type", faiss_policy.INDEX_FLAT) == faiss_policy.INDEX_FLAT:
+                _MMAPPED.add(project_id)
+        elif _load_legacy_files(project_id):
+            version = None
+        else:
             return False
+        read_seconds = time.perf_counter() - start
         
-        # Tải FAISS index
-        idx = faiss.read_index(index_path)
-        PROJECT_INDICES[project_id] = idx
-        
-        # Tải mapping
-        with open(mapping_path, 'rb') as f:
-            data = pickle.load(f)
-            PROJECT_FAISS_MAP[project_id] = data['faiss_map']
-            PROJECT_ASSET_MAP[project_id] = data['asset_map']
+        # Replay các thay đổi sau snapshot
+        replayed = _replay_wal(project_id)
         
+        PROJECT_LOAD_STATS[project_id] = {
+            "snapshot_version": version,
+            "index_type": faiss_policy.index_type_of(PROJECT_INDICES[project_id]),
+            "mmap": project_id in _MMAPPED,
+            "read_seconds": round(read_seconds, 4),
+            "replayed_wal_ops": replayed,
+            "load_seconds": round(time.perf_counter() - start, 4),
+        }
+        print(
+            f"[FAISS] Loaded project {project_id}: {PROJECT_INDICES[project_id].ntotal} vectors, "
+            f"snapshot {f'v{version}' if version else 'legacy'}, {replayed} WAL ops in {PROJECT_LOAD_STATS[project_id]['load_seconds']:.3f}s"
+        )
         return True
         
     except Exception as e:
@@ -87,78 +335,636 @@ def load_project_index_from_disk(project_id: int) -> bool:
         return False
 
 
+def _migrate_legacy_index(
+    old_index: faiss.Index,
+    faiss_map: Dict[int, Tuple[int, Optional[int]]]
+) -> Tuple[faiss.Index, Dict[int, Optional[int]]]:
+    """
+    Chuyển index format cũ (faiss_id tuần tự, vector đã xóa vẫn nằm trong index)
+    sang index keyed theo asset_id, chỉ giữ lại các vector còn sống.
+    """
+    idx = faiss_policy.new_flat_index()
+    folder_map: Dict[int, Optional[int]] = {}
+    
+    # Nếu 1 asset bị add nhiều lần, bản cuối cùng (faiss_id lớn nhất) là bản đúng
+    latest: Dict[int, int] = {}
+    for faiss_id, (asset_id, folder_id) in sorted(faiss_map.items()):
+        latest[asset_id] = faiss_id
+        folder_map[asset_id] = folder_id
+    
+    if latest:
+        asset_ids = np.fromiter(latest.keys(), dtype="int64", count=len(latest))
+        vectors = np.vstack([old_index.reconstruct(int(fid)) for fid in latest.values()]).astype("float32")
+        idx.add_with_ids(vectors, asset_ids)
+    
+    return idx, folder_map
+
+
+def add_change_listener(listener: Callable[[dict], None]):
+    """
+    Đăng ký hàm nhận thay đổi index: {"op": "upsert" | "remove" | "rebuild" | "reconcile",
+    "project_id", "asset_id", "folder_id", "vector", "wal_seq"}. Được gọi sau
+    khi thay đổi đã ghi WAL, trong write lock của project (đúng thứ tự ghi).
+    """
+    _CHANGE_LISTENERS.append(listener)
+
+
+def remove_change_listener(listener: Callable[[dict], None]):
+    if listener in _CHANGE_LISTENERS:
+        _CHANGE_LISTENERS.remove(listener)
+
+
+def _notify_change(event: dict):
+    for listener in _CHANGE_LISTENERS:
+        try:
+            listener(event)
+        except Exception as e:
+            print(f"[FAISS] Change listener error for project {event['project_id']}: {e}")
+
+
+def _project_lock(project_id: int) -> RWLock:
+    """RWLock của index project (tạo khi cần, không bao giờ bị xóa)."""
+    with _PROJECT_LOCKS_GUARD:
+        lock = _PROJECT_LOCKS.get(project_id)
+        if lock is None:
+            lock = _PROJECT_LOCKS[project_id] = RWLock()
+        return lock
+
+
+def _ensure_writable(project_id: int):
+    """
+    Index mmap không cho phép add/remove: copy sang bộ nhớ riêng trước khi ghi.
+    """
+    if project_id in _MMAPPED:
+        PROJECT_INDICES[project_id] = faiss.deserialize_index(
+            faiss.serialize_index(PROJECT_INDICES[project_id])
+        )
+        _MMAPPED.discard(project_id)
+
+
+def _index_remove(idx: faiss.Index, asset_id: int):
+    """Xóa vector của asset khỏi index (HNSW: đánh dấu tombstone)."""
+    ids = np.array([asset_id], dtype="int64")
+    if faiss_policy.supports_remove(idx):
+        idx.remove_ids(ids)
+    else:
+        faiss_policy.tombstone_ids(idx, ids)
+
+
+def _index_upsert(idx: faiss.Index, asset_id: int, vec: np.ndarray, replace: bool):
+    """Thêm vector với id = asset_id, xóa vector cũ trước nếu `replace`."""
+    if replace:
+        _index_remove(idx, asset_id)
+    idx.add_with_ids(vec, np.array([asset_id], dtype="int64"))
+
+
+def _apply_upsert(project_id: int, asset_id: int, folder_id: Optional[int], vec: np.ndarray):
+    """Áp dụng upsert vào index trong RAM (vec đã normalized, shape (1, DIM))."""
+    _ensure_writable(project_id)
+    
+    # Xóa vector cũ (nếu có) rồi thêm vector mới với id = asset_id
+    replace = asset_id in PROJECT_FOLDER_MAP[project_id]
+    _index_upsert(PROJECT_INDICES[project_id], asset_id, vec, replace)
+    PROJECT_FOLDER_MAP[project_id][asset_id] = folder_id
+    
+    composite = USER_COMPOSITE.get(_COMPOSITE_OWNER.get(project_id))
+    if composite is not None:
+        with composite["lock"].write():
+            _index_upsert(composite["index"], asset_id, vec, asset_id in composite["folder_map"])
+            composite["folder_map"][asset_id] = folder_id
+
+
+def _apply_remove(project_id: int, asset_id: int) -> bool:
+    """Áp dụng remove vào index trong RAM. Trả về False nếu asset không có trong index."""
+    if asset_id not in PROJECT_FOLDER_MAP[project_id]:
+        return False
+    _ensure_writable(project_id)
+    _index_remove(PROJECT_INDICES[project_id], asset_id)
+    del PROJECT_FOLDER_MAP[project_id][asset_id]
+    
+    composite = USER_COMPOSITE.get(_COMPOSITE_OWNER.get(project_id))
+    if composite is not None and asset_id in composite["folder_map"]:
+        with composite["lock"].write():
+            _index_remove(composite["index"], asset_id)
+            del composite["folder_map"][asset_id]
+    return True
+
+
+def _replay_wal(project_id: int) -> int:
+    """
+    Replay các record WAL mới hơn snapshot vào index trong RAM.
+    Upsert/remove theo asset_id là idempotent nên replay lặp lại vẫn an toàn.
+    
+    Returns:
+        Số record đã replay
+    """
+    snapshot_seq = PROJECT_SNAPSHOT_SEQ.get(project_id, 0)
+    seq = snapshot_seq
+    replayed = 0
+    for rec_seq, op, asset_id, folder_id, vector in faiss_wal.read_records(FAISS_INDEX_DIR, project_id):
+        seq = max(seq, rec_seq)
+        if rec_seq <= snapshot_seq:
+            continue
+        if op == faiss_wal.OP_UPSERT:
+            _apply_upsert(project_id, asset_id, folder_id, vector.reshape(1, -1))
+        elif op == faiss_wal.OP_REMOVE:
+            _apply_remove(project_id, asset_id)
+        replayed += 1
+    
+    PROJECT_WAL_SEQ[project_id] = seq
+    _LAST_CHECKPOINT[project_id] = time.time()
+    return replayed
+
+
+def _log_mutation(
+    project_id: int,
+    op: int,
+    asset_id: int,
+    folder_id: Optional[int] = None,
+    vector: Optional[np.ndarray] = None
+):
+    """Ghi mutation vào WAL (fsync) và đánh thức checkpoint worker nếu đủ số thao tác."""
+    _log_mutations(project_id, [(op, asset_id, folder_id, vector)])
+
+
+def _log_mutations(
+    project_id: int,
+    mutations: List[Tuple[int, int, Optional[int], Optional[np.ndarray]]]
+):
+    """Ghi nhiều mutation (op, asset_id, folder_id, vector) vào WAL với 1 lần fsync."""
+    seq = PROJECT_WAL_SEQ.get(project_id, 0)
+    records = []
+    for op, asset_id, folder_id, vector in mutations:
+        seq += 1
+        records.append((seq, op, asset_id, folder_id, vector))
+    faiss_wal.append_records(FAISS_INDEX_DIR, project_id, records)
+    PROJECT_WAL_SEQ[project_id] = seq
+    
+    # Index đang được retrain ở background cũng phải nhận thay đổi này
+    if project_id in _RETRAIN_DELTAS:
+        _RETRAIN_DELTAS[project_id].extend((op, asset_id, vector) for op, asset_id, _, vector in mutations)
+    
+    if seq - PROJECT_SNAPSHOT_SEQ.get(project_id, 0) >= settings.FAISS_CHECKPOINT_OPS:
+        _checkpoint_wakeup.set()
+
+
+def _target_compression(project_id: int, index_type: str, n: int, current: str) -> str:
+    """
+    Compression mong muốn cho project: project nhỏ hơn FAISS_COMPRESSION_MIN_VECTORS
+    giữ nguyên kiểu hiện tại (không đáng nén, int8/PQ cần đủ dữ liệu để train).
+    """
+    mode = PROJECT_COMPRESSION.get(project_id, settings.FAISS_COMPRESSION)
+    if mode != faiss_policy.COMPRESSION_NONE and n < settings.FAISS_COMPRESSION_MIN_VECTORS:
+        return current
+    return faiss_policy.effective_compression(index_type, mode)
+
+
+def _retrain_target(project_id: int) -> Optional[Tuple[str, str]]:
+    """
+    (loại index, compression) cần build lại cho project, hoặc None nếu index
+    hiện tại vẫn phù hợp. Chỉ promote (flat -> IVF/HNSW), không tự hạ cấp khi
+    project nhỏ đi.
+    """
+    idx = PROJECT_INDICES[project_id]
+    n = len(PROJECT_FOLDER_MAP[project_id])
+    current = faiss_policy.index_type_of(idx)
+    compression = faiss_policy.compression_of(idx)
+    desired = faiss_policy.choose_index_type(n)
+    
+    index_type = desired if desired != current and desired != faiss_policy.INDEX_FLAT else current
+    target_compression = _target_compression(project_id, index_type, n, compression)
+    if index_type != current or target_compression != compression:
+        return index_type, target_compression
+    # Centroids IVF cũ không còn đại diện khi project lớn lên nhiều
+    trained = PROJECT_TRAINED_SIZE.get(project_id, n)
+    if current == faiss_policy.INDEX_IVF_FLAT and n >= max(trained, 1) * settings.FAISS_RETRAIN_GROWTH_FACTOR:
+        return current, compression
+    return None
+
+
+def _maybe_schedule_retrain(project_id: int):
+    """Đưa project vào hàng đợi retrain background nếu cần (gọi trong _STATE_LOCK)."""
+    if project_id in _RETRAIN_DELTAS:
+        return
+    target = _retrain_target(project_id)
+    if target:
+        _RETRAIN_DELTAS[project_id] = []
+        _RETRAIN_EXECUTOR.submit(_retrain_project, project_id, *target)
+
+
+def _dead_ratio(idx: faiss.Index) -> float:
+    """Tỉ lệ vector đã xóa (tombstone) còn nằm trong index."""
+    return faiss_policy.count_tombstones(idx) / idx.ntotal if idx.ntotal else 0.0
+
+
+def compact_due_projects():
+    """
+    Compaction: build lại (ở background, từ vectors còn sống trong RAM) các
+    index có tỉ lệ tombstone >= FAISS_COMPACT_DEAD_RATIO. Search vẫn chạy
+    trên index cũ cho tới khi swap. Chỉ kiểm tra project có remove kể từ
+    lần gọi trước.
+    """
+    if settings.FAISS_COMPACT_DEAD_RATIO <= 0:
+        _COMPACT_CANDIDATES.clear()
+        return
+    
+    with _STATE_LOCK:
+        candidates = list(_COMPACT_CANDIDATES)
+        _COMPACT_CANDIDATES.clear()
+        for project_id in candidates:
+            idx = PROJECT_INDICES.get(project_id)
+            if idx is None or project_id in _RETRAIN_DELTAS:
+                continue
+            ratio = _dead_ratio(idx)
+            if ratio < settings.FAISS_COMPACT_DEAD_RATIO:
+                continue
+            print(f"[FAISS] Compacting project {project_id} ({ratio:.0%} tombstones)")
+            _RETRAIN_DELTAS[project_id] = []
+            _RETRAIN_EXECUTOR.submit(
+                _retrain_project,
+                project_id,
+                faiss_policy.index_type_of(idx),
+                faiss_policy.compression_of(idx)
+            )
+        
+        # Composite index của user cũng tích tombstone -> bỏ, lần search sau dựng lại
+        for user_id, composite in list(USER_COMPOSITE.items()):
+            if _dead_ratio(composite["index"]) >= settings.FAISS_COMPACT_DEAD_RATIO:
+                _drop_composite(user_id)
+
+
+def _retrain_project(project_id: int, index_type: str, compression: str = faiss_policy.COMPRESSION_NONE):
+    """
+    Build index mới (train IVF / dựng HNSW / nén / compaction) từ vectors còn sống trong RAM,
+    search vẫn chạy trên index cũ trong lúc build. Mutation xảy ra trong lúc
+    build được áp dụng lại trước khi swap.
+    
+    Index nén chỉ giữ bản decode của vectors: retrain từ index nén dùng bản
+    xấp xỉ này, rebuild từ DB (/search/rebuild) train lại trên vector gốc.
+    """
+    with _STATE_LOCK:
+        deltas = _RETRAIN_DELTAS.get(project_id)
+        idx = PROJECT_INDICES.get(project_id)
+        if deltas is None or idx is None:
+            _RETRAIN_DELTAS.pop(project_id, None)
+            return
+        ids, X = faiss_policy.extract_vectors(idx)
+        # Mutation trước thời điểm này đã nằm trong ids/X
+        deltas.clear()
+    
+    try:
+        start = time.perf_counter()
+        new_idx = faiss_policy.build_index(index_type, ids, X, compression)
+        
+        with _STATE_LOCK:
+            # Project bị rebuild từ DB hoặc bị bỏ khỏi RAM trong lúc train -> bỏ kết quả này
+            if _RETRAIN_DELTAS.get(project_id) is not deltas or project_id not in PROJECT_FOLDER_MAP:
+                return
+            for op, asset_id, vector in deltas:
+                if op == faiss_wal.OP_UPSERT:
+                    _index_upsert(new_idx, asset_id, vector.reshape(1, -1), replace=True)
+                else:
+                    _index_remove(new_idx, asset_id)
+            
+            PROJECT_INDICES[project_id] = new_idx
+            _MMAPPED.discard(project_id)
+            PROJECT_TRAINED_SIZE[project_id] = new_idx.ntotal
+            _FORCE_CHECKPOINT.add(project_id)
+            _checkpoint_wakeup.set()
+        
+        print(
+            f"[FAISS] Rebuilt project {project_id} as {index_type}/{compression} "
+            f"({new_idx.ntotal} vectors) in {time.perf_counter() - start:.2f}s"
+        )
+    except Exception as e:
+        print(f"[FAISS] Error retraining project {project_id}: {e}")
+    finally:
+        with _STATE_LOCK:
+            if _RETRAIN_DELTAS.get(project_id) is deltas:
+                del _RETRAIN_DELTAS[project_id]
+
+
+def set_project_compression(project_id: int, mode: str):
+    """
+    Cấu hình kiểu lưu vector của project (none / fp16 / int8 / pq).
+    Index được build lại ở background từ vectors trong RAM; cấu hình được
+    lưu vào manifest snapshot.
+    
+    Raises:
+        ValueError: Nếu mode không hợp lệ
+    """
+    if mode not in faiss_policy.COMPRESSION_MODES:
+        raise ValueError(f"Invalid compression mode: {mode}")
+    _ensure_writer()
+    
+    with _STATE_LOCK:
+        PROJECT_COMPRESSION[project_id] = mode
+        if get_loaded_project_index(project_id) is None:
+            return
+        _FORCE_CHECKPOINT.add(project_id)
+        _checkpoint_wakeup.set()
+        _maybe_schedule_retrain(project_id)
+
+
+def _estimate_memory_bytes(project_id: int) -> int:
+    """Ước lượng RAM của index + mapping (vectors/codes + id map + dict)."""
+    idx = PROJECT_INDICES[project_id]
+    inner = faiss.downcast_index(idx.index) if isinstance(idx, faiss.IndexIDMap) else idx
+    if isinstance(inner, faiss.IndexHNSW):
+        # vectors + links (2*M ở layer 0, int32)
+        per_vector = faiss.downcast_index(inner.storage).code_size + inner.hnsw.nb_neighbors(0) * 4
+    else:
+        per_vector = getattr(inner, "code_size", DIM * 4)
+    # id_map + rev_map (IndexIDMap2) hoặc ids + direct map (IVF) ~ 16 bytes/vector
+    return idx.ntotal * (per_vector + 16) + PROJECT_FOLDER_MAP[project_id].nbytes()
+
+
+def _evict_project(project_id: int):
+    """
+    Giải phóng index của project khỏi RAM. Không mất dữ liệu: snapshot +
+    WAL trên ổ cứng luôn chứa đầy đủ trạng thái, lần dùng sau sẽ tải lại.
+    """
+    PROJECT_INDICES.pop(project_id, None)
+    PROJECT_FOLDER_MAP.pop(project_id, None)
+    _MMAPPED.discard(project_id)
+    # Retrain đang chạy dựa trên index vừa bỏ -> hủy (kết quả sẽ bị bỏ qua)
+    _RETRAIN_DELTAS.pop(project_id, None)
+    print(f"[FAISS] Evicted project {project_id} from memory")
+
+
+def _enforce_memory_budget(keep_project_id: Optional[int] = None):
+    """Evict các project ít dùng nhất (LRU) cho tới khi tổng RAM <= FAISS_MEMORY_BUDGET_MB."""
+    budget = settings.FAISS_MEMORY_BUDGET_MB * 1024 * 1024
+    if budget <= 0:
+        return
+    
+    usage = {pid: _estimate_memory_bytes(pid) for pid in PROJECT_INDICES}
+    total = sum(usage.values())
+    for project_id in list(PROJECT_INDICES.keys()):
+        if total <= budget:
+            break
+        # Không evict project đang được dùng, đang chờ ghi snapshot migrate hoặc đang retrain
+        if project_id == keep_project_id or project_id in _FORCE_CHECKPOINT or project_id in _RETRAIN_DELTAS:
+            continue
+        _evict_project(project_id)
+        total -= usage[project_id]
+
+
+def _project_on_disk(project_id: int) -> bool:
+    """Project có snapshot, file format cũ hoặc WAL trên ổ cứng."""
+    return (
+        bool(faiss_snapshot.list_versions(FAISS_INDEX_DIR, project_id))
+        or os.path.exists(_legacy_paths(project_id)[0])
+        or os.path.exists(faiss_wal.wal_path(FAISS_INDEX_DIR, project_id))
+    )
+
+
+def get_resident_project_ids() -> List[int]:
+    """Các project đang có index trong RAM."""
+    with _STATE_LOCK:
+        return list(PROJECT_INDICES.keys())
+
+
+def is_project_indexed(project_id: int) -> bool:
+    """Project đã có FAISS index (trong RAM hoặc trên ổ cứng)."""
+    return project_id in PROJECT_INDICES or _project_on_disk(project_id)
+
+
+def get_loaded_project_index(project_id: int) -> Optional[faiss.Index]:
+    """
+    Lấy index của project nếu đã tồn tại (tải lười từ ổ cứng nếu cần),
+    không tạo index rỗng. Dùng cho search.
+    """
+    with _STATE_LOCK:
+        if project_id in PROJECT_INDICES:
+            PROJECT_INDICES.move_to_end(project_id)
+            return PROJECT_INDICES[project_id]
+        if not _project_on_disk(project_id):
+            return None
+        return get_or_create_project_index(project_id)
+
+
 def get_or_create_project_index(project_id: int) -> faiss.Index:
     """
     Lấy hoặc tạo FAISS index cho project.
-    Sử dụng IndexFlatIP (Inner Product) vì CLIP vectors đã được normalized.
-    Tự động tải từ ổ cứng nếu có.
+    Tự động tải từ ổ cứng nếu có (snapshot + replay WAL), đánh dấu là
+    vừa dùng trong LRU và evict project khác nếu vượt memory budget.
     """
-    if project_id not in PROJECT_INDICES:
+    with _STATE_LOCK:
+        if project_id in PROJECT_INDICES:
+            PROJECT_INDICES.move_to_end(project_id)
+            return PROJECT_INDICES[project_id]
+        
         # Thử tải từ ổ cứng trước
         if not load_project_index_from_disk(project_id):
-            # Nếu không tải được, tạo mới
-            idx = faiss.IndexFlatIP(DIM)  # Inner Product cho cosine similarity
-            PROJECT_INDICES[project_id] = idx
-            PROJECT_FAISS_MAP[project_id] = {}
-            PROJECT_ASSET_MAP[project_id] = {}
-    
-    return PROJECT_INDICES[project_id]
+            # Nếu không tải được, tạo mới (WAL có thể vẫn còn thay đổi chưa checkpoint)
+            PROJECT_INDICES[project_id] = faiss_policy.new_flat_index()
+            PROJECT_FOLDER_MAP[project_id] = FolderMap()
+            PROJECT_SNAPSHOT_SEQ[project_id] = 0
+            _replay_wal(project_id)
+        
+        _enforce_memory_budget(keep_project_id=project_id)
+        _maybe_schedule_retrain(project_id)
+        return PROJECT_INDICES[project_id]
 
 
-def add_vector_to_project(
+def upsert_vector_to_project(
     project_id: int,
     asset_id: int,
     folder_id: Optional[int],
     embedding: np.ndarray
 ):
     """
-    Thêm vector vào FAISS index của project.
+    Thêm hoặc cập nhật vector của asset trong FAISS index của project.
+    
+    Nếu asset đã có vector (ví dụ re-embed), vector cũ bị xóa trước
+    nên index luôn có đúng 1 dòng cho mỗi asset.
     
     Args:
         project_id: ID của project
-        asset_id: ID của asset
+        asset_id: ID của asset (dùng làm FAISS id)
         folder_id: ID của folder (có thể None)
         embedding: Vector embedding (shape: 512)
     """
-    idx = get_or_create_project_index(project_id)
+    _ensure_writer()
     
     # Chuẩn hóa vector (nếu chưa)
     vec = np.array(embedding, dtype="float32").reshape(1, -1)
     faiss.normalize_L2(vec)
     
-    # Thêm vào FAISS
-    idx.add(vec)
-    
-    # Lấy faiss_id mới (index cuối cùng)
-    faiss_id = idx.ntotal - 1
-    
-    # Lưu mapping
-    PROJECT_FAISS_MAP[project_id][faiss_id] = (asset_id, folder_id)
-    PROJECT_ASSET_MAP[project_id][asset_id] = faiss_id
-    
-    # Tự động lưu xuống ổ cứng
-    save_project_index_to_disk(project_id)
+    # Chờ các search đang chạy trên index này xong rồi mới sửa index tại chỗ
+    with _project_lock(project_id).write():
+        with _STATE_LOCK:
+            get_or_create_project_index(project_id)
+            
+            # Ghi WAL trước, rồi mới áp dụng vào RAM
+            _log_mutation(project_id, faiss_wal.OP_UPSERT, asset_id, folder_id, vec[0])
+            _apply_upsert(project_id, asset_id, folder_id, vec)
+            _maybe_schedule_retrain(project_id)
+            wal_seq = PROJECT_WAL_SEQ[project_id]
+        
+        _notify_change({
+            "op": "upsert",
+            "project_id": project_id,
+            "asset_id": asset_id,
+            "folder_id": folder_id,
+            "vector": vec[0],
+            "wal_seq": wal_seq,
+        })
+
+
+def add_vector_to_project(
+    project_id: int,
+    asset_id: int,
+    folder_id: Optional[int],
+    embedding: np.ndarray
+):
+    """
+    Thêm vector vào FAISS index của project (upsert theo asset_id).
+    """
+    upsert_vector_to_project(project_id, asset_id, folder_id, embedding)
 
 
 def remove_vector_from_project(project_id: int, asset_id: int):
     """
-    Xóa vector khỏi FAISS index.
-    
-    Note: FAISS không hỗ trợ xóa trực tiếp, cần rebuild index.
-    Đánh dấu asset_id trong mapping để bỏ qua khi search.
+    Xóa vector khỏi FAISS index (remove_ids thật, index co lại ngay;
+    riêng HNSW chỉ đánh dấu tombstone).
     """
-    if project_id not in PROJECT_ASSET_MAP:
+    _ensure_writer()
+    with _project_lock(project_id).write():
+        with _STATE_LOCK:
+            # Project bị evict vẫn phải xóa được: tải lại từ ổ cứng nếu cần
+            if get_loaded_project_index(project_id) is None:
+                return
+            if asset_id not in PROJECT_FOLDER_MAP[project_id]:
+                return
+            
+            _log_mutation(project_id, faiss_wal.OP_REMOVE, asset_id)
+            _apply_remove(project_id, asset_id)
+            _COMPACT_CANDIDATES.add(project_id)
+            wal_seq = PROJECT_WAL_SEQ[project_id]
+        
+        _notify_change({"op": "remove", "project_id": project_id, "asset_id": asset_id, "wal_seq": wal_seq})
+
+
+def get_project_asset_ids(project_id: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (asset_ids, folder_ids) đang có trong index của project (folder None = -1),
+    tải project từ ổ cứng nếu cần. Project chưa có index trả về 2 array rỗng.
+    """
+    with _STATE_LOCK:
+        if get_loaded_project_index(project_id) is None:
+            return np.empty(0, dtype="int64"), np.empty(0, dtype="int64")
+        return PROJECT_FOLDER_MAP[project_id].arrays()
+
+
+def get_asset_vector(project_id: int, asset_id: int) -> Optional[np.ndarray]:
+    """
+    Vector (đã normalize) của asset đọc thẳng từ index, không cần DB / CLIP.
+    None nếu asset không có trong index hoặc index nén (vector chỉ là xấp xỉ,
+    nên đọc vector gốc từ bảng Embeddings).
+    """
+    with _project_lock(project_id).read():
+        with _STATE_LOCK:
+            idx = get_loaded_project_index(project_id)
+            if idx is None or asset_id not in PROJECT_FOLDER_MAP[project_id]:
+                return None
+        if faiss_policy.compression_of(idx) != faiss_policy.COMPRESSION_NONE:
+            return None
+        return idx.reconstruct(int(asset_id)).astype("float32")
+
+
+def apply_project_changes(
+    project_id: int,
+    upserts: List[Tuple[int, Optional[int], np.ndarray]],
+    removes: List[int]
+):
+    """
+    Áp dụng nhiều upsert (asset_id, folder_id, vector) và remove cùng lúc:
+    1 lần ghi WAL (1 fsync), 1 lần giữ write lock. Dùng cho reconcile index
+    với DB, chi phí tỉ lệ với số thay đổi thay vì kích thước project.
+    """
+    if not upserts and not removes:
         return
+    _ensure_writer()
+    
+    vectors = np.array([vector for _, _, vector in upserts], dtype="float32").reshape(len(upserts), DIM)
+    faiss.normalize_L2(vectors)
+    
+    with _project_lock(project_id).write():
+        with _STATE_LOCK:
+            get_or_create_project_index(project_id)
+            folder_map = PROJECT_FOLDER_MAP[project_id]
+            removes = [asset_id for asset_id in removes if asset_id in folder_map]
+            
+            mutations = [
+                (faiss_wal.OP_UPSERT, asset_id, folder_id, vectors[i])
+                for i, (asset_id, folder_id, _) in enumerate(upserts)
+            ]
+            mutations += [(faiss_wal.OP_REMOVE, asset_id, None, None) for asset_id in removes]
+            _log_mutations(project_id, mutations)
+            
+            for i, (asset_id, folder_id, _) in enumerate(upserts):
+                _apply_upsert(project_id, asset_id, folder_id, vectors[i:i + 1])
+            for asset_id in removes:
+                _apply_remove(project_id, asset_id)
+            if removes:
+                _COMPACT_CANDIDATES.add(project_id)
+            _maybe_schedule_retrain(project_id)
+        
+        # Replica khác tải lại project từ snapshot + WAL thay vì nhận từng thay đổi
+        _notify_change({"op": "reconcile", "project_id": project_id})
+
+
+def apply_remote_change(event: dict) -> bool:
+    """
+    Áp dụng upsert/remove mà replica khác đã ghi vào WAL chung: chỉ sửa
+    index trong RAM, không ghi WAL lần nữa.
     
-    if asset_id in PROJECT_ASSET_MAP[project_id]:
-        faiss_id = PROJECT_ASSET_MAP[project_id][asset_id]
+    Returns:
+        False nếu project không nằm trong RAM (lần tải sau đọc từ ổ cứng đã có thay đổi)
+    """
+    project_id = event["project_id"]
+    asset_id = event["asset_id"]
+    with _project_lock(project_id).write(), _STATE_LOCK:
+        if project_id not in PROJECT_INDICES:
+            return False
         
-        # Xóa khỏi mapping (đánh dấu đã xóa)
-        del PROJECT_FAISS_MAP[project_id][faiss_id]
-        del PROJECT_ASSET_MAP[project_id][asset_id]
+        if event["op"] == "upsert":
+            vec = np.array(event["vector"], dtype="float32").reshape(1, -1)
+            faiss.normalize_L2(vec)
+            _apply_upsert(project_id, asset_id, event.get("folder_id"), vec)
+            op, vector = faiss_wal.OP_UPSERT, vec[0]
+        else:
+            _apply_remove(project_id, asset_id)
+            op, vector = faiss_wal.OP_REMOVE, None
         
-        # Tự động lưu xuống ổ cứng
-        save_project_index_to_disk(project_id)
+        # Index đang được retrain ở background cũng phải nhận thay đổi này
+        if project_id in _RETRAIN_DELTAS:
+            _RETRAIN_DELTAS[project_id].append((op, asset_id, vector))
+        PROJECT_WAL_SEQ[project_id] = max(PROJECT_WAL_SEQ.get(project_id, 0), event.get("wal_seq", 0))
+    return True
+
+
+def reload_project_from_disk(project_id: int):
+    """
+    Bỏ bản trong RAM của project, lần dùng sau tải lại snapshot + WAL mới
+    nhất (vd. replica khác vừa rebuild, hoặc bị lỡ thông báo thay đổi).
+    """
+    with _project_lock(project_id).write(), _STATE_LOCK:
+        # Retrain background đang chạy dựa trên dữ liệu cũ -> hủy
+        _RETRAIN_DELTAS.pop(project_id, None)
+        _drop_user_composite(project_id)
+        if project_id in PROJECT_INDICES:
+            _evict_project(project_id)
+
+
+def query_threshold(search_type: str, similarity_threshold: float) -> float:
+    """Ngưỡng similarity thực tế của query: text search dùng ngưỡng thấp hơn (0.2)."""
+    if search_type == "text":
+        # Điều chỉnh threshold cho text search (thường thấp hơn)
+        return 0.2
+    return similarity_threshold
 
 
 def search_in_project(
@@ -167,142 +973,681 @@ def search_in_project(
     k: int = 10,
     folder_id: Optional[int] = None,
     search_type: str = "image",
-    similarity_threshold: float = 0.7  # Ngưỡng similarity (0.7 = 70% giống nhau),
-    ) -> list[int]:
+    similarity_threshold: float = 0.7,  # Ngưỡng similarity (0.7 = 70% giống nhau)
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    exact_vectors: Optional[Callable[[List[int]], Dict[int, np.ndarray]]] = None,
+    folder_ids: Optional[Iterable[int]] = None
+    ) -> List[Tuple[int, float]]:
     """
     Tìm kiếm trong project bằng vector query.
     
+    Filter theo folder được đẩy xuống FAISS (IDSelectorBatch trên các asset
+    thuộc folder), nên search trả về đúng k kết quả trong folder mà không
+    cần lấy dư rồi lọc. Folder nhỏ (<= FAISS_FILTER_EXACT_MAX assets) trên
+    index IVF/HNSW được tính exact trên đúng tập vectors của folder, vì
+    search xấp xỉ có selector quá chặt có thể bỏ sót kết quả.
+    
+    Với index nén (fp16 / int8 / pq), score từ FAISS là xấp xỉ: lấy thêm
+    k * FAISS_RERANK_FACTOR candidates rồi tính lại score bằng vector gốc
+    từ `exact_vectors` trước khi áp dụng threshold và cắt top k.
+    
     Args:
         project_id: ID của project
         query_vector: Vector query (shape: 512)
         k: Số lượng kết quả trả về
         folder_id: Nếu có, chỉ tìm trong folder này
+        folder_ids: Nếu có, chỉ tìm trong các folder này (vd. folder + các folder con)
         similarity_threshold: Ngưỡng similarity (0-1), chỉ trả về kết quả có similarity >= threshold
+        nprobe: Số cluster quét cho index IVF (None = FAISS_IVF_NPROBE)
+        ef_search: efSearch cho index HNSW (None = FAISS_HNSW_EF_SEARCH)
+        exact_vectors: Hàm nhận list asset_id, trả về {asset_id: vector gốc} để re-rank
     
     Returns:
-        List asset_ids tìm được
+        List (asset_id, similarity) sắp xếp theo similarity giảm dần
     """
-    if project_id not in PROJECT_INDICES:
-        return []
+    if folder_ids is None and folder_id:
+        folder_ids = [folder_id]
     
-    idx = PROJECT_INDICES[project_id]
-    mapping = PROJECT_FAISS_MAP[project_id]
+    similarity_threshold = query_threshold(search_type, similarity_threshold)
     
-    if idx.ntotal == 0:
-        return []
+    return search_in_project_batch(
+        project_id,
+        np.asarray(query_vector, dtype="float32").reshape(1, -1),
+        k=k,
+        thresholds=[similarity_threshold],
+        folder_ids=folder_ids,
+        nprobe=nprobe,
+        ef_search=ef_search,
+        exact_vectors=exact_vectors
+    )[0]
+
+
+def search_in_project_batch(
+    project_id: int,
+    query_vectors: np.ndarray,
+    k: int = 10,
+    thresholds: Optional[List[float]] = None,
+    folder_ids: Optional[Iterable[int]] = None,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    exact_vectors: Optional[Callable[[List[int]], Dict[int, np.ndarray]]] = None
+) -> List[List[Tuple[int, float]]]:
+    """
+    Tìm kiếm nhiều query cùng lúc trong project: 1 lần idx.search trên ma
+    trận query (n, 512) thay vì n lần search 1 vector.
     
-    # Chuẩn hóa query vector
-    q = np.array(query_vector, dtype="float32").reshape(1, -1)
-    faiss.normalize_L2(q)
+    Args:
+        query_vectors: Ma trận query (n, 512)
+        thresholds: Ngưỡng similarity cho từng query (None = không lọc)
+    
+    Returns:
+        Mỗi query 1 list (asset_id, similarity) sắp xếp giảm dần
+    """
+    return _search_index(
+        _project_lock(project_id),
+        lambda: _resolve_project(project_id, folder_ids),
+        query_vectors, k, thresholds, nprobe, ef_search, exact_vectors
+    )
+
+
+def _resolve_project(
+    project_id: int,
+    folder_ids: Optional[Iterable[int]]
+) -> Optional[Tuple[faiss.Index, Optional[np.ndarray]]]:
+    """(index, asset_ids thuộc folder) của project, None nếu project chưa có index."""
+    with _STATE_LOCK:
+        idx = get_loaded_project_index(project_id)
+        if idx is None:
+            return None
+        subset = None if folder_ids is None else PROJECT_FOLDER_MAP[project_id].ids_in_folders(folder_ids)
+        return idx, subset
+
+
+def _resolve_composite(
+    composite: dict,
+    folder_ids: Optional[Iterable[int]]
+) -> Tuple[faiss.Index, Optional[np.ndarray]]:
+    """(index, asset_ids thuộc folder) của composite index."""
+    subset = None if folder_ids is None else composite["folder_map"].ids_in_folders(folder_ids)
+    return composite["index"], subset
+
+
+def _search_index(
+    lock: RWLock,
+    resolve: Callable[[], Optional[Tuple[faiss.Index, Optional[np.ndarray]]]],
+    query_vectors: np.ndarray,
+    k: int,
+    thresholds: Optional[List[float]],
+    nprobe: Optional[int],
+    ef_search: Optional[int],
+    exact_vectors: Optional[Callable[[List[int]], Dict[int, np.ndarray]]]
+) -> List[List[Tuple[int, float]]]:
+    """
+    Search 1 index (project hoặc composite) cho ma trận query.
     
-    # Tìm kiếm (lấy nhiều hơn k để filter theo folder)
-    search_k = k * 10 if folder_id else k
+    `resolve` trả về (index, subset asset_ids hoặc None) và được gọi trong
+    read lock của index, nên index và subset luôn khớp nhau (không có writer
+    nào add/remove giữa lúc lấy subset và lúc search). Rerank (đọc DB) và lọc
+    threshold chạy ngoài lock.
+    """
+    n = len(query_vectors)
     
-    D, I = idx.search(q, min(search_k, idx.ntotal))
+    # Chuẩn hóa query vectors
+    Q = np.array(query_vectors, dtype="float32").reshape(n, -1)
+    faiss.normalize_L2(Q)
     
-    # Lấy asset_ids
-    asset_ids = []
-    for i, fid in enumerate(I[0]):
-        if fid == -1:  # FAISS trả về -1 nếu không đủ kết quả
-            continue
+    with lock.read():
+        resolved = resolve()
+        if resolved is None:
+            return [[] for _ in range(n)]
+        idx, subset = resolved
+        if idx.ntotal == 0 or (subset is not None and len(subset) == 0):
+            return [[] for _ in range(n)]
         
-        if fid not in mapping:  # Vector đã bị xóa
-            continue
+        search_k = k
+        rerank = exact_vectors is not None and faiss_policy.compression_of(idx) != faiss_policy.COMPRESSION_NONE
+        if rerank:
+            search_k *= max(1, settings.FAISS_RERANK_FACTOR)
         
-        # Tính similarity từ distance (FAISS trả về inner product)
+        if subset is None:
+            params = faiss_policy.make_search_params(idx, nprobe=nprobe, ef_search=ef_search)
+            D, I = idx.search(Q, min(search_k, idx.ntotal), params=params)
+        elif (
+            faiss_policy.index_type_of(idx) != faiss_policy.INDEX_FLAT
+            and len(subset) <= settings.FAISS_FILTER_EXACT_MAX
+        ):
+            D, I = faiss_policy.search_subset(idx, Q, subset, search_k)
+        else:
+            sel = faiss.IDSelectorBatch(subset)
+            params = faiss_policy.make_search_params(idx, nprobe=nprobe, ef_search=ef_search, sel=sel)
+            D, I = idx.search(Q, min(search_k, len(subset)), params=params)
+    
+    all_results = []
+    for row in range(n):
+        # Candidates (FAISS id chính là asset_id, FAISS trả về -1 nếu không đủ kết quả)
         # Vì vectors đã được chuẩn hóa, inner product chính là cosine similarity
-        similarity = float(D[0][i])
-        if search_type == "text":
-            # Điều chỉnh threshold cho text search (thường thấp hơn)
-            similarity_threshold= 0.2
+        candidates = [
+            (int(asset_id), float(similarity))
+            for asset_id, similarity in zip(I[row], D[row])
+            if asset_id >= 0
+        ]
+        if rerank and candidates:
+            candidates = _rerank_exact(Q[row], candidates, exact_vectors)
+        
         # Chỉ lấy kết quả có similarity >= threshold
-        if similarity < similarity_threshold:
-            continue
+        threshold = thresholds[row] if thresholds is not None else None
+        if threshold is not None:
+            candidates = [c for c in candidates if c[1] >= threshold]
+        all_results.append(candidates[:k])
+    
+    return all_results
+
+
+def range_search_in_project(
+    project_id: int,
+    query_vector: np.ndarray,
+    similarity_threshold: float,
+    folder_ids: Optional[Iterable[int]] = None,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    exact_vectors: Optional[Callable[[List[int]], Dict[int, np.ndarray]]] = None
+) -> List[Tuple[int, float]]:
+    """
+    Lấy tất cả asset có similarity >= similarity_threshold (FAISS range_search),
+    không cần đoán k. Kết quả bị cắt ở FAISS_RANGE_MAX_RESULTS.
+    
+    Returns:
+        List (asset_id, similarity) sắp xếp theo similarity giảm dần
+    """
+    return _range_search_index(
+        _project_lock(project_id),
+        lambda: _resolve_project(project_id, folder_ids),
+        query_vector, similarity_threshold, nprobe, ef_search, exact_vectors
+    )
+
+
+def _range_search_index(
+    lock: RWLock,
+    resolve: Callable[[], Optional[Tuple[faiss.Index, Optional[np.ndarray]]]],
+    query_vector: np.ndarray,
+    similarity_threshold: float,
+    nprobe: Optional[int],
+    ef_search: Optional[int],
+    exact_vectors: Optional[Callable[[List[int]], Dict[int, np.ndarray]]]
+) -> List[Tuple[int, float]]:
+    """Range search 1 index, giới hạn trong subset asset_ids nếu có (lock/resolve như _search_index)."""
+    q = np.array(query_vector, dtype="float32").reshape(1, -1)
+    faiss.normalize_L2(q)
+    
+    with lock.read():
+        resolved = resolve()
+        if resolved is None:
+            return []
+        idx, subset = resolved
+        if idx.ntotal == 0 or (subset is not None and len(subset) == 0):
+            return []
         
-        asset_id, f_id = mapping[fid]
+        # Index nén: score xấp xỉ -> hạ ngưỡng 1 chút rồi lọc lại bằng score exact
+        rerank = exact_vectors is not None and faiss_policy.compression_of(idx) != faiss_policy.COMPRESSION_NONE
+        radius = similarity_threshold - (settings.FAISS_RANGE_RERANK_MARGIN if rerank else 0.0)
         
-        # Filter theo folder nếu có
-        if folder_id and f_id != folder_id:
-            continue
+        if subset is not None and (
+            faiss_policy.index_type_of(idx) != faiss_policy.INDEX_FLAT
+            and len(subset) <= settings.FAISS_FILTER_EXACT_MAX
+        ):
+            D, I = faiss_policy.range_search_subset(idx, q, subset, radius)
+        else:
+            sel = None if subset is None else faiss.IDSelectorBatch(subset)
+            params = faiss_policy.make_search_params(idx, nprobe=nprobe, ef_search=ef_search, sel=sel)
+            # range_search với inner product lấy score > radius (strict): lùi radius 1 ulp để giữ cả score == ngưỡng
+            _, D, I = idx.range_search(q, float(np.nextafter(np.float32(radius), np.float32(-np.inf))), params=params)
+    
+    candidates = [(int(asset_id), float(similarity)) for asset_id, similarity in zip(I, D) if asset_id >= 0]
+    if rerank and candidates:
+        candidates = _rerank_exact(q[0], candidates, exact_vectors)
+    else:
+        candidates.sort(key=lambda item: item[1], reverse=True)
+    
+    results = [c for c in candidates if c[1] >= similarity_threshold]
+    return results[:settings.FAISS_RANGE_MAX_RESULTS]
+
+
+def merge_top_k(result_lists: Iterable[List[Tuple[int, float]]], k: int) -> List[Tuple[int, float]]:
+    """
+    K-way merge (heap) các list (asset_id, similarity) đã sắp xếp giảm dần
+    của từng project thành top k chung theo similarity.
+    """
+    merged = heapq.merge(*result_lists, key=lambda item: item[1], reverse=True)
+    return list(itertools.islice(merged, k))
+
+
+def _drop_user_composite(project_id: int):
+    """Bỏ composite index chứa project (vd. project vừa rebuild), lần search sau dựng lại."""
+    _drop_composite(_COMPOSITE_OWNER.get(project_id))
+
+
+def _drop_composite(user_id: Optional[int]):
+    composite = USER_COMPOSITE.pop(user_id, None)
+    if composite is not None:
+        for pid in composite["projects"]:
+            _COMPOSITE_OWNER.pop(pid, None)
+
+
+def _get_user_composite(user_id: int, project_ids: List[int]) -> dict:
+    """
+    Composite index (1 FAISS index, id = asset_id) chứa vectors của mọi
+    project của user, dựng từ index các project đang có (không đọc DB).
+    Dựng lại khi danh sách project của user thay đổi.
+    """
+    with _STATE_LOCK:
+        projects = frozenset(project_ids)
+        composite = USER_COMPOSITE.get(user_id)
+        if composite is not None and composite["projects"] == projects:
+            return composite
+        _drop_composite(user_id)
         
-        asset_ids.append(asset_id)
+        start = time.perf_counter()
+        all_ids, all_vecs, all_folder_ids = [], [], []
+        for pid in projects:
+            idx = get_loaded_project_index(pid)
+            if idx is None:
+                continue
+            ids, X = faiss_policy.extract_vectors(idx)
+            asset_ids, folder_ids = PROJECT_FOLDER_MAP[pid].arrays()
+            all_ids.append(ids)
+            all_vecs.append(X)
+            all_folder_ids.append((asset_ids, folder_ids))
         
-        if len(asset_ids) >= k:
-            break
+        ids = np.concatenate(all_ids) if all_ids else np.empty(0, dtype="int64")
+        X = np.vstack(all_vecs) if all_vecs else np.empty((0, DIM), dtype="float32")
+        index_type = faiss_policy.choose_index_type(len(ids))
+        compression = faiss_policy.COMPRESSION_NONE
+        if len(ids) >= settings.FAISS_COMPRESSION_MIN_VECTORS:
+            compression = faiss_policy.effective_compression(index_type, settings.FAISS_COMPRESSION)
+        
+        folder_map = FolderMap(
+            np.concatenate([a for a, _ in all_folder_ids]) if all_folder_ids else None,
+            np.concatenate([f for _, f in all_folder_ids]) if all_folder_ids else None
+        )
+        composite = {
+            "index": faiss_policy.build_index(index_type, ids, X, compression),
+            "folder_map": folder_map,
+            "projects": projects,
+            "lock": RWLock(),
+        }
+        USER_COMPOSITE[user_id] = composite
+        for pid in projects:
+            _COMPOSITE_OWNER[pid] = user_id
+        print(
+            f"[FAISS] Built composite index for user {user_id}: {len(projects)} projects, "
+            f"{len(ids)} vectors in {time.perf_counter() - start:.2f}s"
+        )
+        return composite
+
+
+def search_user_projects(
+    user_id: int,
+    project_ids: List[int],
+    query_vector: np.ndarray,
+    k: int = 10,
+    folder_ids: Optional[Iterable[int]] = None,
+    search_type: str = "image",
+    similarity_threshold: float = 0.7,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    exact_vectors: Optional[Callable[[List[int]], Dict[int, np.ndarray]]] = None
+) -> List[Tuple[int, float]]:
+    """
+    Tìm kiếm trên tất cả project của user, trả về top k chung theo similarity.
+    
+    Mặc định search từng project rồi k-way merge theo score. Với
+    FAISS_USER_COMPOSITE_INDEX, cả query chỉ là 1 lần search trên composite
+    index của user (tốn thêm RAM cho 1 bản vectors, không tính vào
+    FAISS_MEMORY_BUDGET_MB).
+    
+    Returns:
+        List (asset_id, similarity) sắp xếp theo similarity giảm dần
+    """
+    similarity_threshold = query_threshold(search_type, similarity_threshold)
+    
+    return search_user_projects_batch(
+        user_id,
+        project_ids,
+        np.asarray(query_vector, dtype="float32").reshape(1, -1),
+        k=k,
+        thresholds=[similarity_threshold],
+        folder_ids=folder_ids,
+        nprobe=nprobe,
+        ef_search=ef_search,
+        exact_vectors=exact_vectors
+    )[0]
+
+
+def search_user_projects_batch(
+    user_id: int,
+    project_ids: List[int],
+    query_vectors: np.ndarray,
+    k: int = 10,
+    thresholds: Optional[List[float]] = None,
+    folder_ids: Optional[Iterable[int]] = None,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    exact_vectors: Optional[Callable[[List[int]], Dict[int, np.ndarray]]] = None
+) -> List[List[Tuple[int, float]]]:
+    """
+    Như search_user_projects cho ma trận query (n, 512): mỗi project (hoặc
+    composite index) chỉ được search 1 lần cho cả batch.
+    """
+    if settings.FAISS_USER_COMPOSITE_INDEX:
+        with _STATE_LOCK:
+            composite = _get_user_composite(user_id, project_ids)
+        return _search_index(
+            composite["lock"],
+            lambda: _resolve_composite(composite, folder_ids),
+            query_vectors, k, thresholds, nprobe, ef_search, exact_vectors
+        )
     
-    return asset_ids
+    per_project = [
+        search_in_project_batch(
+            project_id,
+            query_vectors,
+            k=k,
+            thresholds=thresholds,
+            folder_ids=folder_ids,
+            nprobe=nprobe,
+            ef_search=ef_search,
+            exact_vectors=exact_vectors
+        )
+        for project_id in project_ids
+    ]
+    return [
+        merge_top_k([results[row] for results in per_project], k)
+        for row in range(len(query_vectors))
+    ]
+
+
+def range_search_user_projects(
+    user_id: int,
+    project_ids: List[int],
+    query_vector: np.ndarray,
+    similarity_threshold: float,
+    folder_ids: Optional[Iterable[int]] = None,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    exact_vectors: Optional[Callable[[List[int]], Dict[int, np.ndarray]]] = None
+) -> List[Tuple[int, float]]:
+    """
+    Range search trên tất cả project của user (hoặc composite index),
+    gộp theo similarity giảm dần.
+    """
+    if settings.FAISS_USER_COMPOSITE_INDEX:
+        with _STATE_LOCK:
+            composite = _get_user_composite(user_id, project_ids)
+        return _range_search_index(
+            composite["lock"],
+            lambda: _resolve_composite(composite, folder_ids),
+            query_vector, similarity_threshold, nprobe, ef_search, exact_vectors
+        )
+    
+    per_project = [
+        range_search_in_project(
+            project_id, query_vector, similarity_threshold, folder_ids, nprobe, ef_search, exact_vectors
+        )
+        for project_id in project_ids
+    ]
+    return merge_top_k(per_project, settings.FAISS_RANGE_MAX_RESULTS)
+
+
+def _rerank_exact(
+    q: np.ndarray,
+    candidates: List[Tuple[int, float]],
+    exact_vectors: Callable[[List[int]], Dict[int, np.ndarray]]
+) -> List[Tuple[int, float]]:
+    """
+    Tính lại score của candidates bằng vector gốc (float32) và sắp xếp lại.
+    Candidate không có vector gốc giữ score xấp xỉ từ index.
+    """
+    vectors = exact_vectors([asset_id for asset_id, _ in candidates])
+    rescored = []
+    for asset_id, similarity in candidates:
+        vec = vectors.get(asset_id)
+        if vec is not None:
+            vec = np.asarray(vec, dtype="float32")
+            similarity = float(vec @ q / (np.linalg.norm(vec) or 1.0))
+        rescored.append((asset_id, similarity))
+    rescored.sort(key=lambda item: item[1], reverse=True)
+    return rescored
 
 
 def rebuild_project_index(project_id: int, embeddings_data: list[Tuple[int, Optional[int], list[float]]]):
     """
     Rebuild toàn bộ FAISS index cho project từ database.
+    Loại index (flat / IVF / HNSW) được chọn theo số vectors, compression
+    theo cấu hình của project.
     
     Args:
         project_id: ID của project
         embeddings_data: List of (asset_id, folder_id, embedding_vector)
     """
+    n = len(embeddings_data)
+    asset_ids = np.fromiter((asset_id for asset_id, _, _ in embeddings_data), dtype="int64", count=n)
+    folder_ids = np.fromiter(
+        (NO_FOLDER if folder_id is None else folder_id for _, folder_id, _ in embeddings_data),
+        dtype="int64",
+        count=n
+    )
+    X = np.array([embedding for _, _, embedding in embeddings_data], dtype="float32").reshape(n, DIM)
+    rebuild_project_index_arrays(project_id, asset_ids, folder_ids, X)
+
+
+def rebuild_project_index_arrays(project_id: int, asset_ids: np.ndarray, folder_ids: np.ndarray, X: np.ndarray):
+    """
+    Như rebuild_project_index nhưng nhận thẳng array song song (không tạo
+    list Python cho từng vector). X được normalize tại chỗ.
     
-    # Tạo index mới
-    idx = faiss.IndexFlatIP(DIM)
-    faiss_map = {}
-    asset_map = {}
+    Args:
+        asset_ids: (n,) int64
+        folder_ids: (n,) int64, folder None = -1
+        X: (n, DIM) float32
+    """
+    _ensure_writer()
+    asset_ids = np.asarray(asset_ids, dtype="int64")
+    folder_ids = np.asarray(folder_ids, dtype="int64")
+    X = np.ascontiguousarray(X, dtype="float32")
     
-    if embeddings_data:
-        vectors = []
-        for asset_id, folder_id, embedding in embeddings_data:
-            vec = np.array(embedding, dtype="float32")
-            vectors.append(vec)
-        
-        # Convert to numpy array và normalize
-        X = np.array(vectors, dtype="float32")
+    # Mỗi asset chỉ giữ 1 vector (bản cuối cùng nếu DB có trùng)
+    _, last = np.unique(asset_ids[::-1], return_index=True)
+    if len(last) != len(asset_ids):
+        keep = np.sort(len(asset_ids) - 1 - last)
+        asset_ids, folder_ids, X = asset_ids[keep], folder_ids[keep], X[keep]
+    
+    if len(asset_ids):
         faiss.normalize_L2(X)
-        
-        # Add vào index
-        idx.add(X)
-        
-        # Tạo mapping
-        for i, (asset_id, folder_id, _) in enumerate(embeddings_data):
-            faiss_map[i] = (asset_id, folder_id)
-            asset_map[asset_id] = i
+        # Build index với id = asset_id (train trên vector gốc, kể cả index nén)
+        index_type = faiss_policy.choose_index_type(len(asset_ids))
+        compression = _target_compression(project_id, index_type, len(asset_ids), faiss_policy.COMPRESSION_NONE)
+        idx = faiss_policy.build_index(index_type, asset_ids, X, compression)
+    else:
+        idx = faiss_policy.new_flat_index()
     
     # Cập nhật global state
-    PROJECT_INDICES[project_id] = idx
-    PROJECT_FAISS_MAP[project_id] = faiss_map
-    PROJECT_ASSET_MAP[project_id] = asset_map
+    with _project_lock(project_id).write(), _STATE_LOCK:
+        PROJECT_INDICES[project_id] = idx
+        PROJECT_INDICES.move_to_end(project_id)
+        PROJECT_FOLDER_MAP[project_id] = FolderMap(asset_ids, folder_ids)
+        # Project chưa được tải (lazy load) không có seq trong RAM nhưng WAL / snapshot
+        # trên ổ cứng vẫn còn: seq tiếp theo phải lớn hơn mọi record cũ, nếu không
+        # snapshot mới (wal_seq thấp) sẽ replay lại record cũ khi tải lại
+        PROJECT_WAL_SEQ[project_id] = _last_seq_on_disk(project_id)
+        PROJECT_TRAINED_SIZE[project_id] = idx.ntotal
+        _MMAPPED.discard(project_id)
+        # Retrain background đang chạy (nếu có) dựa trên dữ liệu cũ -> hủy
+        _RETRAIN_DELTAS.pop(project_id, None)
+        _drop_user_composite(project_id)
+        _enforce_memory_budget(keep_project_id=project_id)
     
-    # Tự động lưu xuống ổ cứng
+    # Snapshot mới (wal_seq >= mọi record cũ) thay thế toàn bộ WAL cũ
     save_project_index_to_disk(project_id)
+    
+    with _project_lock(project_id).write():
+        _notify_change({"op": "rebuild", "project_id": project_id})
+
+
+def _last_seq_on_disk(project_id: int) -> int:
+    """Seq lớn nhất đã dùng cho project: trong RAM, WAL hoặc manifest snapshot."""
+    manifest = faiss_snapshot.read_latest_manifest(FAISS_INDEX_DIR, project_id) or {}
+    return max(
+        PROJECT_WAL_SEQ.get(project_id, 0),
+        faiss_wal.last_seq(FAISS_INDEX_DIR, project_id),
+        manifest.get("wal_seq", 0),
+    )
 
 
 def get_project_stats(project_id: int) -> dict:
-    """Lấy thống kê về FAISS index của project."""
-    if project_id not in PROJECT_INDICES:
-        return {"total_vectors": 0, "indexed": False}
+    """
+    Lấy thống kê về FAISS index của project.
+    Không tải index vào RAM: project không resident thì đọc từ manifest snapshot.
+    """
+    manifest = faiss_snapshot.read_latest_manifest(FAISS_INDEX_DIR, project_id)
+    on_disk = _project_on_disk(project_id)
     
-    idx = PROJECT_INDICES[project_id]
-    return {
-        "total_vectors": idx.ntotal,
+    # Đọc trạng thái resident trong lock: project có thể bị evict/retrain cùng lúc
+    with _STATE_LOCK:
+        return _project_stats(project_id, manifest, on_disk)
+
+
+def _project_stats(project_id: int, manifest: Optional[dict], on_disk: bool) -> dict:
+    resident = project_id in PROJECT_INDICES
+    
+    if not resident and not on_disk:
+        return {"total_vectors": 0, "indexed": False, "resident": False, "on_disk": False}
+    
+    if resident:
+        idx = PROJECT_INDICES[project_id]
+        index_type = faiss_policy.index_type_of(idx)
+        compression = faiss_policy.compression_of(idx)
+    else:
+        index_type = (manifest or {}).get("index_type", faiss_policy.INDEX_FLAT)
+        compression = (manifest or {}).get("compression", faiss_policy.COMPRESSION_NONE)
+    
+    stats = {
+        "total_vectors": PROJECT_INDICES[project_id].ntotal if resident else (manifest or {}).get("count", 0),
         "indexed": True,
-        "dimension": DIM
+        "dimension": DIM,
+        "index_type": index_type,
+        "compression": compression,
+        "compression_mode": PROJECT_COMPRESSION.get(
+            project_id, (manifest or {}).get("compression_mode", settings.FAISS_COMPRESSION)
+        ),
+        "trained_size": PROJECT_TRAINED_SIZE.get(project_id, (manifest or {}).get("trained_size")),
+        "retraining": project_id in _RETRAIN_DELTAS,
+        "resident": resident,
+        "on_disk": on_disk,
+        "snapshot_version": manifest["version"] if manifest else None,
+        "pending_wal_ops": PROJECT_WAL_SEQ.get(project_id, 0) - PROJECT_SNAPSHOT_SEQ.get(project_id, 0),
+        "load": PROJECT_LOAD_STATS.get(project_id)
     }
+    if resident:
+        stats["mmap"] = project_id in _MMAPPED
+        stats["memory_bytes"] = _estimate_memory_bytes(project_id)
+        stats["tombstones"] = faiss_policy.count_tombstones(idx)
+        stats["dead_ratio"] = round(_dead_ratio(idx), 4)
+    return stats
 
 
 def load_all_indices_from_disk():
     """
-    Tải tất cả FAISS index từ ổ cứng khi khởi động server.
+    Quét các FAISS index trên ổ cứng khi khởi động server.
+    
+    Mặc định index được tải lười khi dùng lần đầu; chỉ khi FAISS_PRELOAD bật
+    thì mới tải trước (vẫn bị giới hạn bởi FAISS_MEMORY_BUDGET_MB).
+    Writer lấy quyền ghi ngay lúc khởi động (báo lỗi sớm nếu thư mục đã có
+    process khác ghi).
     """
+    if is_read_only():
+        print(f"[FAISS] Read-only replica, mutations go to writer {settings.FAISS_WRITER_URL}")
+        if not settings.FAISS_SYNC_ENABLED:
+            print("[FAISS] Warning: FAISS_SYNC_ENABLED is off, this replica will not see the writer's changes until restart")
+    else:
+        _ensure_writer()
     if not os.path.exists(FAISS_INDEX_DIR):
         return
     
-    loaded_count = 0
+    start = time.perf_counter()
+    project_ids = set(faiss_snapshot.list_project_ids(FAISS_INDEX_DIR))
     for filename in os.listdir(FAISS_INDEX_DIR):
-        if filename.startswith("project_") and filename.endswith(".index"):
-            # Extract project_id from filename
-            try:
-                project_id = int(filename.replace("project_", "").replace(".index", ""))
-                if load_project_index_from_disk(project_id):
-                    loaded_count += 1
-            except ValueError:
-                continue
+        # Project chỉ có format cũ (.index) hoặc chỉ có WAL (chưa checkpoint lần nào)
+        for suffix in (".index", ".wal"):
+            if filename.startswith("project_") and filename.endswith(suffix):
+                # Extract project_id from filename
+                try:
+                    project_ids.add(int(filename.replace("project_", "").replace(suffix, "")))
+                except ValueError:
+                    continue
+    
+    if not settings.FAISS_PRELOAD:
+        print(f"[FAISS] Found {len(project_ids)} indices on disk (lazy loading)")
+        return
     
-    print(f"[FAISS] Loaded {loaded_count} indices from disk")
+    loaded_count = 0
+    for project_id in sorted(project_ids):
+        if project_id not in PROJECT_INDICES:
+            get_or_create_project_index(project_id)
+            loaded_count += 1
+    
+    print(f"[FAISS] Loaded {loaded_count} indices from disk in {time.perf_counter() - start:.2f}s")
+
+
+def checkpoint_due_projects(force: bool = False):
+    """
+    Gộp WAL vào snapshot cho các project đã đủ FAISS_CHECKPOINT_OPS thao tác
+    hoặc có thay đổi chưa checkpoint quá FAISS_CHECKPOINT_SECONDS giây.
+    """
+    if is_read_only():
+        # Retrain trong RAM vẫn đánh dấu project, writer mới là nơi ghi snapshot
+        _FORCE_CHECKPOINT.clear()
+        return
+    now = time.time()
+    for project_id in list(PROJECT_INDICES.keys()):
+        pending = PROJECT_WAL_SEQ.get(project_id, 0) - PROJECT_SNAPSHOT_SEQ.get(project_id, 0)
+        if project_id in _FORCE_CHECKPOINT:
+            _FORCE_CHECKPOINT.discard(project_id)
+            save_project_index_to_disk(project_id)
+            continue
+        if pending <= 0:
+            continue
+        age = now - _LAST_CHECKPOINT.get(project_id, now)
+        if force or pending >= settings.FAISS_CHECKPOINT_OPS or age >= settings.FAISS_CHECKPOINT_SECONDS:
+            save_project_index_to_disk(project_id)
+
+
+def _checkpoint_loop():
+    while not _checkpoint_stop.is_set():
+        _checkpoint_wakeup.wait(timeout=1.0)
+        _checkpoint_wakeup.clear()
+        try:
+            checkpoint_due_projects()
+            compact_due_projects()
+        except Exception as e:
+            print(f"[FAISS] Checkpoint error: {e}")
+
+
+def start_checkpoint_worker():
+    """Khởi động background thread gộp WAL vào snapshot."""
+    global _checkpoint_thread
+    if _checkpoint_thread and _checkpoint_thread.is_alive():
+        return
+    _checkpoint_stop.clear()
+    _checkpoint_thread = threading.Thread(target=_checkpoint_loop, name="faiss-checkpoint", daemon=True)
+    _checkpoint_thread.start()
+
+
+def stop_checkpoint_worker():
+    """Dừng checkpoint worker và checkpoint toàn bộ thay đổi còn lại (khi shutdown)."""
+    _checkpoint_stop.set()
+    _checkpoint_wakeup.set()
+    if _checkpoint_thread:
+        _checkpoint_thread.join(timeout=10)
+    checkpoint_due_projects(force=True)
+    faiss_wal.close_all()
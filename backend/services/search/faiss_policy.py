@@ -0,0 +1,286 @@
+"""
+FAISS Index Policy - Chọn loại index theo kích thước project
+
+- flat     : IndexIDMap2(IndexFlatIP)      - exact, cho project nhỏ
+- ivf_flat : IndexIVFFlat (id = asset_id)  - cần train, tunable nprobe
+- hnsw     : IndexIDMap2(IndexHNSWFlat)    - không cần train, tunable efSearch
+
+Ngưỡng chuyển loại cấu hình bằng FAISS_IVF_MIN_VECTORS / FAISS_HNSW_MIN_VECTORS.
+
+Compression (lưu vector dạng nén, áp dụng độc lập với loại index):
+- none : float32 (2048 bytes/vector)
+- fp16 : ScalarQuantizer QT_fp16 (1024 bytes/vector, 2x)
+- int8 : ScalarQuantizer QT_8bit (512 bytes/vector, 4x), cần train
+- pq   : IVF-PQ với FAISS_PQ_M sub-quantizer (FAISS_PQ_M bytes/vector, tới 32x);
+         chỉ áp dụng cho IVF, index flat/HNSW dùng int8
+Kết quả search trên index nén là xấp xỉ: caller re-rank top candidates bằng
+vector gốc (xem search_in_project).
+HNSW không hỗ trợ remove_ids: vector bị xóa được đánh dấu tombstone bằng
+cách đổi id trong id_map sang số âm và bị loại khi search bằng IDSelector.
+"""
+
+import math
+import faiss
+import numpy as np
+from typing import Optional, Tuple
+
+from core.config import settings
+
+# Dimension của CLIP ViT-B/32
+DIM = 512
+
+INDEX_FLAT = "flat"
+INDEX_IVF_FLAT = "ivf_flat"
+INDEX_HNSW = "hnsw"
+
+COMPRESSION_NONE = "none"
+COMPRESSION_FP16 = "fp16"
+COMPRESSION_INT8 = "int8"
+COMPRESSION_PQ = "pq"
+COMPRESSION_MODES = (COMPRESSION_NONE, COMPRESSION_FP16, COMPRESSION_INT8, COMPRESSION_PQ)
+
+_SQ_TYPES = {
+    COMPRESSION_FP16: faiss.ScalarQuantizer.QT_fp16,
+    COMPRESSION_INT8: faiss.ScalarQuantizer.QT_8bit,
+}
+
+# Chỉ các id >= 0 là vector còn sống (tombstone HNSW dùng id âm)
+_LIVE_ID_MAX = 2 ** 62
+
+
+def choose_index_type(n: int) -> str:
+    """Loại index phù hợp cho project có n vectors."""
+    if settings.FAISS_HNSW_MIN_VECTORS > 0 and n >= settings.FAISS_HNSW_MIN_VECTORS:
+        return INDEX_HNSW
+    if settings.FAISS_IVF_MIN_VECTORS > 0 and n >= settings.FAISS_IVF_MIN_VECTORS:
+        return INDEX_IVF_FLAT
+    return INDEX_FLAT
+
+
+def index_type_of(idx: faiss.Index) -> str:
+    """Loại index (flat / ivf_flat / hnsw) của 1 index đã tạo."""
+    if isinstance(idx, faiss.IndexIVF):
+        return INDEX_IVF_FLAT
+    if isinstance(idx, faiss.IndexIDMap):
+        inner = faiss.downcast_index(idx.index)
+        if isinstance(inner, faiss.IndexHNSW):
+            return INDEX_HNSW
+    return INDEX_FLAT
+
+
+def _sq_compression(sq: faiss.ScalarQuantizer) -> str:
+    return COMPRESSION_FP16 if sq.qtype == faiss.ScalarQuantizer.QT_fp16 else COMPRESSION_INT8
+
+
+def compression_of(idx: faiss.Index) -> str:
+    """Kiểu lưu vector (none / fp16 / int8 / pq) của 1 index đã tạo."""
+    if isinstance(idx, faiss.IndexIVF):
+        if isinstance(idx, faiss.IndexIVFPQ):
+            return COMPRESSION_PQ
+        if isinstance(idx, faiss.IndexIVFScalarQuantizer):
+            return _sq_compression(idx.sq)
+        return COMPRESSION_NONE
+    inner = faiss.downcast_index(idx.index) if isinstance(idx, faiss.IndexIDMap) else idx
+    if isinstance(inner, faiss.IndexHNSW):
+        inner = faiss.downcast_index(inner.storage)
+    if isinstance(inner, faiss.IndexScalarQuantizer):
+        return _sq_compression(inner.sq)
+    return COMPRESSION_NONE
+
+
+def effective_compression(index_type: str, compression: str) -> str:
+    """Compression thực tế cho loại index: PQ chỉ dùng cho IVF, còn lại hạ về int8."""
+    if compression == COMPRESSION_PQ and index_type != INDEX_IVF_FLAT:
+        return COMPRESSION_INT8
+    return compression
+
+
+def new_flat_index() -> faiss.Index:
+    """
+    Index rỗng: IndexFlatIP (Inner Product vì CLIP vectors đã normalized)
+    bọc trong IndexIDMap2 để FAISS id = asset_id và hỗ trợ remove_ids/reconstruct.
+    """
+    return faiss.IndexIDMap2(faiss.IndexFlatIP(DIM))
+
+
+def _ivf_nlist(n: int) -> int:
+    # ~4 * sqrt(n) clusters, mỗi cluster cần đủ điểm để train
+    return max(1, min(int(4 * math.sqrt(n)), n // 39, 65536))
+
+
+def _train_sample(X: np.ndarray, size: int) -> np.ndarray:
+    if size >= len(X):
+        return X
+    rng = np.random.default_rng(0)
+    return X[rng.choice(len(X), size, replace=False)]
+
+
+def build_index(
+    index_type: str,
+    ids: np.ndarray,
+    X: np.ndarray,
+    compression: str = COMPRESSION_NONE
+) -> faiss.Index:
+    """
+    Tạo index loại `index_type` từ vectors X (đã normalized) với id = asset_id.
+    IVF và các index nén int8/PQ được train trên (mẫu của) X trước khi add.
+    """
+    ids = np.ascontiguousarray(ids, dtype="int64")
+    X = np.ascontiguousarray(X, dtype="float32")
+    compression = effective_compression(index_type, compression)
+    metric = faiss.METRIC_INNER_PRODUCT
+
+    if index_type == INDEX_IVF_FLAT and len(X) > 0:
+        nlist = _ivf_nlist(len(X))
+        quantizer = faiss.IndexFlatIP(DIM)
+        if compression == COMPRESSION_PQ:
+            idx = faiss.IndexIVFPQ(quantizer, DIM, nlist, settings.FAISS_PQ_M, 8, metric)
+        elif compression in _SQ_TYPES:
+            idx = faiss.IndexIVFScalarQuantizer(quantizer, DIM, nlist, _SQ_TYPES[compression], metric)
+        else:
+            idx = faiss.IndexIVFFlat(quantizer, DIM, nlist, metric)
+        # PQ 8 bit cần ~256 * 39 điểm để train codebook
+        sample_size = max(nlist * 256, 256 * 39) if compression == COMPRESSION_PQ else nlist * 256
+        idx.train(_train_sample(X, sample_size))
+        # Hashtable direct map: remove_ids + reconstruct theo asset_id
+        idx.set_direct_map_type(faiss.DirectMap.Hashtable)
+        idx.nprobe = settings.FAISS_IVF_NPROBE
+    elif index_type == INDEX_HNSW:
+        if compression in _SQ_TYPES:
+            inner = faiss.IndexHNSWSQ(DIM, _SQ_TYPES[compression], settings.FAISS_HNSW_M, metric)
+            inner.train(_train_sample(X, 65536))
+        else:
+            inner = faiss.IndexHNSWFlat(DIM, settings.FAISS_HNSW_M, metric)
+        inner.hnsw.efConstruction = settings.FAISS_HNSW_EF_CONSTRUCTION
+        inner.hnsw.efSearch = settings.FAISS_HNSW_EF_SEARCH
+        idx = faiss.IndexIDMap2(inner)
+    elif compression in _SQ_TYPES and len(X) > 0:
+        inner = faiss.IndexScalarQuantizer(DIM, _SQ_TYPES[compression], metric)
+        inner.train(_train_sample(X, 65536))
+        idx = faiss.IndexIDMap2(inner)
+    else:
+        idx = new_flat_index()
+
+    if len(X) > 0:
+        idx.add_with_ids(X, ids)
+    return idx
+
+
+def supports_remove(idx: faiss.Index) -> bool:
+    """HNSW không hỗ trợ remove_ids (dùng tombstone)."""
+    return index_type_of(idx) != INDEX_HNSW
+
+
+def _id_map_view(idx: faiss.Index) -> np.ndarray:
+    # View numpy (ghi được) lên id_map của IndexIDMap2
+    return faiss.rev_swig_ptr(idx.id_map.data(), idx.id_map.size())
+
+
+def tombstone_ids(idx: faiss.Index, ids: np.ndarray) -> int:
+    """
+    Đánh dấu các id là đã xóa trong index HNSW: id trong id_map đổi thành
+    -(id + 2), search loại chúng bằng IDSelector. Trả về số vector bị đánh dấu.
+    """
+    id_map = _id_map_view(idx)
+    mask = np.isin(id_map, ids)
+    id_map[mask] = -(id_map[mask] + 2)
+    return int(mask.sum())
+
+
+def count_tombstones(idx: faiss.Index) -> int:
+    """Số vector đã xóa nhưng vẫn còn nằm trong index (chỉ HNSW)."""
+    if index_type_of(idx) != INDEX_HNSW or idx.ntotal == 0:
+        return 0
+    return int((_id_map_view(idx) < 0).sum())
+
+
+def extract_vectors(idx: faiss.Index) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Lấy toàn bộ (ids, vectors) còn sống trong index, không cần đọc database.
+    Với index nén, vectors là bản decode (xấp xỉ) của codes.
+    """
+    n = idx.ntotal
+    if n == 0:
+        return np.empty(0, dtype="int64"), np.empty((0, DIM), dtype="float32")
+
+    if isinstance(idx, faiss.IndexIVF):
+        invlists = idx.invlists
+        raw = isinstance(idx, faiss.IndexIVFFlat)
+        all_ids, all_vecs = [], []
+        for list_no in range(idx.nlist):
+            size = invlists.list_size(list_no)
+            if size == 0:
+                continue
+            all_ids.append(faiss.rev_swig_ptr(invlists.get_ids(list_no), size).copy())
+            if raw:
+                codes = faiss.rev_swig_ptr(invlists.get_codes(list_no), size * idx.code_size)
+                all_vecs.append(codes.view("float32").reshape(size, DIM).copy())
+        ids = np.concatenate(all_ids)
+        if raw:
+            return ids, np.vstack(all_vecs)
+        # Index nén: decode qua direct map (xấp xỉ, không phải vector gốc)
+        return ids, idx.reconstruct_batch(ids)
+
+    inner = faiss.downcast_index(idx.index)
+    ids = faiss.vector_to_array(idx.id_map)
+    X = inner.reconstruct_n(0, n)
+    live = ids >= 0
+    return ids[live], X[live]
+
+
+def search_subset(
+    idx: faiss.Index,
+    q: np.ndarray,
+    ids: np.ndarray,
+    k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Search exact (brute force) chỉ trên các id cho trước, dùng vector
+    reconstruct từ index. q là ma trận query (n, DIM); trả về (D, I) cùng
+    format với idx.search.
+    """
+    ids = np.ascontiguousarray(ids, dtype="int64")
+    X = idx.reconstruct_batch(ids)
+    scores = q @ X.T
+    top = np.argsort(-scores, axis=1)[:, :k]
+    return np.take_along_axis(scores, top, axis=1), ids[top]
+
+
+def range_search_subset(
+    idx: faiss.Index,
+    q: np.ndarray,
+    ids: np.ndarray,
+    radius: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Range search exact chỉ trên các id cho trước (1 query).
+    Trả về (D, I) của các vector có score >= radius.
+    """
+    ids = np.ascontiguousarray(ids, dtype="int64")
+    scores = idx.reconstruct_batch(ids) @ q[0]
+    mask = scores >= radius
+    return scores[mask], ids[mask]
+
+
+def make_search_params(
+    idx: faiss.Index,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    sel: Optional[faiss.IDSelector] = None
+) -> Optional[faiss.SearchParameters]:
+    """
+    Tham số search theo loại index: nprobe cho IVF, efSearch cho HNSW,
+    kèm IDSelector (HNSW luôn có selector loại tombstone).
+    """
+    # Truyền qua kwargs để SearchParameters giữ reference tới selector
+    kwargs = {} if sel is None else {"sel": sel}
+    index_type = index_type_of(idx)
+    if index_type == INDEX_IVF_FLAT:
+        return faiss.SearchParametersIVF(nprobe=nprobe or settings.FAISS_IVF_NPROBE, **kwargs)
+    if index_type == INDEX_HNSW:
+        if sel is None:
+            kwargs["sel"] = faiss.IDSelectorRange(0, _LIVE_ID_MAX)
+        return faiss.SearchParametersHNSW(efSearch=ef_search or settings.FAISS_HNSW_EF_SEARCH, **kwargs)
+    if kwargs:
+        return faiss.SearchParameters(**kwargs)
+    return None
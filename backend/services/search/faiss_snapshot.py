@@ -0,0 +1,248 @@
+"""
+FAISS Snapshot - Versioned, crash-safe on-disk format per project
+
+Layout:
+    faiss_indices/project_N/
+        v000001/
+            index.faiss      # FAISS index (faiss.write_index)
+            asset_ids.npy    # int64, id trong index
+            folder_ids.npy   # int64, song song với asset_ids (-1 = None)
+            manifest.json    # version, wal_seq, count, sha256 từng file
+
+Snapshot được ghi vào thư mục tạm `.tmp-*` rồi publish bằng 1 lần
+os.rename (atomic), nên không bao giờ có trạng thái index và mapping lệch nhau.
+Khi tải, chọn version mới nhất có manifest + checksum hợp lệ; các file .npy
+được mở bằng mmap. Không dùng pickle.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import faiss
+import numpy as np
+from typing import List, Optional, Tuple
+
+FORMAT_VERSION = 1
+
+INDEX_FILE = "index.faiss"
+ASSET_IDS_FILE = "asset_ids.npy"
+FOLDER_IDS_FILE = "folder_ids.npy"
+MANIFEST_FILE = "manifest.json"
+
+
+def project_dir(index_dir: str, project_id: int) -> str:
+    """Thư mục chứa các snapshot của project."""
+    return os.path.join(index_dir, f"project_{project_id}")
+
+
+def _version_name(version: int) -> str:
+    return f"v{version:06d}"
+
+
+def list_versions(index_dir: str, project_id: int) -> List[int]:
+    """Các version snapshot đã publish của project (tăng dần)."""
+    path = project_dir(index_dir, project_id)
+    if not os.path.isdir(path):
+        return []
+    versions = []
+    for name in os.listdir(path):
+        if name.startswith("v") and name[1:].isdigit():
+            versions.append(int(name[1:]))
+    return sorted(versions)
+
+
+def list_project_ids(index_dir: str) -> List[int]:
+    """Các project có ít nhất 1 thư mục snapshot."""
+    project_ids = []
+    for name in os.listdir(index_dir):
+        if name.startswith("project_") and os.path.isdir(os.path.join(index_dir, name)):
+            try:
+                project_ids.append(int(name.replace("project_", "")))
+            except ValueError:
+                continue
+    return project_ids
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _fsync_file(path: str):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+
+def _fsync_dir(path: str):
+    # Windows không hỗ trợ fsync thư mục
+    if os.name != "posix":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_snapshot(
+    index_dir: str,
+    project_id: int,
+    index_bytes: np.ndarray,
+    asset_ids: np.ndarray,
+    folder_ids: np.ndarray,
+    wal_seq: int,
+    keep: int = 2,
+    extra: Optional[dict] = None
+) -> int:
+    """
+    Ghi snapshot mới cho project và publish atomic.
+
+    Args:
+        index_bytes: Kết quả faiss.serialize_index
+        asset_ids: int64 array các id trong index
+        folder_ids: int64 array song song với asset_ids (-1 = None)
+        wal_seq: Seq WAL cuối cùng đã nằm trong snapshot
+        keep: Số version cũ giữ lại (để fallback nếu version mới bị hỏng)
+        extra: Thông tin thêm ghi vào manifest (vd. index_type)
+
+    Returns:
+        Version vừa publish
+    """
+    base = project_dir(index_dir, project_id)
+    os.makedirs(base, exist_ok=True)
+
+    versions = list_versions(index_dir, project_id)
+    version = (versions[-1] + 1) if versions else 1
+    tmp_path = os.path.join(base, f".tmp-{_version_name(version)}-{os.getpid()}")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    try:
+        with open(os.path.join(tmp_path, INDEX_FILE), "wb") as f:
+            f.write(index_bytes.tobytes())
+        np.save(os.path.join(tmp_path, ASSET_IDS_FILE), np.ascontiguousarray(asset_ids, dtype="int64"))
+        np.save(os.path.join(tmp_path, FOLDER_IDS_FILE), np.ascontiguousarray(folder_ids, dtype="int64"))
+
+        files = {}
+        for name in (INDEX_FILE, ASSET_IDS_FILE, FOLDER_IDS_FILE):
+            file_path = os.path.join(tmp_path, name)
+            _fsync_file(file_path)
+            files[name] = {"sha256": _sha256(file_path), "size": os.path.getsize(file_path)}
+
+        manifest = {
+            "format_version": FORMAT_VERSION,
+            "project_id": project_id,
+            "version": version,
+            "wal_seq": wal_seq,
+            "count": int(len(asset_ids)),
+            "created_at": time.time(),
+            "files": files,
+            **(extra or {}),
+        }
+        manifest_path = os.path.join(tmp_path, MANIFEST_FILE)
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        _fsync_dir(tmp_path)
+
+        # Publish: rename thư mục là atomic
+        os.rename(tmp_path, os.path.join(base, _version_name(version)))
+        _fsync_dir(base)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    # Dọn các version cũ
+    for old in list_versions(index_dir, project_id)[:-keep]:
+        shutil.rmtree(os.path.join(base, _version_name(old)), ignore_errors=True)
+
+    return version
+
+
+def _verify(path: str, manifest: dict) -> bool:
+    for name, meta in manifest.get("files", {}).items():
+        file_path = os.path.join(path, name)
+        if not os.path.exists(file_path) or os.path.getsize(file_path) != meta["size"]:
+            return False
+        if _sha256(file_path) != meta["sha256"]:
+            return False
+    return True
+
+
+def read_latest_manifest(index_dir: str, project_id: int) -> Optional[dict]:
+    """Manifest của snapshot mới nhất (không tải index, không kiểm tra checksum)."""
+    versions = list_versions(index_dir, project_id)
+    if not versions:
+        return None
+    path = os.path.join(project_dir(index_dir, project_id), _version_name(versions[-1]), MANIFEST_FILE)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def oldest_wal_seq(index_dir: str, project_id: int) -> Optional[int]:
+    """
+    wal_seq nhỏ nhất trong các version còn giữ lại (None nếu không có).
+    WAL chỉ được cắt tới seq này: nếu version mới nhất hỏng, version cũ
+    hơn + replay WAL vẫn khôi phục được đầy đủ.
+    """
+    seqs = []
+    base = project_dir(index_dir, project_id)
+    for version in list_versions(index_dir, project_id):
+        try:
+            with open(os.path.join(base, _version_name(version), MANIFEST_FILE), "r", encoding="utf-8") as f:
+                seqs.append(json.load(f)["wal_seq"])
+        except Exception:
+            # Manifest hỏng: version này không dùng để fallback được
+            continue
+    return min(seqs) if seqs else None
+
+
+def read_latest_snapshot(
+    index_dir: str,
+    project_id: int,
+    verify: bool = True,
+    io_flags: int = 0
+) -> Optional[Tuple[faiss.Index, np.ndarray, np.ndarray, dict]]:
+    """
+    Tải snapshot hợp lệ mới nhất của project.
+
+    Args:
+        io_flags: Flags cho faiss.read_index (vd. IO_FLAG_MMAP_IFC để mmap vectors),
+            chỉ áp dụng cho index flat
+
+    Returns:
+        (index, asset_ids, folder_ids, manifest) hoặc None nếu không có snapshot.
+        asset_ids/folder_ids là mmap (read-only).
+    """
+    base = project_dir(index_dir, project_id)
+    for version in reversed(list_versions(index_dir, project_id)):
+        path = os.path.join(base, _version_name(version))
+        try:
+            with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("format_version") != FORMAT_VERSION:
+                print(f"[FAISS] Unsupported snapshot format in {path}, skipping")
+                continue
+            if verify and not _verify(path, manifest):
+                print(f"[FAISS] Checksum mismatch in {path}, falling back to previous version")
+                continue
+
+            flags = io_flags if manifest.get("index_type", "flat") == "flat" else 0
+            idx = faiss.read_index(os.path.join(path, INDEX_FILE), flags)
+            asset_ids = np.load(os.path.join(path, ASSET_IDS_FILE), mmap_mode="r")
+            folder_ids = np.load(os.path.join(path, FOLDER_IDS_FILE), mmap_mode="r")
+            return idx, asset_ids, folder_ids, manifest
+        except Exception as e:
+            print(f"[FAISS] Error reading snapshot {path}: {e}")
+            continue
+
+    return None
@@ -0,0 +1,239 @@
+"""
+FAISS Sync - Đồng bộ index giữa các backend replica qua Redis
+
+Khi nhiều replica cùng dùng 1 thư mục faiss_indices (snapshot + WAL chung),
+mỗi replica vẫn giữ index riêng trong RAM. Chỉ 1 replica được ghi thư mục
+(writer, giữ file lock); các replica khác đặt FAISS_WRITER_URL, gửi mutation
+sang writer và nhận thay đổi qua đây. Sau mỗi add/remove/rebuild (đã ghi
+WAL), writer tăng version của project trên Redis (INCR) và publish thay đổi
+lên FAISS_SYNC_CHANNEL. Các replica khác:
+- version = version đã biết + 1 và là upsert/remove: áp dụng delta vào RAM
+- lỡ version (mất kết nối, message đến lệch thứ tự), rebuild hoặc reconcile
+  (nhiều thay đổi cùng lúc): bỏ bản trong RAM, lần dùng sau tải lại
+  snapshot + WAL từ ổ cứng
+- version <= version đã biết: bỏ qua (đã có trong lần tải lại trước đó)
+
+Dùng chung Redis với Celery (REDIS_URL). LocalBroker là bản trong process
+để test / chạy dev không có Redis.
+"""
+
+import json
+import queue
+import threading
+import uuid
+from typing import Dict, Iterator, List, Optional
+
+from core.config import settings
+from services.search import faiss_index
+from utils.array_codec import decode_array, encode_array
+
+# Định danh process này trong message (nhận lại message của chính mình thì không áp dụng lại)
+REPLICA_ID = uuid.uuid4().hex
+
+# Version mới nhất đã áp dụng (hoặc đã có sau khi tải lại): project_id -> version
+SYNC_VERSIONS: Dict[int, int] = {}
+
+# Thống kê số message theo kết quả xử lý
+SYNC_STATS: Dict[str, int] = {"published": 0, "applied": 0, "reloaded": 0, "ignored": 0}
+
+_broker = None
+_listener_thread: Optional[threading.Thread] = None
+_stop = threading.Event()
+
+
+class RedisBroker:
+    """Version counter (INCR) + pub/sub trên Redis."""
+
+    def __init__(self, url: str, channel: str):
+        import redis  # đi kèm celery[redis]
+
+        # Timeout để add/remove không bị treo khi Redis mất kết nối
+        self._client = redis.Redis.from_url(url, socket_timeout=5)
+        self._channel = channel
+        self._pubsub = None
+
+    def _version_key(self, project_id: int) -> str:
+        return f"{self._channel}:version:{project_id}"
+
+    def next_version(self, project_id: int) -> int:
+        return int(self._client.incr(self._version_key(project_id)))
+
+    def current_version(self, project_id: int) -> int:
+        return int(self._client.get(self._version_key(project_id)) or 0)
+
+    def publish(self, message: str):
+        self._client.publish(self._channel, message)
+
+    def subscribe(self) -> Iterator[str]:
+        """Subscribe ngay khi gọi, trả về iterator các message (dừng khi close)."""
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(self._channel)
+        return self._messages(self._pubsub)
+
+    def _messages(self, pubsub) -> Iterator[str]:
+        while not _stop.is_set():
+            item = pubsub.get_message(timeout=1.0)
+            if item is not None and item["type"] == "message":
+                data = item["data"]
+                yield data.decode("utf-8") if isinstance(data, bytes) else data
+
+    def close(self):
+        if self._pubsub is not None:
+            self._pubsub.close()
+
+
+class LocalBroker:
+    """Broker trong process, cùng interface với RedisBroker (test / dev)."""
+
+    def __init__(self):
+        self._versions: Dict[int, int] = {}
+        self._subscribers: List[queue.Queue] = []
+        self._lock = threading.Lock()
+
+    def next_version(self, project_id: int) -> int:
+        with self._lock:
+            self._versions[project_id] = self._versions.get(project_id, 0) + 1
+            return self._versions[project_id]
+
+    def current_version(self, project_id: int) -> int:
+        with self._lock:
+            return self._versions.get(project_id, 0)
+
+    def publish(self, message: str):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            q.put(message)
+
+    def subscribe(self) -> Iterator[str]:
+        q = queue.Queue()
+        with self._lock:
+            self._subscribers.append(q)
+        return self._messages(q)
+
+    def _messages(self, q: queue.Queue) -> Iterator[str]:
+        while True:
+            message = q.get()
+            if message is None:
+                return
+            yield message
+
+    def close(self):
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, []
+        for q in subscribers:
+            q.put(None)
+
+
+def _publish(event: dict):
+    """Change listener của faiss_index: gán version và publish thay đổi."""
+    project_id = event["project_id"]
+    message = {
+        "origin": REPLICA_ID,
+        "project_id": project_id,
+        "version": _broker.next_version(project_id),
+        "op": event["op"],
+        "asset_id": event.get("asset_id"),
+        "folder_id": event.get("folder_id"),
+        "wal_seq": event.get("wal_seq", 0),
+    }
+    if event.get("vector") is not None:
+        message["vector"] = encode_array(event["vector"])
+    _broker.publish(json.dumps(message))
+    SYNC_STATS["published"] += 1
+
+
+def handle_message(message: str) -> str:
+    """
+    Xử lý 1 message thay đổi index (chỉ được gọi từ 1 thread listener).
+
+    Message của chính replica này cũng đi qua đây để cập nhật version:
+    thay đổi đã có trong RAM, chỉ cần tải lại nếu lỡ version của replica khác.
+
+    Returns:
+        "applied" / "reloaded" / "ignored"
+    """
+    event = json.loads(message)
+    project_id = event["project_id"]
+    version = event["version"]
+    known = SYNC_VERSIONS.get(project_id)
+
+    own = event["origin"] == REPLICA_ID
+    if known is not None and version <= known:
+        result = "ignored"
+    elif known is not None and version == known + 1 and (own or event["op"] in ("upsert", "remove")):
+        if not own:
+            if "vector" in event:
+                event["vector"] = decode_array(event["vector"])
+            faiss_index.apply_remote_change(event)
+        result = "applied"
+    else:
+        # Không biết đã có những thay đổi nào trước version này -> đọc lại từ ổ cứng
+        faiss_index.reload_project_from_disk(project_id)
+        result = "reloaded"
+
+    SYNC_VERSIONS[project_id] = max(version, known or 0)
+    SYNC_STATS[result] += 1
+    return result
+
+
+def _resync():
+    """
+    Sau khi (re)subscribe: project resident đã thay đổi trong lúc mất kết nối
+    thì tải lại. Project chưa có version (vừa tải từ ổ cứng lúc khởi động)
+    nhận version hiện tại trên Redis.
+    """
+    for project_id in faiss_index.get_resident_project_ids():
+        version = _broker.current_version(project_id)
+        known = SYNC_VERSIONS.get(project_id)
+        if known is not None and known != version:
+            faiss_index.reload_project_from_disk(project_id)
+        SYNC_VERSIONS[project_id] = version
+
+
+def _listen_loop():
+    while not _stop.is_set():
+        try:
+            messages = _broker.subscribe()
+            _resync()
+            for message in messages:
+                try:
+                    handle_message(message)
+                except Exception as e:
+                    print(f"[FAISS] Error handling sync message: {e}")
+        except Exception as e:
+            print(f"[FAISS] Sync listener disconnected: {e}")
+            _stop.wait(1.0)
+
+
+def start_sync(broker=None):
+    """
+    Bật đồng bộ giữa các replica (FAISS_SYNC_ENABLED, hoặc truyền broker
+    để test). Gọi sau load_all_indices_from_disk.
+    """
+    global _broker, _listener_thread
+    if _listener_thread is not None and _listener_thread.is_alive():
+        return
+    if broker is None:
+        if not settings.FAISS_SYNC_ENABLED:
+            return
+        broker = RedisBroker(settings.REDIS_URL, settings.FAISS_SYNC_CHANNEL)
+
+    _broker = broker
+    _stop.clear()
+    faiss_index.add_change_listener(_publish)
+    _listener_thread = threading.Thread(target=_listen_loop, name="faiss-sync", daemon=True)
+    _listener_thread.start()
+    print(f"[FAISS] Index sync started (replica {REPLICA_ID[:8]})")
+
+
+def stop_sync(timeout: float = 5.0):
+    """Dừng listener (khi shutdown)."""
+    global _listener_thread
+    if _listener_thread is None:
+        return
+    _stop.set()
+    _broker.close()
+    _listener_thread.join(timeout=timeout)
+    _listener_thread = None
+    faiss_index.remove_change_listener(_publish)
@@ -0,0 +1,181 @@
+"""
+FAISS Write-Ahead Log - Append-only mutation log per project
+
+Mỗi project có 1 file log `project_N.wal` nằm cạnh snapshot index.
+Mỗi thay đổi (upsert/remove) được append + fsync ngay, snapshot đầy đủ
+chỉ được ghi định kỳ bởi background checkpoint (xem faiss_index.py).
+
+Format 1 record (little-endian):
+    header: seq (u64) | op (u8) | asset_id (i64) | folder_id (i64, -1 = None) | dim (u16)
+    payload: dim * float32 (rỗng với OP_REMOVE)
+    crc32 (u32) của header + payload
+
+Record cuối bị ghi dở (crash giữa chừng) sẽ bị bỏ qua khi replay.
+"""
+
+import os
+import struct
+import threading
+import zlib
+import numpy as np
+from typing import Dict, Iterator, List, Optional, Tuple
+
+OP_UPSERT = 1
+OP_REMOVE = 2
+
+_HEADER = struct.Struct("<QBqqH")
+_CRC = struct.Struct("<I")
+
+# File handle đang mở cho từng WAL (append mode): (index_dir, project_id) -> file
+_WAL_FILES: Dict[Tuple[str, int], object] = {}
+_WAL_LOCK = threading.Lock()
+
+WalRecord = Tuple[int, int, int, Optional[int], Optional[np.ndarray]]
+
+
+def wal_path(index_dir: str, project_id: int) -> str:
+    """Đường dẫn file WAL của project."""
+    return os.path.join(index_dir, f"project_{project_id}.wal")
+
+
+def _fsync_dir(path: str):
+    # Windows không hỗ trợ fsync thư mục
+    if os.name != "posix":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _get_file(index_dir: str, project_id: int):
+    key = (index_dir, project_id)
+    f = _WAL_FILES.get(key)
+    if f is None:
+        path = wal_path(index_dir, project_id)
+        created = not os.path.exists(path)
+        f = open(path, "ab")
+        if created:
+            # Entry của file mới trong thư mục cũng phải bền như record đầu tiên
+            _fsync_dir(index_dir)
+        _WAL_FILES[key] = f
+    return f
+
+
+def _encode_record(
+    seq: int,
+    op: int,
+    asset_id: int,
+    folder_id: Optional[int],
+    vector: Optional[np.ndarray]
+) -> bytes:
+    payload = b"" if vector is None else np.asarray(vector, dtype="<f4").tobytes()
+    header = _HEADER.pack(
+        seq,
+        op,
+        asset_id,
+        -1 if folder_id is None else folder_id,
+        len(payload) // 4
+    )
+    return header + payload + _CRC.pack(zlib.crc32(header + payload))
+
+
+def append_record(
+    index_dir: str,
+    project_id: int,
+    seq: int,
+    op: int,
+    asset_id: int,
+    folder_id: Optional[int] = None,
+    vector: Optional[np.ndarray] = None
+):
+    """
+    Append 1 record vào WAL của project và fsync xuống ổ cứng.
+    """
+    append_records(index_dir, project_id, [(seq, op, asset_id, folder_id, vector)])
+
+
+def append_records(index_dir: str, project_id: int, records: List[WalRecord]):
+    """
+    Append nhiều record (seq, op, asset_id, folder_id, vector) rồi fsync 1 lần.
+    """
+    data = b"".join(_encode_record(*record) for record in records)
+
+    with _WAL_LOCK:
+        f = _get_file(index_dir, project_id)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_records(index_dir: str, project_id: int) -> Iterator[WalRecord]:
+    """
+    Đọc lần lượt các record trong WAL của project.
+
+    Yields:
+        (seq, op, asset_id, folder_id, vector)
+    """
+    path = wal_path(index_dir, project_id)
+    if not os.path.exists(path):
+        return
+
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                break
+            seq, op, asset_id, folder_id, dim = _HEADER.unpack(header)
+            payload = f.read(dim * 4)
+            crc = f.read(_CRC.size)
+            if len(payload) < dim * 4 or len(crc) < _CRC.size:
+                print(f"[WAL] Truncated record at end of {path}, ignoring")
+                break
+            if _CRC.unpack(crc)[0] != zlib.crc32(header + payload):
+                print(f"[WAL] Checksum mismatch in {path} (seq {seq}), stopping replay")
+                break
+
+            vector = np.frombuffer(payload, dtype="<f4").astype("float32") if dim else None
+            yield seq, op, asset_id, (None if folder_id == -1 else folder_id), vector
+
+
+def last_seq(index_dir: str, project_id: int) -> int:
+    """Seq của record cuối cùng hợp lệ trong WAL (0 nếu rỗng)."""
+    seq = 0
+    for record in read_records(index_dir, project_id):
+        seq = record[0]
+    return seq
+
+
+def truncate_through(index_dir: str, project_id: int, seq: int):
+    """
+    Xóa khỏi WAL các record có seq <= `seq` (đã nằm trong snapshot).
+    Các record mới hơn (ghi trong lúc checkpoint) được giữ lại.
+    """
+    path = wal_path(index_dir, project_id)
+    with _WAL_LOCK:
+        f = _WAL_FILES.pop((index_dir, project_id), None)
+        if f is not None:
+            f.close()
+
+        if not os.path.exists(path):
+            return
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as out:
+            for record in read_records(index_dir, project_id):
+                if record[0] > seq:
+                    out.write(_encode_record(*record))
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, path)
+        # Crash ngay sau replace không được đưa WAL cũ (đã cắt) quay lại
+        _fsync_dir(index_dir)
+
+
+def close_all():
+    """Đóng tất cả file WAL đang mở (khi shutdown)."""
+    with _WAL_LOCK:
+        for f in _WAL_FILES.values():
+            f.close()
+        _WAL_FILES.clear()
@@ -0,0 +1,63 @@
+"""
+Reader/Writer Lock - nhiều reader song song, writer độc quyền
+
+Dùng cho FAISS index của từng project: search (reader) chạy song song với
+nhau, add/remove (writer) chờ các search đang chạy xong và chặn search mới
+cho tới khi ghi xong (ưu tiên writer để upload không bị đói).
+"""
+
+import threading
+from contextlib import contextmanager
+
+
+class RWLock:
+    """Reader/writer lock ưu tiên writer (không re-entrant)."""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
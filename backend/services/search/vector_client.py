@@ -0,0 +1,332 @@
+"""
+Vector Client - Truy cập FAISS index cho embeddings_service
+
+- VECTOR_SERVER_URL rỗng: gọi thẳng faiss_index trong process (chạy 1 worker)
+- VECTOR_SERVER_URL có giá trị: mọi add/remove/search đi qua vector server
+  (services/search/vector_server.py). Server là process duy nhất giữ index
+  trên 1 node, nên RAM chỉ tốn 1 lần và mọi uvicorn worker / celery worker
+  đều thấy cùng 1 index (upload ở worker A search được ngay ở worker B).
+- FAISS_WRITER_URL có giá trị (replica chỉ đọc, không có VECTOR_SERVER_URL):
+  search chạy trong process, add/remove/rebuild gửi sang vector server
+  của writer (process duy nhất ghi faiss_indices).
+
+Vectors được gửi dạng float32 base64 (không mất chính xác như khi qua JSON
+số thực). Re-rank trên index nén được làm ở phía server (đọc bảng
+Embeddings), client chỉ báo có cần re-rank hay không.
+"""
+
+import threading
+import numpy as np
+import requests
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from core.config import settings
+from services.search import faiss_index
+from services.search.faiss_index import merge_top_k  # gộp kết quả chạy ở client, không cần server
+from utils.array_codec import decode_array, encode_array
+
+ExactVectors = Callable[[List[int]], Dict[int, np.ndarray]]
+
+_local = threading.local()
+
+
+def is_remote() -> bool:
+    """Có dùng vector server hay không."""
+    return bool(settings.VECTOR_SERVER_URL)
+
+
+def _writer_url() -> str:
+    """Nơi nhận mutation: vector server, hoặc writer khi process này chỉ đọc ("" = trong process)."""
+    return settings.VECTOR_SERVER_URL or settings.FAISS_WRITER_URL
+
+
+def _http() -> requests.Session:
+    # requests.Session không đảm bảo thread-safe: mỗi thread 1 session (giữ keep-alive)
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = requests.Session()
+    return session
+
+
+def _request(method: str, path: str, payload: Optional[dict] = None, base_url: Optional[str] = None):
+    url = (base_url or settings.VECTOR_SERVER_URL).rstrip("/") + path
+    response = _http().request(method, url, json=payload, timeout=settings.VECTOR_SERVER_TIMEOUT)
+    if response.status_code == 400:
+        raise ValueError(response.json().get("detail", response.text))
+    response.raise_for_status()
+    return response.json()
+
+
+def forward_to_writer(path: str, payload: dict) -> dict:
+    """Gửi mutation sang vector server của writer (FAISS_WRITER_URL)."""
+    return _request("POST", path, payload, base_url=settings.FAISS_WRITER_URL)
+
+
+def _pairs(results: list) -> List[Tuple[int, float]]:
+    return [(int(asset_id), float(score)) for asset_id, score in results]
+
+
+def _search_payload(
+    query_vectors: np.ndarray,
+    k: Optional[int],
+    thresholds: Optional[List[float]],
+    folder_ids: Optional[Iterable[int]],
+    nprobe: Optional[int],
+    ef_search: Optional[int],
+    exact_vectors: Optional[ExactVectors]
+) -> dict:
+    return {
+        "vectors": encode_array(np.asarray(query_vectors, dtype="float32").reshape(-1, faiss_index.DIM)),
+        "k": k,
+        "thresholds": thresholds,
+        "folder_ids": None if folder_ids is None else [int(f) for f in folder_ids],
+        "nprobe": nprobe,
+        "ef_search": ef_search,
+        "rerank": exact_vectors is not None,
+    }
+
+
+def upsert_vector_to_project(
+    project_id: int,
+    asset_id: int,
+    folder_id: Optional[int],
+    embedding: np.ndarray
+):
+    """Thêm hoặc cập nhật vector của asset (xem faiss_index.upsert_vector_to_project)."""
+    if not _writer_url():
+        return faiss_index.upsert_vector_to_project(project_id, asset_id, folder_id, embedding)
+    _request("POST", "/upsert", {
+        "project_id": project_id,
+        "asset_id": asset_id,
+        "folder_id": folder_id,
+        "vector": encode_array(np.asarray(embedding, dtype="float32").reshape(1, -1)),
+    }, base_url=_writer_url())
+
+
+def remove_vector_from_project(project_id: int, asset_id: int):
+    """Xóa vector của asset khỏi index của project."""
+    if not _writer_url():
+        return faiss_index.remove_vector_from_project(project_id, asset_id)
+    _request("POST", "/remove", {"project_id": project_id, "asset_id": asset_id}, base_url=_writer_url())
+
+
+def rebuild_project_index(project_id: int, embeddings_data: list[Tuple[int, Optional[int], list[float]]]):
+    """Rebuild toàn bộ index của project từ list (asset_id, folder_id, embedding)."""
+    if not _writer_url():
+        return faiss_index.rebuild_project_index(project_id, embeddings_data)
+    vectors = np.array([embedding for _, _, embedding in embeddings_data], dtype="float32").reshape(-1, faiss_index.DIM)
+    _request("POST", "/rebuild", {
+        "project_id": project_id,
+        "asset_ids": [int(asset_id) for asset_id, _, _ in embeddings_data],
+        "folder_ids": [folder_id for _, folder_id, _ in embeddings_data],
+        "vectors": encode_array(vectors),
+    }, base_url=_writer_url())
+
+
+def rebuild_project_index_arrays(project_id: int, asset_ids: np.ndarray, folder_ids: np.ndarray, vectors: np.ndarray):
+    """Rebuild từ array song song (folder None = -1), X có thể bị normalize tại chỗ."""
+    if not _writer_url():
+        return faiss_index.rebuild_project_index_arrays(project_id, asset_ids, folder_ids, vectors)
+    _request("POST", "/rebuild", {
+        "project_id": project_id,
+        "asset_ids": np.asarray(asset_ids, dtype="int64").tolist(),
+        "folder_ids": [None if folder_id == faiss_index.NO_FOLDER else folder_id for folder_id in np.asarray(folder_ids).tolist()],
+        "vectors": encode_array(vectors),
+    }, base_url=_writer_url())
+
+
+def get_project_asset_ids(project_id: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(asset_ids, folder_ids) đang có trong index của project (folder None = -1)."""
+    if not is_remote():
+        return faiss_index.get_project_asset_ids(project_id)
+    data = _request("GET", f"/projects/{project_id}/assets")
+    return np.array(data["asset_ids"], dtype="int64"), np.array(data["folder_ids"], dtype="int64")
+
+
+def get_asset_vector(project_id: int, asset_id: int) -> Optional[np.ndarray]:
+    """Vector của asset trong index (None nếu không có hoặc index nén)."""
+    if not is_remote():
+        return faiss_index.get_asset_vector(project_id, asset_id)
+    data = _request("GET", f"/projects/{project_id}/vectors/{asset_id}")
+    return None if data["vector"] is None else decode_array(data["vector"])[0]
+
+
+def apply_project_changes(
+    project_id: int,
+    upserts: List[Tuple[int, Optional[int], np.ndarray]],
+    removes: List[int]
+):
+    """Áp dụng nhiều upsert/remove cùng lúc (1 lần ghi WAL)."""
+    if not _writer_url():
+        return faiss_index.apply_project_changes(project_id, upserts, removes)
+    vectors = np.array([vector for _, _, vector in upserts], dtype="float32").reshape(-1, faiss_index.DIM)
+    _request("POST", f"/projects/{project_id}/changes", {
+        "asset_ids": [int(asset_id) for asset_id, _, _ in upserts],
+        "folder_ids": [folder_id for _, folder_id, _ in upserts],
+        "vectors": encode_array(vectors),
+        "removes": [int(asset_id) for asset_id in removes],
+    }, base_url=_writer_url())
+
+
+def is_project_indexed(project_id: int) -> bool:
+    """Project đã có FAISS index (trong RAM hoặc trên ổ cứng của server)."""
+    if not is_remote():
+        return faiss_index.is_project_indexed(project_id)
+    return _request("GET", f"/projects/{project_id}/indexed")["indexed"]
+
+
+def get_project_stats(project_id: int) -> dict:
+    """Thống kê FAISS index của project."""
+    if not is_remote():
+        return faiss_index.get_project_stats(project_id)
+    return _request("GET", f"/projects/{project_id}/stats")
+
+
+def set_project_compression(project_id: int, mode: str):
+    """Đặt compression cho project (ValueError nếu mode không hợp lệ)."""
+    if not _writer_url():
+        return faiss_index.set_project_compression(project_id, mode)
+    _request("POST", "/compression", {"project_id": project_id, "mode": mode}, base_url=_writer_url())
+
+
+def search_in_project(
+    project_id: int,
+    query_vector: np.ndarray,
+    k: int = 10,
+    folder_id: Optional[int] = None,
+    search_type: str = "image",
+    similarity_threshold: float = 0.7,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    exact_vectors: Optional[ExactVectors] = None,
+    folder_ids: Optional[Iterable[int]] = None
+) -> List[Tuple[int, float]]:
+    """Tìm kiếm 1 query trong project (xem faiss_index.search_in_project)."""
+    if not is_remote():
+        return faiss_index.search_in_project(
+            project_id, query_vector, k, folder_id, search_type, similarity_threshold,
+            nprobe, ef_search, exact_vectors, folder_ids
+        )
+    if folder_ids is None and folder_id:
+        folder_ids = [folder_id]
+    return search_in_project_batch(
+        project_id,
+        np.asarray(query_vector, dtype="float32").reshape(1, -1),
+        k=k,
+        thresholds=[faiss_index.query_threshold(search_type, similarity_threshold)],
+        folder_ids=folder_ids,
+        nprobe=nprobe,
+        ef_search=ef_search,
+        exact_vectors=exact_vectors
+    )[0]
+
+
+def search_in_project_batch(
+    project_id: int,
+    query_vectors: np.ndarray,
+    k: int = 10,
+    thresholds: Optional[List[float]] = None,
+    folder_ids: Optional[Iterable[int]] = None,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    exact_vectors: Optional[ExactVectors] = None
+) -> List[List[Tuple[int, float]]]:
+    """Tìm kiếm nhiều query cùng lúc trong project."""
+    if not is_remote():
+        return faiss_index.search_in_project_batch(
+            project_id, query_vectors, k, thresholds, folder_ids, nprobe, ef_search, exact_vectors
+        )
+    payload = _search_payload(query_vectors, k, thresholds, folder_ids, nprobe, ef_search, exact_vectors)
+    payload["project_id"] = project_id
+    return [_pairs(rows) for rows in _request("POST", "/search", payload)["results"]]
+
+
+def search_user_projects(
+    user_id: int,
+    project_ids: List[int],
+    query_vector: np.ndarray,
+    k: int = 10,
+    folder_ids: Optional[Iterable[int]] = None,
+    search_type: str = "image",
+    similarity_threshold: float = 0.7,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    exact_vectors: Optional[ExactVectors] = None
+) -> List[Tuple[int, float]]:
+    """Tìm kiếm 1 query trên tất cả project của user."""
+    if not is_remote():
+        return faiss_index.search_user_projects(
+            user_id, project_ids, query_vector, k, folder_ids, search_type, similarity_threshold,
+            nprobe, ef_search, exact_vectors
+        )
+    return search_user_projects_batch(
+        user_id,
+        project_ids,
+        np.asarray(query_vector, dtype="float32").reshape(1, -1),
+        k=k,
+        thresholds=[faiss_index.query_threshold(search_type, similarity_threshold)],
+        folder_ids=folder_ids,
+        nprobe=nprobe,
+        ef_search=ef_search,
+        exact_vectors=exact_vectors
+    )[0]
+
+
+def search_user_projects_batch(
+    user_id: int,
+    project_ids: List[int],
+    query_vectors: np.ndarray,
+    k: int = 10,
+    thresholds: Optional[List[float]] = None,
+    folder_ids: Optional[Iterable[int]] = None,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    exact_vectors: Optional[ExactVectors] = None
+) -> List[List[Tuple[int, float]]]:
+    """Tìm kiếm nhiều query trên tất cả project của user."""
+    if not is_remote():
+        return faiss_index.search_user_projects_batch(
+            user_id, project_ids, query_vectors, k, thresholds, folder_ids, nprobe, ef_search, exact_vectors
+        )
+    payload = _search_payload(query_vectors, k, thresholds, folder_ids, nprobe, ef_search, exact_vectors)
+    payload.update({"user_id": user_id, "project_ids": list(project_ids)})
+    return [_pairs(rows) for rows in _request("POST", "/search/user", payload)["results"]]
+
+
+def range_search_in_project(
+    project_id: int,
+    query_vector: np.ndarray,
+    similarity_threshold: float,
+    folder_ids: Optional[Iterable[int]] = None,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    exact_vectors: Optional[ExactVectors] = None
+) -> List[Tuple[int, float]]:
+    """Lấy tất cả asset của project có similarity >= similarity_threshold."""
+    if not is_remote():
+        return faiss_index.range_search_in_project(
+            project_id, query_vector, similarity_threshold, folder_ids, nprobe, ef_search, exact_vectors
+        )
+    payload = _search_payload(query_vector, None, [similarity_threshold], folder_ids, nprobe, ef_search, exact_vectors)
+    payload["project_id"] = project_id
+    return _pairs(_request("POST", "/range", payload)["results"])
+
+
+def range_search_user_projects(
+    user_id: int,
+    project_ids: List[int],
+    query_vector: np.ndarray,
+    similarity_threshold: float,
+    folder_ids: Optional[Iterable[int]] = None,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    exact_vectors: Optional[ExactVectors] = None
+) -> List[Tuple[int, float]]:
+    """Range search trên tất cả project của user."""
+    if not is_remote():
+        return faiss_index.range_search_user_projects(
+            user_id, project_ids, query_vector, similarity_threshold, folder_ids, nprobe, ef_search, exact_vectors
+        )
+    payload = _search_payload(query_vector, None, [similarity_threshold], folder_ids, nprobe, ef_search, exact_vectors)
+    payload.update({"user_id": user_id, "project_ids": list(project_ids)})
+    return _pairs(_request("POST", "/range/user", payload)["results"])
@@ -0,0 +1,302 @@
+"""
+Vector Server - Process riêng giữ toàn bộ FAISS index của 1 node
+
+Mỗi uvicorn worker tự tải index thì tốn RAM N lần và upload ở worker này
+không thấy được ở worker khác. Vector server là process duy nhất sở hữu
+index (snapshot + WAL + checkpoint worker), các worker gọi qua
+services/search/vector_client.py khi đặt VECTOR_SERVER_URL.
+
+Chạy (luôn 1 worker, các request được phục vụ song song bằng thread pool
+và RWLock của từng project):
+    uvicorn services.search.vector_server:app --host 127.0.0.1 --port 8001
+hoặc:
+    python -m services.search.vector_server
+
+Endpoints:
+- POST /upsert, /remove, /rebuild - Thay đổi index
+- POST /search, /search/user - Top k (nhiều query)
+- POST /range, /range/user - Range search theo ngưỡng similarity
+- POST /compression - Cấu hình compression của project
+- POST /projects/{project_id}/changes - Nhiều upsert/remove cùng lúc (reconcile)
+- GET /projects/{project_id}/indexed, /projects/{project_id}/stats, /projects/{project_id}/assets
+- GET /projects/{project_id}/vectors/{asset_id} - Vector của 1 asset ("more like this")
+- GET /health
+
+Với FAISS_WRITER_URL (replica chỉ đọc dùng chung faiss_indices), các
+endpoint thay đổi index chuyển tiếp request sang vector server của writer.
+"""
+
+import numpy as np
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+from sqlmodel import Session, select
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from core.config import settings
+from db.session import engine
+from models import Embeddings
+from services.search import faiss_index, faiss_sync
+from services.search.embedding_codec import decode_embeddings
+from services.search.vector_client import forward_to_writer
+from utils.array_codec import decode_array, encode_array
+
+app = FastAPI(title="PhotoStore Vector Server")
+
+
+class ArrayPayload(BaseModel):
+    shape: List[int]
+    data: str
+
+
+class UpsertRequest(BaseModel):
+    project_id: int
+    asset_id: int
+    folder_id: Optional[int] = None
+    vector: ArrayPayload
+
+
+class RemoveRequest(BaseModel):
+    project_id: int
+    asset_id: int
+
+
+class RebuildRequest(BaseModel):
+    project_id: int
+    asset_ids: List[int]
+    folder_ids: List[Optional[int]]
+    vectors: ArrayPayload
+
+
+class ChangesRequest(BaseModel):
+    asset_ids: List[int]
+    folder_ids: List[Optional[int]]
+    vectors: ArrayPayload
+    removes: List[int]
+
+
+class CompressionRequest(BaseModel):
+    project_id: int
+    mode: str
+
+
+class SearchRequest(BaseModel):
+    vectors: ArrayPayload
+    project_id: Optional[int] = None
+    user_id: Optional[int] = None
+    project_ids: Optional[List[int]] = None
+    k: Optional[int] = 10
+    thresholds: Optional[List[Optional[float]]] = None
+    folder_ids: Optional[List[int]] = None
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    rerank: bool = False
+
+
+def _exact_vectors(asset_ids: List[int]) -> Dict[int, np.ndarray]:
+    """Vector gốc từ bảng Embeddings để re-rank kết quả trên index nén."""
+    if not asset_ids:
+        return {}
+    with Session(engine) as session:
+        rows = session.exec(
+            select(Embeddings.asset_id, Embeddings.embedding)
+            .where(Embeddings.asset_id.in_(asset_ids))
+        ).all()
+    if not rows:
+        return {}
+    vectors = decode_embeddings([embedding for _, embedding in rows])
+    return {asset_id: vectors[i] for i, (asset_id, _) in enumerate(rows)}
+
+
+def _search_kwargs(request: SearchRequest) -> dict:
+    return {
+        "folder_ids": request.folder_ids,
+        "nprobe": request.nprobe,
+        "ef_search": request.ef_search,
+        "exact_vectors": _exact_vectors if request.rerank else None,
+    }
+
+
+def _project_id(request: SearchRequest) -> int:
+    if request.project_id is None:
+        raise HTTPException(status_code=422, detail="project_id is required")
+    return request.project_id
+
+
+def _user_id(request: SearchRequest) -> int:
+    if request.user_id is None:
+        raise HTTPException(status_code=422, detail="user_id is required")
+    return request.user_id
+
+
+def _threshold(request: SearchRequest) -> float:
+    if not request.thresholds or request.thresholds[0] is None:
+        raise HTTPException(status_code=400, detail="Range search requires a similarity threshold")
+    return request.thresholds[0]
+
+
+def _forward(path: str, request: BaseModel) -> dict:
+    """Chuyển tiếp mutation sang writer (replica này không ghi faiss_indices)."""
+    try:
+        return forward_to_writer(path, request.dict())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.on_event("startup")
+def startup_event():
+    """Tải index (snapshot + replay WAL) và chạy checkpoint worker"""
+    faiss_index.load_all_indices_from_disk()
+    faiss_index.start_checkpoint_worker()
+    faiss_sync.start_sync()
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """Gộp WAL còn lại vào snapshot trước khi tắt"""
+    faiss_sync.stop_sync()
+    faiss_index.stop_checkpoint_worker()
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok", "resident_projects": len(faiss_index.PROJECT_INDICES)}
+
+
+@app.post("/upsert")
+def upsert(request: UpsertRequest):
+    if faiss_index.is_read_only():
+        return _forward("/upsert", request)
+    faiss_index.upsert_vector_to_project(
+        request.project_id, request.asset_id, request.folder_id, decode_array(request.vector.dict())[0]
+    )
+    return {"status": "ok"}
+
+
+@app.post("/remove")
+def remove(request: RemoveRequest):
+    if faiss_index.is_read_only():
+        return _forward("/remove", request)
+    faiss_index.remove_vector_from_project(request.project_id, request.asset_id)
+    return {"status": "ok"}
+
+
+@app.post("/rebuild")
+def rebuild(request: RebuildRequest):
+    if faiss_index.is_read_only():
+        return _forward("/rebuild", request)
+    vectors = decode_array(request.vectors.dict())
+    if not (len(request.asset_ids) == len(request.folder_ids) == len(vectors)):
+        raise HTTPException(status_code=400, detail="asset_ids, folder_ids and vectors must have the same length")
+    folder_ids = [faiss_index.NO_FOLDER if folder_id is None else folder_id for folder_id in request.folder_ids]
+    faiss_index.rebuild_project_index_arrays(
+        request.project_id,
+        np.array(request.asset_ids, dtype="int64"),
+        np.array(folder_ids, dtype="int64"),
+        vectors
+    )
+    return {"status": "ok", "count": len(vectors)}
+
+
+@app.post("/compression")
+def compression(request: CompressionRequest):
+    if faiss_index.is_read_only():
+        return _forward("/compression", request)
+    try:
+        faiss_index.set_project_compression(request.project_id, request.mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "ok"}
+
+
+@app.get("/projects/{project_id}/indexed")
+def indexed(project_id: int):
+    return {"indexed": faiss_index.is_project_indexed(project_id)}
+
+
+@app.get("/projects/{project_id}/assets")
+def assets(project_id: int):
+    asset_ids, folder_ids = faiss_index.get_project_asset_ids(project_id)
+    return {"asset_ids": asset_ids.tolist(), "folder_ids": folder_ids.tolist()}
+
+
+@app.get("/projects/{project_id}/vectors/{asset_id}")
+def asset_vector(project_id: int, asset_id: int):
+    vector = faiss_index.get_asset_vector(project_id, asset_id)
+    return {"vector": None if vector is None else encode_array(vector.reshape(1, -1))}
+
+
+@app.post("/projects/{project_id}/changes")
+def changes(project_id: int, request: ChangesRequest):
+    if faiss_index.is_read_only():
+        return _forward(f"/projects/{project_id}/changes", request)
+    vectors = decode_array(request.vectors.dict())
+    if not (len(request.asset_ids) == len(request.folder_ids) == len(vectors)):
+        raise HTTPException(status_code=400, detail="asset_ids, folder_ids and vectors must have the same length")
+    faiss_index.apply_project_changes(
+        project_id,
+        list(zip(request.asset_ids, request.folder_ids, vectors)),
+        request.removes
+    )
+    return {"status": "ok"}
+
+
+@app.get("/projects/{project_id}/stats")
+def stats(project_id: int):
+    return faiss_index.get_project_stats(project_id)
+
+
+@app.post("/search")
+def search(request: SearchRequest):
+    results = faiss_index.search_in_project_batch(
+        _project_id(request),
+        decode_array(request.vectors.dict()),
+        k=request.k,
+        thresholds=request.thresholds,
+        **_search_kwargs(request)
+    )
+    return {"results": results}
+
+
+@app.post("/search/user")
+def search_user(request: SearchRequest):
+    results = faiss_index.search_user_projects_batch(
+        _user_id(request),
+        request.project_ids or [],
+        decode_array(request.vectors.dict()),
+        k=request.k,
+        thresholds=request.thresholds,
+        **_search_kwargs(request)
+    )
+    return {"results": results}
+
+
+@app.post("/range")
+def range_search(request: SearchRequest):
+    results = faiss_index.range_search_in_project(
+        _project_id(request),
+        decode_array(request.vectors.dict())[0],
+        _threshold(request),
+        **_search_kwargs(request)
+    )
+    return {"results": results}
+
+
+@app.post("/range/user")
+def range_search_user(request: SearchRequest):
+    results = faiss_index.range_search_user_projects(
+        _user_id(request),
+        request.project_ids or [],
+        decode_array(request.vectors.dict())[0],
+        _threshold(request),
+        **_search_kwargs(request)
+    )
+    return {"results": results}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # Lắng nghe đúng địa chỉ mà client dùng (mặc định 127.0.0.1:8001)
+    url = urlparse(settings.VECTOR_SERVER_URL or "http://127.0.0.1:8001")
+    uvicorn.run(app, host=url.hostname or "127.0.0.1", port=url.port or 8001, workers=1)
@@ -5,19 +5,19 @@ Tự động đánh tags cho hình ảnh sử dụng CLIP model.
 Optimized for speed with caching, vectorization, and batch processing.
 """
 
-import torch
-import clip
 import numpy as np
 from PIL import Image
-from sqlmodel import Session
+from sqlmodel import Session, select
 from typing import List, Tuple, Optional
 import logging
 from functools import lru_cache
 import time
 
-from dependencies.clip_service import get_clip_model
+from dependencies.clip_batcher import encode_images, encode_texts
+from dependencies.embedding_cache import encode_texts_cached
 from db.crud_tag import get_or_create_tag, add_tag_to_asset, get_tags_for_asset
-from models import Assets
+from models import Assets, Embeddings
+from services.search.embedding_codec import decode_embedding
 
 # Setup logging
 logger = logging.getLogger(__name__)
@@ -66,7 +66,7 @@ DEFAULT_LABELS = [
     # --- NGHỆ THUẬT & PHONG CÁCH ---
     "drawing", "painting", "sculpture", "vintage", "modern"
 ]
-def get_cached_label_features(model, device, labels: List[str]):
+def get_cached_label_features(labels: List[str]) -> np.ndarray:
     """
     Cache label embeddings with smart invalidation.
     Uses tuple(labels) as cache key for multiple label sets support.
@@ -87,13 +87,8 @@ def get_cached_label_features(model, device, labels: List[str]):
     logger.info(f"Computing embeddings for {len(labels)} labels...")
     
     try:
-        # Batch tokenization (more efficient than one-by-one)
-        text_tokens = clip.tokenize(labels).to(device)
-        
-        with torch.no_grad():
-            text_features = model.encode_text(text_tokens)
-            # L2 normalization for cosine similarity
-            text_features /= text_features.norm(dim=-1, keepdim=True)
+        # 1 request cho cả label set (1 lần forward, đã L2-normalize)
+        text_features = encode_texts(labels)
         
         # Cache the result
         _label_features_cache[labels_key] = text_features
@@ -127,6 +122,34 @@ def get_image_tags(
         threshold: Minimum confidence score (0-1)
         top_k: Maximum number of tags to return
     
+    Returns:
+        List of (tag_name, confidence_score) tuples, sorted by score descending
+    """
+    try:
+        # Encode image (moderate cost, batched with concurrent requests)
+        image_features = encode_images([image])[0]
+    except Exception as e:
+        logger.error(f"Error in get_image_tags: {e}")
+        raise
+    return get_tags_from_features(image_features, labels, threshold, top_k)
+
+
+def get_tags_from_features(
+    image_features: np.ndarray,
+    labels: Optional[List[str]] = None,
+    threshold: float = 0.2,
+    top_k: int = 5
+) -> List[Tuple[str, float]]:
+    """
+    Get tags from an already computed, L2-normalized CLIP image embedding
+    (e.g. the vector stored for the asset), without running the image encoder.
+    
+    Args:
+        image_features: numpy array shape (512,)
+        labels: List of candidate labels (default: DEFAULT_LABELS)
+        threshold: Minimum confidence score (0-1)
+        top_k: Maximum number of tags to return
+    
     Returns:
         List of (tag_name, confidence_score) tuples, sorted by score descending
     """
@@ -139,28 +162,21 @@ def get_image_tags(
     
     try:
         start_time = time.time()
-        model, preprocess, device = get_clip_model()
         
-        # 1. Encode image (moderate cost)
-        image_tensor = preprocess(image).unsqueeze(0).to(device)
-        with torch.no_grad():
-            image_features = model.encode_image(image_tensor)
-            image_features /= image_features.norm(dim=-1, keepdim=True)
-
-        # 2. Get cached text features (nearly instant after first call)
-        text_features = get_cached_label_features(model, device, labels)
+        # 1. Get cached text features (nearly instant after first call)
+        text_features = get_cached_label_features(labels)
         
-        # 3. Compute similarity (vectorized, very fast)
-        similarity = (image_features @ text_features.T).cpu().numpy()[0]
+        # 2. Compute similarity (vectorized, very fast)
+        similarity = text_features @ np.asarray(image_features, dtype="float32").reshape(-1)
         
-        # 4. Get top-k indices efficiently using argpartition
+        # 3. Get top-k indices efficiently using argpartition
         if len(similarity) > top_k:
             top_indices = np.argpartition(similarity, -top_k)[-top_k:]
             top_indices = top_indices[np.argsort(-similarity[top_indices])]
         else:
             top_indices = np.argsort(-similarity)
         
-        # 5. Filter by threshold and build results
+        # 4. Filter by threshold and build results
         results = []
         for idx in top_indices:
             score = float(similarity[idx])
@@ -175,22 +191,26 @@ def get_image_tags(
         return results
         
     except Exception as e:
-        logger.error(f"Error in get_image_tags: {e}")
+        logger.error(f"Error in get_tags_from_features: {e}")
         raise
+
+
 def auto_tag_asset(
     session: Session,
     asset_id: int,
-    image: Image.Image,
+    image: Optional[Image.Image] = None,
     labels: Optional[List[str]] = None,
     threshold: float = 0.2,
     top_k: int = 5,
-    overwrite: bool = False
+    overwrite: bool = False,
+    image_features: Optional[np.ndarray] = None
 ) -> List[str]:
     """
     Auto-tag an asset and save to database.
     
     Optimizations:
     - Fast image tagging with cached label embeddings
+    - Reuses image_features (the asset's embedding) when given: no second CLIP pass
     - Batch database operations where possible
     - Smart overwrite logic
     - Detailed logging
@@ -203,6 +223,7 @@ def auto_tag_asset(
         threshold: Minimum confidence (0-1)
         top_k: Max number of tags
         overwrite: If True, remove old tags before adding new ones
+        image_features: Normalized CLIP embedding of the image (replaces image)
     
     Returns:
         List of tag names added
@@ -215,8 +236,13 @@ def auto_tag_asset(
         if not asset:
             raise ValueError(f"Asset {asset_id} not found")
         
-        # Get predicted tags from image
-        predicted_tags = get_image_tags(image, labels, threshold, top_k)
+        # Get predicted tags from the embedding (or encode the image)
+        if image_features is not None:
+            predicted_tags = get_tags_from_features(image_features, labels, threshold, top_k)
+        elif image is not None:
+            predicted_tags = get_image_tags(image, labels, threshold, top_k)
+        else:
+            raise ValueError("image or image_features is required")
         
         if not predicted_tags:
             logger.info(f"No tags found for asset {asset_id}")
@@ -268,7 +294,7 @@ def auto_tag_asset_by_id(
     overwrite: bool = False
 ) -> List[str]:
     """
-    Tự động đánh tags cho asset từ asset_id (tự động load image từ file).
+    Tự động đánh tags cho asset từ asset_id (dùng embedding đã lưu, nếu chưa có thì load image từ file).
     
     Args:
         session: Database session
@@ -287,7 +313,17 @@ def auto_tag_asset_by_id(
     asset = session.get(Assets, asset_id)
     if not asset:
         raise ValueError(f"Asset {asset_id} not found")
-    model, preprocess, device = get_clip_model()
+    
+    # Asset đã có embedding: dùng luôn vector đó (không đọc file / chạy CLIP)
+    row = session.exec(
+        select(Embeddings.embedding).where(Embeddings.asset_id == asset_id)
+    ).first()
+    if row is not None:
+        return auto_tag_asset(
+            session, asset_id, labels=labels, threshold=threshold, top_k=top_k,
+            overwrite=overwrite, image_features=decode_embedding(row)
+        )
+    
     # Load image từ file
     UPLOAD_DIR = Path("uploads")
     safe_path = asset.path.replace("\\", "/")
@@ -347,8 +383,7 @@ def batch_auto_tag_assets(
         labels = DEFAULT_LABELS
     
     try:
-        model, preprocess, device = get_clip_model()
-        get_cached_label_features(model, device, labels)
+        get_cached_label_features(labels)
         logger.info("Label embeddings cached")
     except Exception as e:
         logger.error(f"Failed to pre-cache labels: {e}")
@@ -427,20 +462,14 @@ def search_similar_tags(
         return []
     
     try:
-        model, preprocess, device = get_clip_model()
+        # Encode query (LRU cache shared with search, batched on miss)
+        query_features = encode_texts_cached([query.strip()])
         
-        # Tokenize and encode query
-        query_tokens = clip.tokenize([query.strip()]).to(device)
+        # Use cached label features
+        label_features = get_cached_label_features(labels)
         
-        with torch.no_grad():
-            query_features = model.encode_text(query_tokens)
-            query_features /= query_features.norm(dim=-1, keepdim=True)
-            
-            # Use cached label features
-            label_features = get_cached_label_features(model, device, labels)
-            
-            # Vectorized similarity computation
-            similarity = (query_features @ label_features.T).cpu().numpy()[0]
+        # Vectorized similarity computation
+        similarity = (query_features @ label_features.T)[0]
         
         # Efficient top-k selection
         if len(similarity) > top_k:
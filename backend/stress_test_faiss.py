@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Stress Test Script cho FAISS index (concurrency)
+
+Nhiều thread cùng add / remove / search / range search trên 1 project rồi
+kiểm tra: không có exception, index và folder map không lệch nhau, search
+không trả về asset đã bị xóa hẳn.
+
+Chạy trong thư mục backend (cần các biến môi trường của core.config):
+    python stress_test_faiss.py --threads 8 --seconds 10
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+import traceback
+from typing import Optional
+
+import numpy as np
+
+from services.search import faiss_index
+
+
+def random_vectors(rng: np.random.Generator, n: int) -> np.ndarray:
+    X = rng.standard_normal((n, faiss_index.DIM)).astype("float32")
+    return X / np.linalg.norm(X, axis=1, keepdims=True)
+
+
+class FaissStressTester:
+    """
+    Chạy writer/reader song song trên 1 project FAISS.
+    Asset có id chẵn chỉ được thêm (không bao giờ xóa), id lẻ bị thêm/xóa liên tục;
+    id >= REMOVED_BASE bị xóa hẳn từ đầu và không được xuất hiện trong kết quả.
+    """
+
+    REMOVED_BASE = 1_000_000
+
+    def __init__(self, project_id: int, initial: int, threads: int, seconds: float, folders: int, user_id: Optional[int] = None):
+        self.project_id = project_id
+        self.user_id = user_id
+        self.initial = initial
+        self.threads = threads
+        self.seconds = seconds
+        self.folders = folders
+        self.errors = []
+        self.counts = {"upsert": 0, "remove": 0, "search": 0, "range": 0}
+        self._counts_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _count(self, op: str):
+        with self._counts_lock:
+            self.counts[op] += 1
+
+    def setup(self):
+        rng = np.random.default_rng(0)
+        X = random_vectors(rng, self.initial)
+        data = [(i, i % self.folders, X[i].tolist()) for i in range(self.initial)]
+        faiss_index.rebuild_project_index(self.project_id, data)
+
+        # Asset bị xóa hẳn: thêm rồi xóa ngay trước khi chạy các thread
+        for i in range(50):
+            faiss_index.upsert_vector_to_project(
+                self.project_id, self.REMOVED_BASE + i, 0, random_vectors(rng, 1)[0]
+            )
+            faiss_index.remove_vector_from_project(self.project_id, self.REMOVED_BASE + i)
+
+    def _run(self, worker):
+        def target(seed: int):
+            rng = np.random.default_rng(seed)
+            try:
+                while not self._stop.is_set():
+                    worker(rng)
+            except Exception:
+                self.errors.append(traceback.format_exc())
+                self._stop.set()
+        return target
+
+    def writer(self, rng: np.random.Generator):
+        asset_id = int(rng.integers(0, self.initial * 2))
+        if asset_id % 2 == 1 and rng.random() < 0.5:
+            faiss_index.remove_vector_from_project(self.project_id, asset_id)
+            self._count("remove")
+        else:
+            faiss_index.upsert_vector_to_project(
+                self.project_id, asset_id, asset_id % self.folders, random_vectors(rng, 1)[0]
+            )
+            self._count("upsert")
+
+    def reader(self, rng: np.random.Generator):
+        q = random_vectors(rng, 1)[0]
+        folder_ids = [int(rng.integers(0, self.folders))] if rng.random() < 0.5 else None
+
+        if self.user_id is not None:
+            # Search qua tất cả project của user (composite index nếu FAISS_USER_COMPOSITE_INDEX)
+            results = faiss_index.search_user_projects(
+                self.user_id, [self.project_id], q, k=20, folder_ids=folder_ids, similarity_threshold=-1.0
+            )
+            self._count("search")
+        elif rng.random() < 0.8:
+            results = faiss_index.search_in_project(
+                self.project_id, q, k=20, similarity_threshold=-1.0, folder_ids=folder_ids
+            )
+            self._count("search")
+        else:
+            results = faiss_index.range_search_in_project(self.project_id, q, 0.1, folder_ids)
+            self._count("range")
+
+        for asset_id, _ in results:
+            if asset_id >= self.REMOVED_BASE:
+                raise AssertionError(f"Removed asset {asset_id} returned by search")
+            if folder_ids is not None and asset_id % self.folders != folder_ids[0]:
+                raise AssertionError(f"Asset {asset_id} outside folder {folder_ids[0]}")
+
+    def run(self):
+        workers = []
+        for i in range(self.threads):
+            # 1/4 số thread là writer, còn lại là reader
+            worker = self.writer if i % 4 == 0 else self.reader
+            workers.append(threading.Thread(target=self._run(worker), args=(i + 1,), daemon=True))
+
+        start = time.perf_counter()
+        for t in workers:
+            t.start()
+        self._stop.wait(self.seconds)
+        self._stop.set()
+        for t in workers:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        print(f"\n{'=' * 60}")
+        print(f"Ran {self.threads} threads for {elapsed:.1f}s")
+        for op, count in self.counts.items():
+            print(f"  {op:<7} {count:>8}  ({count / elapsed:.0f}/s)")
+
+    def check(self) -> bool:
+        with faiss_index._STATE_LOCK:
+            idx = faiss_index.PROJECT_INDICES[self.project_id]
+            folder_map = faiss_index.PROJECT_FOLDER_MAP[self.project_id]
+            live = idx.ntotal - faiss_index.faiss_policy.count_tombstones(idx)
+            if live != len(folder_map):
+                self.errors.append(f"Index has {live} live vectors but folder map has {len(folder_map)}")
+            if any(i in folder_map for i in range(self.REMOVED_BASE, self.REMOVED_BASE + 50)):
+                self.errors.append("Removed asset still in folder map")
+
+        stats = faiss_index.get_project_stats(self.project_id)
+        print(f"Index: {stats['index_type']}, {stats['total_vectors']} vectors, {stats.get('tombstones', 0)} tombstones")
+
+        if self.errors:
+            print(f"\n❌ {len(self.errors)} error(s):")
+            for error in self.errors[:5]:
+                print(error)
+            return False
+        print("\n✅ No errors")
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress test FAISS index concurrency")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--initial", type=int, default=5000)
+    parser.add_argument("--folders", type=int, default=10)
+    parser.add_argument("--user-search", action="store_true", help="Search qua search_user_projects thay vì từng project")
+    args = parser.parse_args()
+
+    # Không đụng vào faiss_indices thật
+    faiss_index.FAISS_INDEX_DIR = tempfile.mkdtemp(prefix="faiss-stress-")
+    print(f"Using index dir {faiss_index.FAISS_INDEX_DIR}")
+
+    tester = FaissStressTester(
+        project_id=1,
+        initial=args.initial,
+        threads=args.threads,
+        seconds=args.seconds,
+        folders=args.folders,
+        user_id=1 if args.user_search else None
+    )
+    tester.setup()
+    tester.run()
+    ok = tester.check()
+    os._exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+"""
+Array codec - Ma trận float32 <-> payload JSON (shape + bytes base64)
+
+Dùng chung cho vector server / client, faiss_sync và CLIP server / client.
+Chỉ cần NumPy: process gọi CLIP server không phải import FAISS.
+"""
+import base64
+
+import numpy as np
+
+
+def encode_array(arr: np.ndarray) -> dict:
+    """Ma trận float32 -> payload JSON (shape + bytes base64)."""
+    arr = np.ascontiguousarray(arr, dtype="float32")
+    return {"shape": list(arr.shape), "data": base64.b64encode(arr.tobytes()).decode("ascii")}
+
+
+def decode_array(payload: dict) -> np.ndarray:
+    """Payload từ encode_array -> ma trận float32."""
+    data = base64.b64decode(payload["data"])
+    return np.frombuffer(data, dtype="float32").reshape(payload["shape"]).copy()
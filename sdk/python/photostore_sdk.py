@@ -278,6 +278,99 @@ class PhotoStoreClient:
         
         return self._handle_response(response)
 
+    def search_batch(
+        self,
+        query_texts: Optional[List[str]] = None,
+        files: Optional[List[Union[str, Path, bytes, Any]]] = None,
+        k: int = 10,
+        folder_id: Optional[int] = None,
+        include_subfolders: bool = False,
+        similarity_threshold: float = 0.7
+    ) -> Dict[str, Any]:
+        """
+        Run many searches (text and/or image queries) in a single request
+        
+        All queries are encoded in one batch and searched with one vector
+        search on the server, which is much faster than calling search_image
+        once per query.
+        
+        Args:
+            query_texts: List of text queries (optional)
+            files: List of images as file paths, bytes or file-like objects (optional)
+            k: Maximum number of results per query (default: 10)
+            folder_id: Optional folder ID to search within
+            include_subfolders: Also search the subfolders of folder_id
+            similarity_threshold: Minimum similarity 0-1 for image queries (default: 0.7)
+        
+        Returns:
+            Dict with one entry per query in "data" (text queries first, then images),
+            each containing "query_index", "query_type" and its ranked "data"
+        
+        Example:
+            results = client.search_batch(
+                query_texts=["sunset beach", "red car"],
+                files=["query1.jpg", "query2.jpg"],
+                k=5
+            )
+            for query in results["data"]:
+                print(query["query_index"], [a["id"] for a in query["data"]])
+        """
+        if not query_texts and not files:
+            raise PhotoStoreException("Must provide at least query_texts or files")
+        
+        data = {
+            "k": k,
+            "similarity_threshold": similarity_threshold,
+            "include_subfolders": include_subfolders
+        }
+        if query_texts:
+            data["query_texts"] = list(query_texts)
+        if folder_id is not None:
+            data["folder_id"] = folder_id
+        
+        upload_files = []
+        opened_handles = []
+        
+        try:
+            for i, file in enumerate(files or []):
+                if isinstance(file, (str, Path)):
+                    path = Path(file)
+                    if not path.exists():
+                        raise PhotoStoreException(f"File not found: {path}")
+                    handle = open(path, "rb")
+                    opened_handles.append(handle)
+                    fname = path.name
+                elif isinstance(file, bytes):
+                    from io import BytesIO
+                    handle = BytesIO(file)
+                    opened_handles.append(handle)
+                    fname = f"image_{i}.jpg"
+                else:
+                    # Assume it's already a file-like object
+                    handle = file
+                    fname = getattr(file, "name", None) or f"image_{i}.jpg"
+                    fname = Path(str(fname)).name
+                
+                content_type = mimetypes.guess_type(fname)[0] or "image/jpeg"
+                upload_files.append(("files", (fname, handle, content_type)))
+            
+            response = requests.post(
+                f"{self.api_endpoint}/image/batch",
+                files=upload_files or None,
+                data=data,
+                headers=self._get_headers(),
+                timeout=self.timeout
+            )
+        finally:
+            # Close file handles we opened
+            for handle in opened_handles:
+                try:
+                    handle.close()
+                except:
+                    pass
+        
+        return self._handle_response(response)
+
     def get_asset(self, asset_id: int) -> Dict[str, Any]:
         """
         Get asset information by ID